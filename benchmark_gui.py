@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+界面响应基准测试 - 在虚拟 X 显示（Xvfb）中驱动 MarkdownConverterGUI
+
+按文档规模逐级加载输入文本，模拟按键、大段粘贴、切换输入规则和标签页，
+记录从事件发出到转换结果/预览重绘完成的延迟，以及期间主循环单次被阻塞的最长时间。
+
+用法：
+    python benchmark_gui.py --xvfb                     # 自动启动 Xvfb
+    xvfb-run -s "-screen 0 1600x1200x24" python benchmark_gui.py
+    python benchmark_gui.py --sizes 1000,10000 --json result.json
+
+每次运行使用临时 HOME 目录，不读取也不修改用户保存的规则配置，结果可重复。
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+import statistics
+import _tkinter
+
+# 默认逐级测试的文档行数
+DEFAULT_SIZES = (1000, 5000, 20000, 50000)
+
+# 中文数字编号只支持到九十九，生成文档时每一级同级标题的数量都控制在这个数以内
+MAX_SIBLINGS = 90
+
+# 生成文档使用的输入格式（与界面默认规则一致）
+HEADING_PREFIXES = {1: '（一）', 2: '- ', 3: '* ', 4: '1. '}
+
+PARAGRAPH_WORDS = ['转换', '格式', '标题', '内容', '**重点**', '说明', '`代码`', '数据', '示例', '段落']
+
+def generate_document(line_count, seed=0):
+    """生成约 line_count 行、含四级标题和正文段落的输入文本"""
+    rng = random.Random(seed)
+    section_lines = max(20, line_count // MAX_SIBLINGS)
+    counts = {level: 0 for level in HEADING_PREFIXES}
+    lines = []
+    while len(lines) < line_count:
+        if len(lines) % section_lines == 0:
+            level = 1
+        else:
+            level = rng.choice((2, 3, 4, 0, 0, 0, 0, 0))
+        if level and counts[level] < MAX_SIBLINGS:
+            counts[level] += 1
+            for lower in range(level + 1, 5):
+                counts[lower] = 0
+            lines.append(f"{HEADING_PREFIXES[level]}第{len(lines)}行标题")
+        else:
+            words = rng.choices(PARAGRAPH_WORDS, k=rng.randint(4, 20))
+            lines.append(''.join(words))
+            if rng.random() < 0.3:
+                lines.append('')
+    return '\n'.join(lines[:line_count])
+
+def start_xvfb(screen='1600x1200x24'):
+    """启动 Xvfb，由它自行选择空闲的显示编号；返回 (进程, DISPLAY)"""
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(
+        ['Xvfb', '-displayfd', str(write_fd), '-screen', '0', screen, '-nolisten', 'tcp'],
+        pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        number = f.readline().strip()
+    if not number:
+        process.kill()
+        raise RuntimeError("Xvfb 启动失败")
+    return process, f":{number}"
+
+def summarize(samples):
+    """延迟样本（秒）的统计结果（毫秒）"""
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'median_ms': round(statistics.median(ordered) * 1000, 2),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+class GuiBenchmark:
+    """驱动界面并测量事件到重绘完成的延迟"""
+
+    def __init__(self, gui_module, timeout=30.0):
+        self.gui_module = gui_module
+        self.tk = gui_module.tk
+        self.timeout = timeout
+        self.all_events = _tkinter.ALL_EVENTS | _tkinter.DONT_WAIT
+        self.idle_events = _tkinter.IDLE_EVENTS | _tkinter.DONT_WAIT
+
+        # 切换回转换页时若规则有变化会弹出询问框，基准测试中固定选择“保存”
+        gui_module.messagebox.askyesno = lambda *args, **kwargs: True
+
+        self.root = self.tk.Tk()
+        self.root.geometry('1400x900+0+0')
+        self.app = gui_module.MarkdownConverterGUI(self.root)
+        self.root.update()
+        self.converter_tab, self.rules_tab = self.app.notebook.tabs()[:2]
+        self.input_comboboxes = self.find_input_comboboxes()
+
+    def find_input_comboboxes(self):
+        """按绑定的变量找到各级输入格式下拉框"""
+        by_variable = {str(var): level for level, var in self.app.input_vars.items()}
+        found = {}
+        pending = [self.root]
+        while pending:
+            widget = pending.pop()
+            pending.extend(widget.winfo_children())
+            if isinstance(widget, self.gui_module.ttk.Combobox):
+                level = by_variable.get(str(widget.cget('textvariable')))
+                if level:
+                    found[level] = widget
+        return found
+
+    def pump(self, done):
+        """处理事件直到 done() 为真，再处理完剩余的重绘任务
+
+        返回期间单个事件处理的最长耗时，即主循环无法响应的最长时间。
+        """
+        deadline = time.perf_counter() + self.timeout
+        longest = 0.0
+        while True:
+            started = time.perf_counter()
+            handled = self.root.tk.dooneevent(self.all_events)
+            longest = max(longest, time.perf_counter() - started)
+            if done():
+                break
+            if not handled:
+                if time.perf_counter() > deadline:
+                    raise TimeoutError("等待界面重绘超时")
+                time.sleep(0.0005)
+        while True:
+            started = time.perf_counter()
+            handled = self.root.tk.dooneevent(self.idle_events)
+            longest = max(longest, time.perf_counter() - started)
+            if not handled:
+                return longest
+
+    def measure(self, action, target):
+        """执行 action（通常是发出事件），等待 target 文本框内容更新并重绘完成
+
+        返回 (延迟, 最长阻塞)，单位为秒。
+        """
+        self.pump(lambda: True)
+        target.edit_modified(False)
+        started = time.perf_counter()
+        action()
+        stall = self.pump(lambda: target.edit_modified())
+        return time.perf_counter() - started, stall
+
+    def send_key(self, widget, keysym, state=0):
+        widget.event_generate('<KeyPress>', keysym=keysym, state=state, when='tail')
+        widget.event_generate('<KeyRelease>', keysym=keysym, state=state, when='tail')
+
+    def load_document(self, text):
+        """把文档放入输入框并点击刷新，返回首次转换的 (延迟, 最长阻塞)"""
+        self.app.notebook.select(self.converter_tab)
+        self.pump(lambda: True)
+        input_text = self.app.input_text
+        input_text.delete('1.0', 'end')
+        input_text.insert('1.0', text)
+        result = self.measure(self.app.refresh_btn.invoke, self.app.output_text)
+        # 光标放在文档中间，模拟在长文档中编辑
+        middle = int(input_text.index('end-1c').split('.')[0]) // 2
+        input_text.mark_set('insert', f'{middle}.0')
+        return result
+
+    def focus_input(self):
+        """合成的按键事件只会送到拥有焦点的窗口"""
+        self.app.notebook.select(self.converter_tab)
+        self.app.input_text.focus_force()
+        self.pump(lambda: True)
+
+    def bench_typing(self, keystrokes):
+        input_text = self.app.input_text
+        self.focus_input()
+        results = []
+        for k in range(keystrokes):
+            keysym = 'a' if k % 8 else 'Return'
+            results.append(self.measure(lambda: self.send_key(input_text, keysym), self.app.output_text))
+        return results
+
+    def bench_paste(self, block, repeats):
+        """通过 Ctrl+V 粘贴大段文本（与用户操作相同的按键路径）"""
+        input_text = self.app.input_text
+        self.focus_input()
+        self.root.clipboard_clear()
+        self.root.clipboard_append(block)
+        control = 0x0004
+        return [self.measure(lambda: self.send_key(input_text, 'v', control), self.app.output_text)
+                for _ in range(repeats)]
+
+    def bench_rule_switch(self, level, values, repeats):
+        """在规则页切换某一级输入格式，测量预览更新"""
+        self.app.notebook.select(self.rules_tab)
+        self.pump(lambda: True)
+        combobox = self.input_comboboxes[level]
+        results = []
+        for k in range(repeats):
+            def select(value=values[k % len(values)]):
+                combobox.set(value)
+                combobox.event_generate('<<ComboboxSelected>>', when='tail')
+            results.append(self.measure(select, self.app.preview_after_text))
+        return results
+
+    def bench_tab_switch(self, level, values, repeats):
+        """改动规则后切回转换页，测量转换结果重新生成（包含界面中 100ms 的延后执行）"""
+        results = []
+        combobox = self.input_comboboxes[level]
+        for k in range(repeats):
+            self.app.notebook.select(self.rules_tab)
+            self.pump(lambda: True)
+            # 必须选一个与当前不同的格式，否则切回转换页时不会重新转换
+            combobox.set(next(value for value in values if value != combobox.get()))
+            combobox.event_generate('<<ComboboxSelected>>', when='tail')
+            self.pump(lambda: True)
+            results.append(self.measure(lambda: self.app.notebook.select(self.converter_tab),
+                                        self.app.output_text))
+        return results
+
+    def run(self, sizes, keystrokes=20, repeats=5, seed=0):
+        display = self.gui_module.INPUT_FORMAT_OPTIONS
+        level2_values = [name for name, internal in display if internal in ('dash', 'number_paren')]
+        paste_block = generate_document(500, seed + 1)
+        report = []
+        for size in sizes:
+            entry = {'lines': size}
+            samples = {'load': [self.load_document(generate_document(size, seed))]}
+            samples['keystroke'] = self.bench_typing(keystrokes)
+            samples['paste'] = self.bench_paste(paste_block, repeats)
+            samples['rule_switch'] = self.bench_rule_switch('level2', level2_values, repeats)
+            samples['tab_switch'] = self.bench_tab_switch('level2', level2_values, repeats)
+            for name, results in samples.items():
+                stats = summarize([latency for latency, _ in results])
+                stats['max_stall_ms'] = round(max(stall for _, stall in results) * 1000, 2)
+                entry[name] = stats
+            report.append(entry)
+            print(format_entry(entry), file=sys.stderr)
+        return report
+
+    def close(self):
+        self.root.destroy()
+
+SCENARIOS = ('load', 'keystroke', 'paste', 'rule_switch', 'tab_switch')
+
+def format_entry(entry):
+    parts = [f"{entry['lines']:>7} 行"]
+    for name in SCENARIOS:
+        stats = entry[name]
+        parts.append(f"{name} 中位 {stats['median_ms']}ms / 最长阻塞 {stats['max_stall_ms']}ms")
+    return ' | '.join(parts)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Markdown中文格式转换器界面响应基准测试")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="逐级测试的文档行数，逗号分隔")
+    parser.add_argument('--keystrokes', type=int, default=20, help="每个规模模拟的按键次数")
+    parser.add_argument('--repeats', type=int, default=5, help="粘贴和切换操作的重复次数")
+    parser.add_argument('--seed', type=int, default=0, help="生成文档的随机种子")
+    parser.add_argument('--timeout', type=float, default=30.0, help="等待单次重绘的超时（秒）")
+    parser.add_argument('--xvfb', action='store_true', help="自动启动 Xvfb 作为显示")
+    parser.add_argument('--json', help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+    try:
+        args.sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    except ValueError:
+        parser.error(f"无效的文档行数：{args.sizes}")
+    return args
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    xvfb = None
+    if args.xvfb:
+        xvfb, os.environ['DISPLAY'] = start_xvfb()
+    elif not os.environ.get('DISPLAY'):
+        print("没有可用的显示，请使用 --xvfb 或 xvfb-run 运行", file=sys.stderr)
+        return 2
+
+    # 界面在导入时确定配置路径，先切换到临时 HOME 再导入
+    with tempfile.TemporaryDirectory(prefix='md_gui_bench_') as home:
+        os.environ['HOME'] = home
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import markdown_gui_custom
+
+        benchmark = GuiBenchmark(markdown_gui_custom, timeout=args.timeout)
+        try:
+            report = benchmark.run(args.sizes, args.keystrokes, args.repeats, args.seed)
+        finally:
+            benchmark.close()
+            if xvfb:
+                xvfb.terminate()
+                xvfb.wait()
+
+    result = {
+        'python': sys.version.split()[0],
+        'tk': markdown_gui_custom.tk.TkVersion,
+        'seed': args.seed,
+        'results': report,
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
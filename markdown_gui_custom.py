@@ -6,14 +6,432 @@ Markdown中文格式转换器 - 用户友好版（优化布局）
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, font
+from tkinter import ttk, messagebox, scrolledtext, font, filedialog
 import re
 import json
 import os
 import platform
+import sys
+import time
+import select
+import struct
+import hashlib
+import argparse
+import random
+import io
+import codecs
+import contextlib
+import ctypes
+import ctypes.util
+import tempfile
+import zipfile
+import gzip
+import tarfile
+import shutil
+import html
+import multiprocessing
+import threading
+import queue
+import signal
+import socket
+import cProfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+# NumPy 为可选依赖，仅用于大文档的行分类预扫描
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from array import array
+from collections import namedtuple, OrderedDict, deque
+
+# 输入格式选项（显示名称, 内部名称）
+INPUT_FORMAT_OPTIONS = [
+    ('不使用', ''),
+    ('#### 标题', 'markdown_h4'),
+    ('### 标题', 'markdown_h3'),
+    ('## 标题', 'markdown_h2'),
+    ('# 标题', 'markdown_h1'),
+    ('（一）标题', 'chinese_paren'),
+    ('一、标题', 'chinese_dot'),
+    ('(1)标题', 'number_paren'),
+    ('1、标题', 'number_dot'),
+    ('1. 标题', 'number_period'),
+    ('(A)标题', 'letter_paren'),
+    ('A. 标题', 'letter_period'),
+    ('(a)标题', 'letter_paren_lower'),
+    ('- 标题', 'dash'),
+    ('* 标题', 'asterisk'),
+    ('（Ⅰ）标题', 'roman_paren'),
+    ('Ⅰ、标题', 'roman_dot'),
+]
+
+# 输出格式选项
+OUTPUT_FORMAT_OPTIONS = {
+    'level1': {
+        'label': '一级标题输出',
+        'options': [
+            ('一、二、三、', 'chinese'),
+            ('1、2、3、', 'number'),
+            ('Ⅰ、Ⅱ、Ⅲ、', 'roman')
+        ],
+        'default': 'chinese'
+    },
+    'level2': {
+        'label': '二级标题输出',
+        'options': [
+            ('（一）（二）（三）', 'chinese_paren'),
+            ('(1)(2)(3)', 'number_paren'),
+            ('(A)(B)(C)', 'letter_paren')
+        ],
+        'default': 'chinese_paren'
+    },
+    'level3': {
+        'label': '三级标题输出',
+        'options': [
+            ('1. 2. 3.', 'number_dot'),
+            ('A. B. C.', 'letter_dot'),
+            ('一. 二. 三.', 'chinese_dot')
+        ],
+        'default': 'number_dot'
+    },
+    'level4': {
+        'label': '四级标题输出',
+        'options': [
+            ('(1)(2)(3)', 'number_paren'),
+            ('(a)(b)(c)', 'letter_paren'),
+            ('（一）（二）（三）', 'chinese_paren')
+        ],
+        'default': 'number_paren'
+    }
+}
+
+# 默认输入规则（与界面默认值一致）
+DEFAULT_INPUT_RULES = {
+    'level1': 'chinese_paren',
+    'level2': 'dash',
+    'level3': 'asterisk',
+    'level4': 'number_period'
+}
+
+# 规则预设（界面中的预设按钮和管道模式的 preset 共用）
+RULE_PRESETS = [
+    {
+        'name': '标准文档格式',
+        'description': '一、（一）1. (1)',
+        'input': {
+            'level1': '（一）标题',
+            'level2': '1、标题',
+            'level3': '- 标题',
+            'level4': '* 标题'
+        },
+        'output': {
+            'level1': '一、标题',
+            'level2': '（一）标题',
+            'level3': '1. 标题',
+            'level4': '(1)标题'
+        }
+    },
+    {
+        'name': 'Markdown转中文',
+        'description': '#### → 一、',
+        'input': {
+            'level1': '#### 标题',
+            'level2': '### 标题',
+            'level3': '## 标题',
+            'level4': '# 标题'
+        },
+        'output': {
+            'level1': '一、标题',
+            'level2': '（一）标题',
+            'level3': '1. 标题',
+            'level4': '(1)标题'
+        }
+    },
+    {
+        'name': '全数字格式',
+        'description': '1、(1)1. (a)',
+        'input': {
+            'level1': '（一）标题',
+            'level2': '- 标题',
+            'level3': '* 标题',
+            'level4': '1. 标题'
+        },
+        'output': {
+            'level1': '1、标题',
+            'level2': '(1)标题',
+            'level3': '1. 标题',
+            'level4': '(a)标题'
+        }
+    }
+]
+
+# 预设中的输出格式写法与输出下拉框显示名称的对应关系
+PRESET_OUTPUT_NAMES = {
+    'level1': {
+        '一、标题': '一、二、三、',
+        '1、标题': '1、2、3、',
+        'Ⅰ、标题': 'Ⅰ、Ⅱ、Ⅲ、'
+    },
+    'level2': {
+        '（一）标题': '（一）（二）（三）',
+        '(1)标题': '(1)(2)(3)',
+        '(A)标题': '(A)(B)(C)'
+    },
+    'level3': {
+        '1. 标题': '1. 2. 3.',
+        'A. 标题': 'A. B. C.',
+        '一. 标题': '一. 二. 三.'
+    },
+    'level4': {
+        '(1)标题': '(1)(2)(3)',
+        '(a)标题': '(a)(b)(c)',
+        '（一）标题': '（一）（二）（三）'
+    }
+}
+
+# 默认配置文件路径（与界面共用）
+DEFAULT_CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".markdown_converter", "config.json")
+
+# 批量/监视模式下需要转换的文件扩展名
+CONVERTIBLE_EXTENSIONS = ('.md', '.markdown', '.txt')
+
+# 透明解压的单文件压缩后缀（如 .md.gz），以及按成员逐个读取的归档格式
+COMPRESSED_SUFFIX = '.gz'
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# 写入归档时单个成员先在内存中缓冲，超过该大小后转存临时文件
+ARCHIVE_SPOOL_SIZE = 8 * 1024 * 1024
+
+# 并行模式下，文件达到该大小才按标题行分片；每个分片不小于 PARALLEL_MIN_SHARD
+PARALLEL_MIN_SIZE = 16 * 1024 * 1024
+PARALLEL_MIN_SHARD = 4 * 1024 * 1024
+
+# 流式读取时每块的字符数；编码识别时读取的字节样本大小
+STREAM_BLOCK_CHARS = 4 * 1024 * 1024
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# 行分类预扫描的结果：空行、普通正文行、需要逐行完整处理的行（可能是标题、列表、分隔线等）
+LINE_BLANK = 0
+LINE_PLAIN = 1
+LINE_FULL = 2
+
+# 文本达到该行数才使用 NumPy 预扫描
+NUMPY_MIN_LINES = 2000
+
+# 界面中打开文件时每次交给文本框的字符数，以及每次定时回调最多占用主线程的时间（秒）
+GUI_LOAD_CHUNK_CHARS = 256 * 1024
+GUI_TASK_TIME_SLICE = 0.02
+
+# 规则页用当前文档预览时取的行数：文档开头的行数，以及光标前后各取的行数
+PREVIEW_HEAD_LINES = 30
+PREVIEW_CONTEXT_LINES = 40
+
+# 按一级标题分节输出时文件名中标题部分的最大字符数，以及第一个一级标题之前内容的文件名
+SECTION_NAME_MAX_CHARS = 60
+SECTION_PREAMBLE_NAME = '前言'
+
+# 诊断模式：主循环心跳间隔（毫秒）、心跳迟到多久记为一次卡顿、延迟直方图的分桶上界（毫秒）
+STALL_HEARTBEAT_MS = 50
+STALL_THRESHOLD_MS = 200
+STALL_HISTOGRAM_BOUNDS = (16, 50, 100, 200, 500, 1000)
+STALL_LOG_NAME = 'stall.log'
+
+# 性能分析：采样线程的采样间隔（秒），以及界面中隐藏开关写出分析结果的子目录
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_DIR_NAME = 'profiles'
+
+# 命令行输出格式及对应的文件扩展名
+OUTPUT_FILE_SUFFIXES = {'text': '.txt', 'html': '.html', 'docx': '.docx'}
+
+# 全角 ASCII 字符（！到～）和全角空格到半角的映射；逐字符一一对应，转换后字符串长度不变
+WIDTH_NORMALIZE_TABLE = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+WIDTH_NORMALIZE_TABLE[0x3000] = 0x20
+
+# 输入规则中的选项（不是标题级别）：为 True 时先统一全角/半角再匹配标题
+NORMALIZE_WIDTH_KEY = 'normalize_width'
+# 输入规则中的选项：保留不清理的 Markdown 清理阶段，值为逗号分隔、排好序的阶段名
+CLEAN_KEEP_KEY = 'keep_markdown'
+RULE_OPTION_KEYS = (NORMALIZE_WIDTH_KEY, CLEAN_KEEP_KEY)
+
+# 正文和标题的清理步骤，按执行顺序排列：(阶段名, 正则, 替换)；
+# 关闭某个阶段只是去掉它的步骤，其余步骤的相对顺序不变
+CLEAN_STEPS = [
+    ('heading', r'^#+\s*', ''),                  # 标题符号 (# 开头)
+    ('separator', r'^\s*[-*]{3,}\s*$', ''),       # 分隔线 (--- 或 ***)
+    ('list', r'^[-*+]+\s+', ''),                  # 列表符号 (- * + 开头)
+    ('list', r'^\d+\.\s+', ''),                   # 数字列表 (1. 2. 等开头)
+    ('emphasis', r'\*\*(.*?)\*\*', r'\1'),          # 粗体 **text**
+    ('emphasis', r'\*(.*?)\*', r'\1'),              # 斜体 *text*
+    ('emphasis', r'__(.*?)__', r'\1'),              # 粗体 __text__
+    ('emphasis', r'_(.*?)_', r'\1'),                # 斜体 _text_
+    ('code', r'`(.*?)`', r'\1'),                    # 行内代码 `code`
+    ('link', r'\[(.*?)\]\(.*?\)', r'\1'),           # 链接 [text](url)
+    ('image', r'!\[(.*?)\]\(.*?\)', r'\1'),         # 图片 ![alt](url)
+    ('quote', r'^>\s+', ''),                      # 引用符号 (> 开头)
+    ('heading', r'^###\s+', ''),                  # 三个井号标记 (### 开头)
+    ('emphasis', r'^\*\*', ''),                    # 开头的两个星号
+    ('emphasis', r'\*\*$', ''),                    # 结尾的两个星号
+    ('emphasis', r'\*\*(.*?)\*\*', r'\1'),          # 行内剩余的粗体
+    ('emphasis', r'\*\*\s*$', ''),                 # 行末的星号
+    ('emphasis', r'\*$', ''),                      # 单个星号结尾
+    ('stray', r'[#*]+', ''),                       # 所有剩余的 # 和 *
+]
+
+# 逐行清理结果的 LRU 缓存条目数，以及参与缓存的最长行（更长的行很少重复，不占用缓存）
+CLEAN_MEMO_SIZE = 8192
+CLEAN_MEMO_MAX_LINE = 512
+
+# 界面中可开关的清理阶段（阶段名, 显示名称）
+CLEAN_STAGES = [
+    ('emphasis', '粗体/斜体'),
+    ('link', '链接'),
+    ('image', '图片'),
+    ('code', '行内代码'),
+    ('quote', '引用'),
+    ('list', '列表符号'),
+    ('heading', '标题 #'),
+    ('separator', '分隔线'),
+    ('stray', '残留 # *'),
+]
+
+# 保留的链接、图片、行内代码在其他清理步骤执行前先整体换成占位符，清理后再放回原文
+CLEAN_PROTECT_PATTERNS = {
+    'image': r'!\[[^\]]*\]\([^)]*\)',
+    'link': r'(?<!!)\[[^\]]*\]\([^)]*\)',
+    'code': r'`[^`]*`',
+}
+
+# 保留的标题符号、列表符号和强调符号只把符号本身换成占位符（其中的文字照常清理），
+# 否则最后的 stray 步骤仍会删掉所有 # 和 *
+CLEAN_PROTECT_MARKERS = {
+    'heading': r'^\s*#+',
+    'list': r'^\s*(?:[-*+]+|\d+\.)(?=\s)',
+}
+CLEAN_PROTECT_EMPHASIS = r'(\*\*|__|\*|_)(.*?)\1'
+
+# 转换器产出的单行事件：kind 为 'title' 或 'text'，title 为清理后的标题文字
+LineEvent = namedtuple('LineEvent', 'kind level text title start end')
+
+# 大纲模式的标题记录：number 为生成的编号前缀，title 为清理后的标题文字，line 为源行号（从 1 开始）
+OutlineEntry = namedtuple('OutlineEntry', 'level number title line')
+
+# 检查模式发现的不一致标题：line 为源行号（从 1 开始），expected 为转换后应有的标题行，actual 为原标题行
+CheckViolation = namedtuple('CheckViolation', 'line level expected actual')
+
+def build_cleaner(keep=()):
+    """生成只包含启用阶段的清理函数；keep 为保留（不清理）的阶段名
+    
+    关闭的阶段在生成时就被去掉，逐行清理时没有任何额外判断；
+    保留链接、图片或行内代码时，这些片段先换成占位符，避免被其他阶段改动；
+    保留标题、列表或强调时，只有这些符号换成占位符，不会被最后的 stray 步骤删掉。
+    """
+    keep = set(keep)
+    steps = [(re.compile(pattern).sub, repl) for stage, pattern, repl in CLEAN_STEPS if stage not in keep]
+    protected = [CLEAN_PROTECT_PATTERNS[stage] for stage in ('image', 'link', 'code') if stage in keep]
+    markers = [re.compile(CLEAN_PROTECT_MARKERS[stage]).sub for stage in ('heading', 'list') if stage in keep]
+    emphasis_sub = re.compile(CLEAN_PROTECT_EMPHASIS).sub if 'emphasis' in keep else None
+    
+    if not protected and not markers and emphasis_sub is None:
+        def clean(text):
+            for sub, repl in steps:
+                text = sub(repl, text)
+            return text.strip()
+        return clean
+    
+    protect_sub = re.compile('|'.join(protected)).sub if protected else None
+    restore_sub = re.compile('\ue000(\\d+)\ue001').sub
+    
+    def clean(text):
+        spans = []
+        
+        def stash(match):
+            spans.append(match.group())
+            return f'\ue000{len(spans) - 1}\ue001'
+        
+        def stash_delimiters(match):
+            # 成对的强调符号各换成一个占位符，中间的文字留给其余步骤清理
+            spans.append(match.group(1))
+            opening = f'\ue000{len(spans) - 1}\ue001'
+            spans.append(match.group(1))
+            return f'{opening}{match.group(2)}\ue000{len(spans) - 1}\ue001'
+        
+        if protect_sub is not None:
+            text = protect_sub(stash, text)
+        for marker_sub in markers:
+            text = marker_sub(stash, text, count=1)
+        if emphasis_sub is not None:
+            text = emphasis_sub(stash_delimiters, text)
+        for sub, repl in steps:
+            text = sub(repl, text)
+        if spans:
+            text = restore_sub(lambda match: spans[int(match.group(1))], text)
+        return text.strip()
+    return clean
+
+def clean_keep_value(stages):
+    """把保留的清理阶段（列表或逗号分隔的字符串）规范为输入规则中的取值，没有保留时返回 None"""
+    if isinstance(stages, str):
+        stages = [stage.strip() for stage in stages.split(',')]
+    stages = sorted(set(filter(None, stages)))
+    known = {stage for stage, _ in CLEAN_STAGES}
+    unknown = [stage for stage in stages if stage not in known]
+    if unknown:
+        raise ValueError(f"未知的清理阶段：{', '.join(unknown)}")
+    return ','.join(stages) or None
+
+class LineMemo:
+    """有界 LRU 缓存：按 (清理配置, 行) 记住逐行清理的结果，并统计命中率
+    
+    公文、报告中大量重复的行（“**发布机构**：”之类的标签、免责声明、落款、表头）
+    只需清理一次。同一个实例可以由批量转换中的多个文档、多个转换器共用。
+    """
+    
+    def __init__(self, maxsize=CLEAN_MEMO_SIZE, max_line=CLEAN_MEMO_MAX_LINE):
+        self.maxsize = maxsize
+        self.max_line = max_line
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def wrap(self, namespace, func):
+        """返回带缓存的 func；namespace 区分不同的清理配置"""
+        entries = self.entries
+        touch = entries.move_to_end
+        maxsize, max_line = self.maxsize, self.max_line
+        
+        def memoized(text):
+            if len(text) > max_line:
+                return func(text)
+            key = (namespace, text)
+            try:
+                result = entries[key]
+            except KeyError:
+                self.misses += 1
+                result = entries[key] = func(text)
+                if len(entries) > maxsize:
+                    entries.popitem(last=False)
+                return result
+            self.hits += 1
+            touch(key)
+            return result
+        return memoized
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+    
+    def summary(self):
+        stats = self.stats()
+        return (f"清理缓存：命中 {stats['hits']} / {stats['hits'] + stats['misses']} 次"
+                f"（{stats['hit_rate']:.1%}），缓存 {stats['size']} 行")
 
 class MarkdownConverter:
-    def __init__(self):
+    def __init__(self, clean_memo=None):
+        """clean_memo 为逐行清理缓存（LineMemo），批量转换时可在多个转换器之间共用；不给出时新建一个"""
         self.chinese_numbers = ['一', '二', '三', '四', '五', '六', '七', '八', '九', '十']
         self.roman_numbers = ['Ⅰ', 'Ⅱ', 'Ⅲ', 'Ⅳ', 'Ⅴ', 'Ⅵ', 'Ⅶ', 'Ⅷ', 'Ⅸ', 'Ⅹ']
         self.reset_counters()
@@ -39,6 +457,67 @@ class MarkdownConverter:
             'roman_dot': {'pattern': r'^([ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]+)、\s*(.+)$', 'name': 'Ⅰ、标题'},
             'plain_text': {'pattern': r'^(.+)$', 'name': '普通文本（匹配所有）'}
         }
+        
+        # 统一全角/半角后使用的标题格式：括号只需写半角形式，全角、半角及混写的括号都能匹配
+        self.normalized_title_patterns = dict(self.title_patterns)
+        self.normalized_title_patterns.update({
+            'chinese_paren': {'pattern': r'^\(([一二三四五六七八九十]+)\)\s*(.+)$', 'name': '（一）标题'},
+            'roman_paren': {'pattern': r'^\(([ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]+)\)\s*(.+)$', 'name': '（Ⅰ）标题'},
+        })
+        
+        # 统一全角/半角后清理标题编号用的正则（与 clean_existing_title_numbers 依次对应，只需半角形式）；
+        # 不带 ^，用 match(文本, 起点) 依次从上一步的结束位置开始匹配
+        self._normalized_number_res = [re.compile(pattern) for pattern in (
+            r'[#*\s]*[一二三四五六七八九十]+[、.]\s*',
+            r'[#*\s]*[0-9]+[、.]\s*',
+            r'[#*\s]*[ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]+[、.]\s*',
+            r'[#*\s]*\([一二三四五六七八九十0-9ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩa-zA-Z]+\)\s*',
+            r'[#*\s]*[A-Za-z]\.\s*',
+            r'[#*\s]*[一二三四五六七八九十]+\s+',
+            r'[#*\s]*[0-9]+\s+',
+            r'[#*\s]*[A-Za-z]+\s+',
+            r'#+\s*',
+        )]
+        
+        # 重新编号模式去掉标题中已有编号用的正则：同上，但不吃掉 Markdown 符号（# 和 *），
+        # 也不去掉开头的英文单词，只去编号
+        self._renumber_number_res = [re.compile(pattern) for pattern in (
+            r'\s*[一二三四五六七八九十]+[、.]\s*',
+            r'\s*[0-9]+[、.]\s*',
+            r'\s*[ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]+[、.]\s*',
+            r'\s*\([一二三四五六七八九十0-9ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩa-zA-Z]+\)\s*',
+            r'\s*[A-Za-z]\.\s*',
+            r'\s*[一二三四五六七八九十]+\s+',
+            r'\s*[0-9]+\s+',
+        )]
+        
+        # 各格式可能的行首字符（正则字符集写法），用于预扫描时排除不可能是标题的行；
+        # None 表示可以匹配任意行。Markdown 标题按 # 的个数单独判断
+        self.pattern_leads = {
+            'chinese_paren': '（',
+            'chinese_dot': '一二三四五六七八九十',
+            'number_paren': r'\(',
+            'number_dot': r'\d',
+            'number_period': r'\d',
+            'letter_paren': r'\(',
+            'letter_period': 'A-Z',
+            'letter_paren_lower': r'\(',
+            'dash': r'\-',
+            'asterisk': r'\*',
+            'roman_paren': '（',
+            'roman_dot': 'ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ',
+            'plain_text': None,
+        }
+        self.use_numpy = np is not None
+        self._rule_cache = {}
+        self._lead_cache = {}
+        self._heading_filter_cache = {}
+        self.clean_memo = clean_memo if clean_memo is not None else LineMemo()
+        self._cleaner_cache = {}
+        self._title_cleaner_cache = {}
+        self._full_cleaner = self.cleaner_for({})
+        self._separator_re = re.compile(r'^\s*[-*]{3,}\s*$')
+        self._list_item_re = re.compile(r'^([-*+]|\d+\.|[a-zA-Z]\.)\s+')
     
     def reset_counters(self):
         self.counters = {
@@ -65,42 +544,56 @@ class MarkdownConverter:
             title = re.sub(pattern, '', title)
         return title.strip()
     
+    def clean_normalized_title_numbers(self, title):
+        """clean_existing_title_numbers 的全角/半角统一版本
+        
+        在统一后的文本上匹配编号前缀，再按相同长度从原文中截掉，标题文字保留原有的全角字符。
+        """
+        normalized = title.translate(WIDTH_NORMALIZE_TABLE)
+        start = 0
+        for regex in self._normalized_number_res:
+            match = regex.match(normalized, start)
+            if match:
+                start = match.end()
+        return title[start:].strip()
+    
+    def strip_title_number(self, title):
+        """重新编号模式：去掉标题开头已有的编号，保留其余文字和 Markdown 符号
+        
+        在统一全角/半角后的文本上匹配，全角、半角的编号都能去掉，标题文字保留原样。
+        """
+        normalized = title.translate(WIDTH_NORMALIZE_TABLE)
+        start = 0
+        for regex in self._renumber_number_res:
+            match = regex.match(normalized, start)
+            if match:
+                start = match.end()
+        return title[start:]
+    
     def clean_markdown_symbols(self, text):
-        """清除Markdown符号，保留文本内容"""
-        # 清除标题符号 (# 开头)
-        text = re.sub(r'^#+\s*', '', text)
-        # 清除分隔线 (--- 或 ***)
-        text = re.sub(r'^\s*[-*]{3,}\s*$', '', text)
-        # 清除列表符号 (- * + 开头)
-        text = re.sub(r'^[-*+]+\s+', '', text)
-        # 清除数字列表 (1. 2. 等开头)
-        text = re.sub(r'^\d+\.\s+', '', text)
-        # 清除粗体和斜体标记 (** * __ _)
-        text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # 粗体 **text**
-        text = re.sub(r'\*(.*?)\*', r'\1', text)      # 斜体 *text*
-        text = re.sub(r'__(.*?)__', r'\1', text)      # 粗体 __text__
-        text = re.sub(r'_(.*?)_', r'\1', text)        # 斜体 _text_
-        # 清除反引号代码块 (`code`)
-        text = re.sub(r'`(.*?)`', r'\1', text)
-        # 清除链接 [text](url)
-        text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', text)
-        # 清除图片 ![alt](url)
-        text = re.sub(r'!\[(.*?)\]\(.*?\)', r'\1', text)
-        # 清除引用符号 (> 开头)
-        text = re.sub(r'^>\s+', '', text)
-        # 清除三个井号标记 (### 开头)
-        text = re.sub(r'^###\s+', '', text)
-        # 清除两个星号标记 (**开头或结尾)
-        text = re.sub(r'^\*\*', '', text)
-        text = re.sub(r'\*\*$', '', text)
-        # 清除行内的星号标记
-        text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-        # 清除行末的星号标记
-        text = re.sub(r'\*\*\s*$', '', text)
-        text = re.sub(r'\*$', '', text)  # 清除单个星号结尾
-        # 清除所有剩余的#和*
-        text = re.sub(r'[#*]+', '', text)
-        return text.strip()
+        """清除Markdown符号，保留文本内容（启用全部清理阶段）"""
+        return self._full_cleaner(text)
+    
+    def cleaner_for(self, input_rules):
+        """按输入规则中保留的清理阶段取专用的正文清理函数（带逐行缓存），结果会被缓存"""
+        keep = input_rules.get(CLEAN_KEEP_KEY) or ''
+        cleaner = self._cleaner_cache.get(keep)
+        if cleaner is None:
+            cleaner = build_cleaner(keep.split(',') if keep else ())
+            cleaner = self._cleaner_cache[keep] = self.clean_memo.wrap(('text', keep), cleaner)
+        return cleaner
+    
+    def title_cleaner_for(self, input_rules):
+        """标题清理函数：先清理 Markdown 符号再去掉已有编号（带逐行缓存），结果会被缓存"""
+        keep = input_rules.get(CLEAN_KEEP_KEY) or ''
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        cleaner = self._title_cleaner_cache.get((keep, normalize))
+        if cleaner is None:
+            clean = build_cleaner(keep.split(',') if keep else ())
+            clean_numbers = self.clean_normalized_title_numbers if normalize else self.clean_existing_title_numbers
+            cleaner = self.clean_memo.wrap(('title', keep, normalize), lambda title: clean_numbers(clean(title)))
+            self._title_cleaner_cache[(keep, normalize)] = cleaner
+        return cleaner
     
     def get_chinese_number(self, num):
         if num <= 10:
@@ -177,15 +670,13 @@ class MarkdownConverter:
         
         return prefix + title
     
-    def convert_text(self, text, input_rules, output_formats):
-        """转换整个文本"""
-        lines = text.split('\n')
-        converted_lines = []
-        self.reset_counters()
-        current_paragraph = []
-        list_indent_level = 0
-        in_list = False
-        last_line_was_title = False
+    def sort_rules(self, input_rules):
+        """把输入规则整理为按匹配优先级排序的 [(级别, 编译后的正则)]，结果会被缓存"""
+        key = tuple(input_rules.items())
+        rules = self._rule_cache.get(key)
+        title_patterns = self.normalized_title_patterns if input_rules.get(NORMALIZE_WIDTH_KEY) else self.title_patterns
+        if rules is not None:
+            return rules
         
         # 创建一个按特定规则排序的规则列表
         # 1. 优先处理markdown标题，按#数量从多到少排序（即从低级别到高级别）
@@ -211,88 +702,920 @@ class MarkdownConverter:
             sorted_rules.append((rule[0], rule[1]))
         sorted_rules.extend(other_rules)
         
-        for i, line in enumerate(lines):
-            original_line = line.strip()
-            # 跳过分隔线
-            if re.match(r'^\s*[-*]{3,}\s*$', original_line):
-                continue
-            if not original_line:
-                if current_paragraph:
-                    converted_lines.append(' '.join(current_paragraph))
-                    current_paragraph = []
-                if in_list:
-                    in_list = False
-                    list_indent_level = 0
-                continue
-            
-            matched = False
-            # 使用排序后的规则列表
-            for level_name, pattern_key in sorted_rules:
-                if pattern_key in self.title_patterns:
-                    pattern = self.title_patterns[pattern_key]['pattern']
-                    match = re.match(pattern, original_line)
-                    if match:
-                        if current_paragraph:
-                            converted_lines.append(' '.join(current_paragraph))
-                            current_paragraph = []
-                        in_list = False
-                        list_indent_level = 0
-                                                # 提取标题内容 - 处理不同的匹配组
-                        if len(match.groups()) == 1:
-                            title = match.group(1).strip()
-                        elif len(match.groups()) == 2:
-                            title = match.group(2).strip()
-                        else:
-                            title = match.group(-1).strip()
-                        # 先去Markdown符号，再去编号
-                        clean_title = self.clean_markdown_symbols(title)
-                        clean_title = self.clean_existing_title_numbers(clean_title)
-                        level_num = int(level_name.replace('level', ''))
-                        converted_title = self.get_formatted_title(level_num, clean_title, output_formats)
-                        converted_lines.append(converted_title)
-                        last_line_was_title = True
-                        matched = True
-                        break
+        rules = [
+            (int(level_name.replace('level', '')), re.compile(title_patterns[pattern_key]['pattern']))
+            for level_name, pattern_key in sorted_rules
+        ]
+        self._rule_cache[key] = rules
+        return rules
+    
+    def match_title(self, line, rules, normalize=False, title_cleaner=None):
+        """用排序后的规则匹配一行（已去除首尾空白），返回 (级别, 清理后的标题) 或 None
+        
+        normalize 为 True 时在统一全角/半角后的文本上匹配（rules 须来自带该选项的规则），
+        由于统一前后长度相同，标题按匹配位置从原文中截取。
+        title_cleaner 见 title_cleaner_for，默认清理全部 Markdown 符号。
+        """
+        if title_cleaner is None:
+            title_cleaner = self.title_cleaner_for({NORMALIZE_WIDTH_KEY: normalize})
+        if normalize:
+            normalized = line.translate(WIDTH_NORMALIZE_TABLE)
+            for level_num, regex in rules:
+                match = regex.match(normalized)
+                if match:
+                    title = line[match.start(regex.groups):match.end(regex.groups)].strip()
+                    return level_num, title_cleaner(title)
+            return None
+        for level_num, regex in rules:
+            match = regex.match(line)
+            if match:
+                # 提取标题内容 - 使用最后一个匹配组
+                title = match.group(regex.groups).strip()
+                # 先去Markdown符号，再去编号
+                return level_num, title_cleaner(title)
+        return None
+    
+    def match_level(self, line, rules, normalize=False):
+        """只判断一行是第几级标题，不提取和清理标题文字；不是标题时返回 None"""
+        if normalize:
+            line = line.translate(WIDTH_NORMALIZE_TABLE)
+        for level_num, regex in rules:
+            if regex.match(line):
+                return level_num
+        return None
+    
+    def classify_lines(self, text, input_rules):
+        """NumPy 预扫描：只看行首字符和行长度，给 text.split('\\n') 的每一行分类
+        
+        返回 LINE_* 组成的数组；NumPy 不可用或规则可匹配任意行时返回 None。
+        """
+        if np is None:
+            return None
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        key = tuple(input_rules.items())
+        leads = self._lead_cache.get(key)
+        if leads is None:
+            active = [p for p in input_rules.values() if p in self.title_patterns]
+            if any(p not in self.pattern_leads and not p.startswith('markdown_') for p in active) or \
+                    any(self.pattern_leads.get(p, '') is None for p in active):
+                leads = False
+            else:
+                # 列表项、分隔线以及各标题格式可能的行首字符
+                chars = r'\-*+\da-zA-Z' + ''.join(self.pattern_leads.get(p, '') for p in active)
+                if normalize:
+                    # 统一后行首字符按半角判断（如 （ 变为 (）
+                    chars = chars.translate(WIDTH_NORMALIZE_TABLE)
+                hash_levels = [int(p[-1]) for p in active if p.startswith('markdown_h')]
+                leads = (re.compile('[' + chars + ']'), hash_levels)
+            self._lead_cache[key] = leads
+        if leads is False:
+            return None
+        special_re, hash_levels = leads
+        
+        codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+        newlines = np.flatnonzero(codes == 10)
+        starts = np.concatenate(([0], newlines + 1))
+        lengths = np.concatenate((newlines, [codes.size])) - starts
+        # 末尾补 0，空的最后一行也能取到“行首字符”
+        padded = np.concatenate((codes, np.zeros(5, dtype=codes.dtype)))
+        first = padded[starts]
+        
+        # 不同的行首字符通常只有几百种，逐个在 Python 中判断后映射回每一行
+        unique, inverse = np.unique(first, return_inverse=True)
+        special = np.array([
+            ch.isspace() or special_re.match(ch.translate(WIDTH_NORMALIZE_TABLE) if normalize else ch) is not None
+            for ch in map(chr, unique.tolist())
+        ], dtype=bool)
+        plain = ~special[inverse.ravel()]
+        
+        # 以 # 开头的行：只有连续 # 的个数等于某个启用的 Markdown 标题级别时才可能是标题
+        # （统一全角/半角时全角 ＃ 也算）
+        hash_codes = (35, 0xFF03) if normalize else (35,)
+        hash_rows = np.flatnonzero(np.isin(first, hash_codes))
+        if hash_rows.size:
+            run = np.ones(hash_rows.size, dtype=np.int8)
+            still = np.ones(hash_rows.size, dtype=bool)
+            for k in range(1, 5):
+                still &= np.isin(padded[starts[hash_rows] + k], hash_codes)
+                run += still
+            plain[hash_rows] = ~np.isin(run, hash_levels)
+        
+        kinds = np.full(starts.size, LINE_FULL, dtype=np.int8)
+        kinds[plain] = LINE_PLAIN
+        kinds[lengths == 0] = LINE_BLANK
+        return kinds
+    
+    def iter_text_events(self, text, input_rules, output_formats):
+        """转换整段文本，大文本在 NumPy 可用时先做行分类预扫描"""
+        lines = text.split('\n')
+        return self.iter_events(lines, input_rules, output_formats, self._line_kinds_for(text, lines, input_rules))
+    
+    def iter_stream_events(self, stream, input_rules, output_formats):
+        """流式转换文本流：按块读取，内存占用与文档大小无关，输出与 convert_text 相同"""
+        return self.number_events(self.iter_stream_parse(stream, input_rules), output_formats)
+    
+    def iter_stream_parse(self, stream, input_rules):
+        """流式解析文本流，产出未编号的解析事件（见 parse_events）"""
+        blocks = (
+            (lines, self._line_kinds_for(block, lines, input_rules))
+            for block in iter_text_blocks(stream)
+            for lines in (block.split('\n'),)
+        )
+        return self.parse_blocks(blocks, input_rules)
+    
+    def _line_kinds_for(self, text, lines, input_rules):
+        if self.use_numpy and len(lines) >= NUMPY_MIN_LINES:
+            return self.classify_lines(text, input_rules)
+        return None
+    
+    def iter_events(self, lines, input_rules, output_formats, line_kinds=None):
+        """逐行转换，按输出顺序产出 LineEvent
+        
+        kind 为 'title'（标题）或 'text'（段落、列表项）；
+        start/end 是该输出行对应的源行范围 [start, end)。
+        空白行、分隔线等不产生输出的源行不会出现在任何事件中。
+        """
+        return self.number_events(self.parse_events(lines, input_rules, line_kinds), output_formats)
+    
+    def number_events(self, events, output_formats, counters=None):
+        """为解析事件中的标题按输出格式生成编号，去掉转换后为空的标题
+        
+        counters 为初始计数器（见 count_headings），用于从文档中间开始编号。
+        """
+        self.reset_counters()
+        if counters:
+            self.counters.update(counters)
+        format_title = self.get_formatted_title
+        for event in events:
+            if event.kind == 'title':
+                converted_title = format_title(event.level, event.title, output_formats)
+                if converted_title.strip():
+                    yield event._replace(text=converted_title)
+            else:
+                yield event
+    
+    def parse_events(self, lines, input_rules, line_kinds=None):
+        """与输出格式无关的解析：匹配标题、清理正文、合并段落
+        
+        标题事件的 text 为 None（编号由 number_events 按输出格式生成），
+        并且即使标题文字为空也会产出，以保证计数正确。
+        给出 line_kinds（见 classify_lines）时，连续的空行和普通正文行整段处理，
+        只有 LINE_FULL 的行才逐行匹配标题规则。
+        """
+        return self.parse_blocks(((lines, line_kinds),), input_rules)
+    
+    def parse_blocks(self, blocks, input_rules):
+        """parse_events 的分块版本：blocks 依次产出 (行列表, line_kinds 或 None)
+        
+        段落可以跨块延续，事件中的行号在各块之间连续编号。
+        """
+        rules = self.sort_rules(input_rules)
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        is_separator = self._separator_re.match
+        is_list_item = self._list_item_re.match
+        clean = self.cleaner_for(input_rules)
+        clean_title = self.title_cleaner_for(input_rules)
+        current_paragraph = []
+        paragraph_start = paragraph_end = 0
+        base = 0
+        
+        for lines, line_kinds in blocks:
+            if line_kinds is None:
+                runs = ((0, len(lines), LINE_FULL),)
+            else:
+                cuts = (np.flatnonzero(line_kinds[1:] != line_kinds[:-1]) + 1).tolist()
+                bounds = [0] + cuts + [len(lines)]
+                runs = zip(bounds, bounds[1:], line_kinds[bounds[:-1]].tolist())
             
-            if not matched:
-                cleaned_line = self.clean_markdown_symbols(original_line)
-                list_match = re.match(r'^([-*+]|\d+\.|[a-zA-Z]\.)\s+', original_line)
-                if list_match:
+            for run_start, run_end, kind in runs:
+                if kind == LINE_BLANK:
                     if current_paragraph:
-                        converted_lines.append(' '.join(current_paragraph))
+                        text = ' '.join(current_paragraph)
+                        if text.strip():
+                            yield LineEvent('text', 0, text, None, paragraph_start, paragraph_end)
                         current_paragraph = []
-                    in_list = True
-                    last_line_was_title = False
-                    converted_lines.append(cleaned_line)
-                elif in_list and original_line.startswith('  '):
-                    if converted_lines:
-                        converted_lines[-1] = converted_lines[-1] + ' ' + cleaned_line
-                    last_line_was_title = False
-                else:
-                    if not in_list:
-                        current_paragraph.append(cleaned_line)
+                    continue
+                if kind == LINE_PLAIN:
+                    # 普通正文行：不可能是标题、列表或分隔线，直接并入当前段落
+                    if not current_paragraph:
+                        paragraph_start = base + run_start
+                    current_paragraph.extend([clean(line.strip()) for line in lines[run_start:run_end]])
+                    paragraph_end = base + run_end
+                    continue
+                
+                for i in range(base + run_start, base + run_end):
+                    original_line = lines[i - base].strip()
+                    # 跳过分隔线
+                    if is_separator(original_line):
+                        continue
+                    if not original_line:
+                        if current_paragraph:
+                            text = ' '.join(current_paragraph)
+                            if text.strip():
+                                yield LineEvent('text', 0, text, None, paragraph_start, paragraph_end)
+                            current_paragraph = []
+                        continue
+                    
+                    matched = self.match_title(original_line, rules, normalize, clean_title)
+                    if matched:
+                        if current_paragraph:
+                            text = ' '.join(current_paragraph)
+                            if text.strip():
+                                yield LineEvent('text', 0, text, None, paragraph_start, paragraph_end)
+                            current_paragraph = []
+                        yield LineEvent('title', matched[0], None, matched[1], i, i + 1)
+                        continue
+                    
+                    cleaned_line = clean(original_line)
+                    if is_list_item(original_line):
+                        if current_paragraph:
+                            text = ' '.join(current_paragraph)
+                            if text.strip():
+                                yield LineEvent('text', 0, text, None, paragraph_start, paragraph_end)
+                            current_paragraph = []
+                        if cleaned_line.strip():
+                            yield LineEvent('text', 0, cleaned_line, None, i, i + 1)
                     else:
-                        in_list = False
+                        if not current_paragraph:
+                            paragraph_start = i
                         current_paragraph.append(cleaned_line)
-                    last_line_was_title = False
+                        paragraph_end = i + 1
+            
+            base += len(lines)
         
         if current_paragraph:
-            converted_lines.append(' '.join(current_paragraph))
-        
-        result_lines = [line for line in converted_lines if line.strip()]
-        return '\n'.join(result_lines)
-        
+            text = ' '.join(current_paragraph)
+            if text.strip():
+                yield LineEvent('text', 0, text, None, paragraph_start, paragraph_end)
+    
+    def heading_filter(self, input_rules):
+        """把所有启用的标题规则合并成一个正则，一次匹配就能排除不是标题的行"""
+        key = tuple(input_rules.items())
+        regex = self._heading_filter_cache.get(key)
+        if regex is None:
+            title_patterns = self.normalized_title_patterns if input_rules.get(NORMALIZE_WIDTH_KEY) else self.title_patterns
+            patterns = [title_patterns[p]['pattern'] for p in input_rules.values() if p in title_patterns]
+            regex = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns) or '(?!)')
+            self._heading_filter_cache[key] = regex
+        return regex
+    
+    def iter_heading_lines(self, blocks, input_rules):
+        """只找出标题行，产出 (源行号（从 0 开始）, 去掉首尾空白的行)
+        
+        与 parse_blocks 使用相同的标题判断，但不清理正文、不合并段落；
+        给出 line_kinds 时只检查 LINE_FULL 的行。
+        """
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        is_candidate = self.heading_filter(input_rules).match
+        is_separator = self._separator_re.match
+        base = 0
+        for lines, line_kinds in blocks:
+            if line_kinds is None:
+                candidates = range(len(lines))
+            else:
+                candidates = np.flatnonzero(line_kinds == LINE_FULL).tolist()
+            for i in candidates:
+                line = lines[i].strip()
+                if not line or is_separator(line):
+                    continue
+                if not is_candidate(line.translate(WIDTH_NORMALIZE_TABLE) if normalize else line):
+                    continue
+                yield base + i, line
+            base += len(lines)
+    
+    def iter_heading_matches(self, blocks, input_rules, clean_titles=True):
+        """只匹配标题行，产出 (源行号（从 0 开始）, 级别, 清理后的标题)
+        
+        clean_titles 为 False 时标题为 None。
+        """
+        rules = self.sort_rules(input_rules)
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        clean_title = self.title_cleaner_for(input_rules)
+        for index, line in self.iter_heading_lines(blocks, input_rules):
+            if clean_titles:
+                level, title = self.match_title(line, rules, normalize, clean_title)
+                yield index, level, title
+            else:
+                yield index, self.match_level(line, rules, normalize), None
+    
+    def count_headings(self, lines, input_rules, text=None, counters=None):
+        """快速预扫描：统计各级标题，返回处理完这些行之后的编号计数器
+        
+        只按级别计数、不生成编号，结果可以作为 number_events 的初始计数器，
+        使从文档中间开始的转换得到与整篇转换相同的编号。
+        counters 为这些行之前的计数器，用于分段接续扫描。
+        """
+        line_kinds = self._line_kinds_for(text, lines, input_rules) if text is not None else None
+        counts = [0] * 5
+        if counters:
+            counts[1:] = [counters[f'level{n}'] for n in range(1, 5)]
+        for _, level, _ in self.iter_heading_matches(((lines, line_kinds),), input_rules, clean_titles=False):
+            counts[level] += 1
+            counts[level + 1:] = [0] * (4 - level)
+        return {f'level{n}': counts[n] for n in range(1, 5)}
+    
+    def iter_outline_blocks(self, blocks, input_rules, output_formats):
+        """只提取标题大纲，产出 OutlineEntry，编号与完整转换的结果一致"""
+        format_title = self.get_formatted_title
+        self.reset_counters()
+        for index, level, title in self.iter_heading_matches(blocks, input_rules):
+            converted_title = format_title(level, title, output_formats)
+            if converted_title.strip():
+                number = converted_title[:len(converted_title) - len(title)]
+                yield OutlineEntry(level, number, title, index + 1)
+    
+    def iter_outline(self, text, input_rules, output_formats):
+        """提取整段文本的标题大纲"""
+        lines = text.split('\n')
+        blocks = ((lines, self._line_kinds_for(text, lines, input_rules)),)
+        return self.iter_outline_blocks(blocks, input_rules, output_formats)
+    
+    def iter_stream_outline(self, stream, input_rules, output_formats):
+        """流式提取文本流的标题大纲，内存占用与文档大小无关"""
+        blocks = (
+            (lines, self._line_kinds_for(block, lines, input_rules))
+            for block in iter_text_blocks(stream)
+            for lines in (block.split('\n'),)
+        )
+        return self.iter_outline_blocks(blocks, input_rules, output_formats)
+    
+    def iter_check_blocks(self, blocks, input_rules, output_formats):
+        """一致性检查：产出转换后会被改写的标题行（CheckViolation），不清理正文、不产生输出
+        
+        标题按输入规则识别，转换后的标题行（按输出格式重新编号）与原行完全相同才算一致，
+        因此已经按输出格式编号的文档需要使用能识别输出格式的输入规则。
+        按需逐个产出，只要第一个不一致时取到即可停止，不再读取文档的其余部分。
+        """
+        rules = self.sort_rules(input_rules)
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        clean_title = self.title_cleaner_for(input_rules)
+        format_title = self.get_formatted_title
+        self.reset_counters()
+        for index, line in self.iter_heading_lines(blocks, input_rules):
+            level, title = self.match_title(line, rules, normalize, clean_title)
+            expected = format_title(level, title, output_formats)
+            if expected != line:
+                yield CheckViolation(index + 1, level, expected, line)
+    
+    def iter_stream_check(self, stream, input_rules, output_formats):
+        """流式检查文本流，内存占用与文档大小无关"""
+        blocks = (
+            (lines, self._line_kinds_for(block, lines, input_rules))
+            for block in iter_text_blocks(stream)
+            for lines in (block.split('\n'),)
+        )
+        return self.iter_check_blocks(blocks, input_rules, output_formats)
+    
+    def iter_renumber_blocks(self, blocks, input_rules, output_formats):
+        """只改写标题行的编号，逐块产出改写后的行列表（就地修改传入的行列表）
+        
+        标题按输入规则识别、按输出格式重新编号：编号式规则（一、 (1) - 等）的编号被替换，
+        Markdown 标题保留 # 标记，只替换其后已有的编号（没有编号时加上）。
+        标题文字（包括其中的 Markdown 符号）和行首行尾的空白保持原样；
+        其余行不清理、不合并段落，原样产出。
+        """
+        rules = self.sort_rules(input_rules)
+        normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+        format_title = self.get_formatted_title
+        self.reset_counters()
+        for lines, line_kinds in blocks:
+            for index, line in self.iter_heading_lines(((lines, line_kinds),), input_rules):
+                target = line.translate(WIDTH_NORMALIZE_TABLE) if normalize else line
+                for level, regex in rules:
+                    match = regex.match(target)
+                    if match:
+                        break
+                title_start = match.start(regex.groups)
+                marker = line[:title_start] if regex.pattern.startswith('^#') else ''
+                title = self.strip_title_number(line[title_start:match.end(regex.groups)].strip())
+                raw = lines[index]
+                indent = raw[:len(raw) - len(raw.lstrip())]
+                lines[index] = (indent + marker + format_title(level, title, output_formats)
+                                + raw[len(indent) + len(line):])
+            yield lines
+    
+    def iter_stream_renumber(self, stream, input_rules, output_formats):
+        """流式重新编号文本流，产出的各块之间补上 '\n' 拼接起来就是结果"""
+        blocks = (
+            (lines, self._line_kinds_for(block, lines, input_rules))
+            for block in iter_text_blocks(stream)
+            for lines in (block.split('\n'),)
+        )
+        return self.iter_renumber_blocks(blocks, input_rules, output_formats)
+    
+    def convert_text(self, text, input_rules, output_formats):
+        """转换整个文本"""
+        events = self.iter_text_events(text, input_rules, output_formats)
+        return '\n'.join(event.text for event in events)
+    
+    def parse_text(self, text, input_rules):
+        """解析文本为 ParsedDocument，之后可以用不同的输出格式反复渲染"""
+        lines = text.split('\n')
+        return ParsedDocument.from_events(self.parse_events(lines, input_rules, self._line_kinds_for(text, lines, input_rules)))
+    
+    def render_document(self, document, output_formats, counters=None):
+        """按输出格式渲染已解析的文档，只需一遍编号，不再匹配和清理"""
+        return '\n'.join(event.text for event in document.iter_render(self, output_formats, counters))
+        
+    def parse_heading_number(self, token):
+        """把标题编号（阿拉伯数字、中文数字、罗马数字、字母）转换为整数，无法识别时返回 None"""
+        if not token:
+            return None
+        if token.isdigit():
+            return int(token)
+        if len(token) == 1 and token.isascii() and token.isalpha():
+            return ord(token.upper()) - 64
+        if all(ch in self.roman_numbers for ch in token):
+            # 与 get_roman_number 一致：ⅩⅡ 表示 12
+            return sum(self.roman_numbers.index(ch) + 1 for ch in token)
+        if all(ch in self.chinese_numbers for ch in token):
+            if '十' not in token:
+                return self.chinese_numbers.index(token[0]) + 1 if len(token) == 1 else None
+            tens, _, ones = token.partition('十')
+            tens_value = self.chinese_numbers.index(tens) + 1 if tens else 1
+            ones_value = self.chinese_numbers.index(ones) + 1 if ones else 0
+            return tens_value * 10 + ones_value
+        return None
+    
+    def detect_input_rules(self, windows, max_levels=4):
+        """根据抽样得到的若干段连续源行，推断输入规则
+        
+        统计每种标题格式的出现次数，并根据编号的重新开始推断层级：
+        编号为 1 的标题紧跟在另一种标题后面，说明后者是它的上级；
+        编号大于 1 的标题紧跟在另一种标题后面，说明后者是它的下级。
+        返回 {'input_rules', 'confidence', 'counts', 'sampled_lines'}，confidence 在 0~1 之间。
+        """
+        candidates = [
+            (key, re.compile(info['pattern']))
+            for key, info in self.title_patterns.items() if key != 'plain_text'
+        ]
+        counts = {}
+        first_seen = {}
+        votes = {}  # (上级, 下级) -> 票数
+        sampled = 0
+        position = 0
+        
+        for window in windows:
+            previous = None  # 窗口内上一个标题的 (格式, 编号)；正文行不打断标题之间的先后关系
+            for line in window:
+                sampled += 1
+                line = line.strip()
+                if not line or self._separator_re.match(line):
+                    continue
+                position += 1
+                for key, regex in candidates:
+                    match = regex.match(line)
+                    if match:
+                        break
+                else:
+                    continue
+                number = self.parse_heading_number(match.group(1)) if regex.groups == 2 else None
+                counts[key] = counts.get(key, 0) + 1
+                first_seen.setdefault(key, position)
+                if previous is not None and previous[0] != key:
+                    if number == 1:
+                        pair = (previous[0], key)
+                    elif number is not None:
+                        pair = (key, previous[0])
+                    else:
+                        pair = None
+                    if pair:
+                        votes[pair] = votes.get(pair, 0) + 1
+                previous = (key, number)
+        
+        # 样本足够时，只出现一两次的格式多半是正文里的偶然匹配
+        total_hits = sum(counts.values())
+        min_support = max(2, total_hits // 50) if total_hits >= 20 else 1
+        keys = [key for key in counts if counts[key] >= min_support]
+        
+        def beats(a, b):
+            if a.startswith('markdown_') and b.startswith('markdown_'):
+                return a[-1] < b[-1]  # # 越少级别越高
+            if votes.get((a, b), 0) != votes.get((b, a), 0):
+                return votes.get((a, b), 0) > votes.get((b, a), 0)
+            if counts[a] != counts[b]:
+                return counts[a] < counts[b]  # 上级标题通常比下级少
+            return first_seen[a] < first_seen[b]
+        
+        scores = {a: sum(1 for b in keys if b != a and beats(a, b)) for a in keys}
+        order = sorted(keys, key=lambda k: (-scores[k], first_seen[k]))[:max_levels]
+        
+        # 置信度 = 层级关系的一致程度 × 样本充分程度
+        agree = total = 0
+        for i, upper in enumerate(order):
+            for lower in order[i + 1:]:
+                agree += votes.get((upper, lower), 0)
+                total += votes.get((upper, lower), 0) + votes.get((lower, upper), 0)
+        consistency = agree / total if total else 0.5
+        support = min(1.0, sum(counts[k] for k in order) / (8.0 * len(order))) if order else 0.0
+        
+        return {
+            'input_rules': {f'level{i + 1}': key for i, key in enumerate(order)},
+            'confidence': round(consistency * support, 2),
+            'counts': counts,
+            'sampled_lines': sampled,
+        }
+    
     def _is_title_line(self, line):
         """判断一行是否是标题行（以数字、中文数字或罗马数字开头）"""
         return bool(re.match(r'^[一二三四五六七八九十]、|^\d+、|^[ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]、|^（[一二三四五六七八九十]）|^\(\d+\)|^\([A-Za-z]\)', line))
 
+class ParsedDocument:
+    """紧凑的解析结果，按列存储每个输出行的类型、标题级别、文字和源行范围
+    
+    所有文字拼接在一个字符串里，用偏移数组定位；段落已经合并好。
+    只改输出格式时，渲染只需对这些列做一遍编号。
+    """
+    
+    KIND_TEXT = 0
+    KIND_TITLE = 1
+    
+    def __init__(self):
+        self.kinds = array('b')
+        self.levels = array('b')
+        self.offsets = array('q', [0])
+        self.starts = array('q')
+        self.ends = array('q')
+        self.buffer = ''
+    
+    @classmethod
+    def from_events(cls, events):
+        """由 parse_events 的事件构建"""
+        document = cls()
+        chunks = []
+        length = 0
+        for event in events:
+            text = event.title if event.kind == 'title' else event.text
+            document.kinds.append(cls.KIND_TITLE if event.kind == 'title' else cls.KIND_TEXT)
+            document.levels.append(event.level)
+            length += len(text)
+            document.offsets.append(length)
+            document.starts.append(event.start)
+            document.ends.append(event.end)
+            chunks.append(text)
+        document.buffer = ''.join(chunks)
+        return document
+    
+    def __len__(self):
+        return len(self.kinds)
+    
+    def text_at(self, index):
+        """第 index 行的文字（标题为清理后的标题，不含编号）"""
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]]
+    
+    def titles(self):
+        """所有标题的清理后文字"""
+        return [self.text_at(i) for i, kind in enumerate(self.kinds) if kind == self.KIND_TITLE]
+    
+    def iter_render(self, converter, output_formats, counters=None):
+        """按输出格式重新编号，产出与 MarkdownConverter.iter_events 相同的事件
+        
+        counters 为初始计数器，含义同 MarkdownConverter.number_events。
+        """
+        converter.reset_counters()
+        if counters:
+            converter.counters.update(counters)
+        format_title = converter.get_formatted_title
+        buffer, offsets, levels = self.buffer, self.offsets, self.levels
+        for i, kind in enumerate(self.kinds):
+            text = buffer[offsets[i]:offsets[i + 1]]
+            if kind == self.KIND_TITLE:
+                converted_title = format_title(levels[i], text, output_formats)
+                if converted_title.strip():
+                    yield LineEvent('title', levels[i], converted_title, text, self.starts[i], self.ends[i])
+            else:
+                yield LineEvent('text', 0, text, None, self.starts[i], self.ends[i])
+
+def _take_lines(text, pos, count):
+    """从 pos 开始取至多 count 行，返回 (行列表, 下一行的起始位置)"""
+    lines = []
+    while len(lines) < count and pos <= len(text):
+        end = text.find('\n', pos)
+        if end < 0:
+            lines.append(text[pos:])
+            return lines, len(text) + 1
+        lines.append(text[pos:end])
+        pos = end + 1
+    return lines, pos
+
+def sample_text_windows(text, prefix_lines=1000, window_count=24, window_lines=50, seed=0):
+    """抽样文本：开头 prefix_lines 行，再把其余部分均分为 window_count 段，
+    每段随机取一个位置，从下一行开始取 window_lines 行。不会扫描整个文本。"""
+    prefix, pos = _take_lines(text, 0, prefix_lines)
+    windows = [prefix]
+    rest = len(text) - pos
+    if rest <= 0:
+        return windows
+    rng = random.Random(seed)
+    span = rest / window_count
+    for k in range(window_count):
+        offset = pos + int(span * (k + rng.random()))
+        start = text.find('\n', offset)
+        if start < 0:
+            break
+        window, _ = _take_lines(text, start + 1, window_lines)
+        windows.append(window)
+    return windows
+
+def sample_file_windows(path, prefix_lines=1000, window_count=24, window_lines=50, seed=0,
+                        encoding=None, window_bytes=16 * 1024):
+    """与 sample_text_windows 相同的抽样方式，直接在文件上定位读取，只读取抽到的部分
+    
+    每个窗口读取 window_bytes 字节后解码，丢掉首尾不完整的行；
+    UTF-16/32 的窗口起点按码元对齐。
+    """
+    encoding = encoding or detect_file_encoding(path)
+    size = input_file_size(path)
+    with open_binary_input(path) as f:
+        head = f.read(ENCODING_SAMPLE_SIZE * 4)
+        # 开头部分按原编码解码（会去掉 BOM），末尾可能截断的行不要
+        text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(head, final=len(head) < ENCODING_SAMPLE_SIZE * 4)
+        prefix = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        if len(head) == ENCODING_SAMPLE_SIZE * 4:
+            prefix.pop()
+        windows = [prefix[:prefix_lines]]
+        if len(head) >= size:
+            return windows
+        
+        # 窗口从文件中间开始，没有 BOM，需要明确字节序
+        window_encoding = codecs.lookup(encoding).name
+        unit = 1
+        if window_encoding.startswith('utf-16') or window_encoding.startswith('utf-32'):
+            unit = 2 if window_encoding.startswith('utf-16') else 4
+            if window_encoding in ('utf-16', 'utf-32'):
+                little = head.startswith(codecs.BOM_UTF16_LE)
+                window_encoding += '-le' if little else '-be'
+        elif window_encoding == 'utf-8-sig':
+            window_encoding = 'utf-8'
+        
+        rng = random.Random(seed)
+        span = (size - len(head)) / window_count
+        for k in range(window_count):
+            offset = len(head) + int(span * (k + rng.random()))
+            f.seek(offset - offset % unit)
+            chunk = decode_document_bytes(f.read(window_bytes), window_encoding).split('\n')
+            window = chunk[1:-1][:window_lines]
+            if window:
+                windows.append(window)
+    return windows
+
+class StallMonitor:
+    """诊断模式：用 root.after 心跳测量 Tk 主循环的响应延迟，并记录卡顿时正在执行的处理函数
+    
+    每 interval 毫秒安排一次心跳，心跳实际执行时刻比预期晚多少即为这一拍的延迟，
+    计入直方图。主线程被某个回调占住时心跳无法执行，所以由一个后台线程在心跳
+    超时期间抽样主线程的调用栈，找出本文件中正在运行的函数（auto_convert、
+    update_preview、on_tab_changed、通知动画等）；迟到的心跳到达时把卡顿时长和
+    抽样最多的处理函数一起写入日志。
+    """
+    
+    def __init__(self, root, on_update=None, log_path=None, interval=STALL_HEARTBEAT_MS,
+                 threshold=STALL_THRESHOLD_MS, bounds=STALL_HISTOGRAM_BOUNDS, clock=time.perf_counter):
+        self.root = root
+        self.on_update = on_update
+        self.log_path = log_path
+        self.interval = interval
+        self.threshold = threshold
+        self.bounds = bounds
+        self.clock = clock
+        self.histogram = [0] * (len(bounds) + 1)
+        self.stalls = []  # (卡顿毫秒数, 处理函数, 调用链)
+        self.max_late = 0.0
+        self.running = False
+        self._after_id = None
+        self._expected = None
+        self._last_tick = None
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog = None
+        self._main_thread_id = threading.get_ident()
+        self._ticks_since_update = 0
+    
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._stop.clear()
+        self._last_tick = self.clock()
+        self._schedule()
+        self._watchdog = threading.Thread(target=self._watch, name='stall-watchdog', daemon=True)
+        self._watchdog.start()
+    
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self._stop.set()
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except tk.TclError:
+                pass
+            self._after_id = None
+    
+    def _schedule(self):
+        self._expected = self.clock() + self.interval / 1000
+        self._after_id = self.root.after(self.interval, self._tick)
+    
+    def _tick(self):
+        if not self.running:
+            return
+        now = self.clock()
+        late = max(0.0, (now - self._expected) * 1000)
+        self.record(late)
+        self._last_tick = now
+        self._schedule()
+        self._ticks_since_update += 1
+        # 状态栏约每秒刷新一次，出现卡顿时立即刷新
+        if self.on_update and (late > self.threshold or self._ticks_since_update * self.interval >= 1000):
+            self._ticks_since_update = 0
+            self.on_update(self)
+    
+    def record(self, late):
+        """把一拍的延迟（毫秒）计入直方图；超过阈值时记录卡顿"""
+        index = 0
+        while index < len(self.bounds) and late > self.bounds[index]:
+            index += 1
+        self.histogram[index] += 1
+        self.max_late = max(self.max_late, late)
+        with self._lock:
+            samples, self._samples = self._samples, {}
+        if late <= self.threshold:
+            return
+        if samples:
+            # 先按处理函数汇总抽样次数，再取该函数下最常见的调用链
+            totals = {}
+            for (handler, chain), count in samples.items():
+                totals[handler] = totals.get(handler, 0) + count
+            handler = max(totals, key=totals.get)
+            chain = max((key for key in samples if key[0] == handler), key=samples.get)[1]
+        else:
+            # 整段时间都在 Tcl/Tk 内部（例如大段文本排版），抽样不到 Python 回调
+            handler, chain = '（Tk 内部）', ''
+        self.stalls.append((late, handler, chain))
+        self.log(late, handler, chain)
+    
+    def _watch(self):
+        # 抽样间隔取心跳间隔的一半，卡顿超过阈值后才开始抽样
+        period = self.interval / 2000
+        while not self._stop.wait(period):
+            if (self.clock() - self._last_tick) * 1000 <= self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._main_thread_id)
+            key = self.handler_of(frame)
+            del frame
+            with self._lock:
+                self._samples[key] = self._samples.get(key, 0) + 1
+    
+    @staticmethod
+    def handler_of(frame):
+        """从主线程的调用栈中找出本文件中的处理函数，返回 (处理函数, 调用链)
+        
+        处理函数取最外层的非 lambda 函数（lambda 只是快捷键绑定的转发），
+        调用链为本文件内的各级函数，由外到内。
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == __file__:
+                name = getattr(code, 'co_qualname', code.co_name)
+                if not name.startswith('StallMonitor.') and code.co_name not in ('run_gui', 'main', '<module>'):
+                    names.append(name)
+            frame = frame.f_back
+        names.reverse()
+        if not names:
+            return '（Tk 内部）', ''
+        handler = next((name for name in names if not name.endswith('<lambda>')), names[0])
+        return handler, ' > '.join(names)
+    
+    def log(self, late, handler, chain):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} 卡顿 {late:.0f}ms 处理函数 {handler}"
+        if chain:
+            line += f" 调用链 {chain}"
+        print(line, file=sys.stderr)
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+            except OSError:
+                pass
+    
+    def percentile(self, fraction):
+        """直方图中第 fraction 分位所在桶的上界（毫秒），最后一桶返回最大延迟"""
+        total = sum(self.histogram)
+        if not total:
+            return 0.0
+        count = 0
+        for index, n in enumerate(self.histogram):
+            count += n
+            if count >= total * fraction:
+                return self.bounds[index] if index < len(self.bounds) else self.max_late
+        return self.max_late
+    
+    def summary(self):
+        """状态栏显示的一行直方图，例如 “延迟 ≤16:812 ≤50:9 … >1000:1 | p95≤16ms 卡顿 1 次 最长 1840ms”"""
+        buckets = [f"≤{bound}:{n}" for bound, n in zip(self.bounds, self.histogram)]
+        buckets.append(f">{self.bounds[-1]}:{self.histogram[-1]}")
+        return (f"延迟 {' '.join(buckets)} | p95≤{self.percentile(0.95):.0f}ms "
+                f"卡顿 {len(self.stalls)} 次 最长 {self.max_late:.0f}ms")
+
+class ConversionProfiler:
+    """分析每次转换：mode 为 'cprofile' 时用 cProfile，为 'sample' 时用调用栈采样线程
+    
+    两种方式不同时运行：cProfile 的逐次调用开销会使采样到的调用栈偏向调用频繁的小函数。
+    每次分析写出两个文件，文件名前缀为 “文档名-规则指纹-时间-进程号-序号”：
+    cprofile 写 .pstats（可用 pstats / snakeviz 查看），sample 写 .collapsed（每行 “外层;…;内层 次数”，
+    可直接交给 flamegraph.pl / speedscope）；另有 .json 记录文档、规则配置和耗时，用于复现。
+    采样线程只采样被分析的线程；多进程分片时只记录主进程。
+    """
+    
+    _sequence = itertools.count(1)
+    
+    def __init__(self, profile_dir, mode='cprofile', sample_interval=PROFILE_SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"未知的分析方式：{mode}")
+        self.profile_dir = profile_dir
+        self.mode = mode
+        self.sample_interval = sample_interval
+    
+    def tag(self, document, input_rules, output_formats):
+        name = _FILE_NAME_INVALID_CHARS.sub('_', document).strip() or 'document'
+        fingerprint = rule_config_fingerprint(input_rules, output_formats)[:8]
+        return (f"{name[:SECTION_NAME_MAX_CHARS]}-{fingerprint}-{time.strftime('%Y%m%d-%H%M%S')}"
+                f"-{os.getpid()}-{next(self._sequence)}")
+    
+    @contextlib.contextmanager
+    def profile(self, document, input_rules, output_formats, source=None):
+        """分析 with 块中的代码；document 为文件名中的文档名，source 为记录在 .json 中的源路径"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        prefix = os.path.join(self.profile_dir, self.tag(document, input_rules, output_formats))
+        samples = {}
+        stop = threading.Event()
+        if self.mode == 'sample':
+            profiler = None
+            sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), samples, stop),
+                                       name='profile-sampler', daemon=True)
+            sampler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield prefix
+        finally:
+            elapsed = time.perf_counter() - started
+            meta = {'document': document, 'source': source, 'mode': self.mode, 'seconds': round(elapsed, 6),
+                    'input_rules': input_rules, 'output_formats': output_formats}
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(prefix + '.pstats')
+            else:
+                stop.set()
+                sampler.join()
+                with atomic_output(prefix + '.collapsed') as f:
+                    for stack, count in sorted(samples.items()):
+                        f.write(f"{stack} {count}\n")
+                meta.update(samples=sum(samples.values()), sample_interval=self.sample_interval)
+            write_file_atomic(prefix + '.json', json.dumps(meta, ensure_ascii=False, indent=2) + '\n')
+    
+    def _sample(self, thread_id, samples, stop):
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, 'co_qualname', code.co_name)
+                names.append(f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                stack = ';'.join(reversed(names))
+                samples[stack] = samples.get(stack, 0) + 1
+
+def profile_conversion(profiler, document, input_rules, output_formats, source=None):
+    """profiler 为 None 时不做分析，否则返回 profiler.profile(...)"""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile(document, input_rules, output_formats, source)
+
 class MarkdownConverterGUI:
-    def __init__(self, root):
+    def __init__(self, root, diagnostics=False):
         self.root = root
         self.converter = MarkdownConverter()
         self.last_input_rules = {}
         self.last_output_formats = {}
         self.rules_initialized = False  # 标记规则是否已初始化
+        self._parse_cache = {}  # 解析结果缓存：名称 -> ((文本, 输入规则), ParsedDocument)
+        self._edit_generation = 0  # 输入框内容的修改代数，每次 <<Modified>> 递增
+        self._prescan_cache = None  # 预览的标题计数预扫描缓存：(修改代数, 输入规则, 已扫描到的行号, 计数器)
+        # 大纲索引：每个标题为 (级别, 转换后的标题, 输入行号, 输出行号)，与大纲列表中的条目一一对应
+        self.outline_headings = []
+        self.outline_items = []
+        self.outline_visible = False
+        self.outline_dirty = False
+        self.file_task = None  # 正在进行的后台打开/保存任务
+        self.stall_monitor = None  # 诊断模式的主循环卡顿监视器
+        self.profiler = None  # 隐藏开关打开的性能分析器，开启时分析每次手动转换
         
         # 配置文件路径
         self.config_dir = os.path.join(os.path.expanduser("~"), ".markdown_converter")
@@ -313,6 +1636,9 @@ class MarkdownConverterGUI:
         
         # 保存加载后的规则状态作为初始状态
         self.save_current_rules_state()
+        
+        if diagnostics:
+            self.toggle_diagnostics()
     
     def setup_fonts(self):
         """设置跨平台字体"""
@@ -420,10 +1746,28 @@ class MarkdownConverterGUI:
             font=(self.default_font, 9)
         )
         status_bar.pack(side='bottom', fill='x')
+        self.status_bar = status_bar
+        
+        # 诊断模式的延迟直方图，叠放在状态栏右侧（平时隐藏）
+        self.latency_var = tk.StringVar()
+        self.latency_label = tk.Label(
+            status_bar,
+            textvariable=self.latency_var,
+            anchor='e',
+            bg='#ecf0f1',
+            fg='#7f8c8d',
+            font=(self.default_font, 9)
+        )
+        
+        # 后台打开/保存文件时显示的进度条（平时隐藏）
+        self.setup_progress_bar()
         
         # 绑定快捷键
         self.root.bind('<Control-Return>', lambda e: self.convert_text())
         self.root.bind('<F5>', lambda e: self.convert_text())
+        # 隐藏的诊断开关
+        self.root.bind('<Control-Shift-D>', lambda e: self.toggle_diagnostics())
+        self.root.bind('<Control-Shift-P>', lambda e: self.toggle_profiling())
         
         # 绑定标签页切换事件
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
@@ -448,11 +1792,27 @@ class MarkdownConverterGUI:
             pady=5  # 减小内边距
         )
         left_frame.pack(side='left', fill='both', expand=True, padx=(0, 10))
+        self.left_frame = left_frame
         
         # 输入区域按钮框架 - 移到文本框前面
         input_button_frame = tk.Frame(left_frame, bg='white')
         input_button_frame.pack(fill='x', pady=(0, 5))  # 减小内边距
         
+        # 打开文件按钮
+        self.open_btn = tk.Button(
+            input_button_frame,
+            text="📂 打开文件",
+            command=self.open_file,
+            bg='#3498db',
+            fg='black',
+            font=(self.button_font, 9, 'bold'),
+            relief='flat',
+            padx=10,
+            pady=3,
+            cursor='hand2'
+        )
+        self.open_btn.pack(side='left', padx=(0, 10))
+        
         # 清空按钮
         self.clear_btn = tk.Button(
             input_button_frame,
@@ -483,6 +1843,21 @@ class MarkdownConverterGUI:
         )
         self.refresh_btn.pack(side='left')
         
+        # 大纲面板开关
+        self.outline_btn = tk.Button(
+            input_button_frame,
+            text="📑 大纲",
+            command=self.toggle_outline,
+            bg='#95a5a6',
+            fg='black',
+            font=(self.button_font, 9, 'bold'),
+            relief='flat',
+            padx=10,
+            pady=3,
+            cursor='hand2'
+        )
+        self.outline_btn.pack(side='left', padx=(10, 0))
+        
         # 输入文本框
         self.input_text = scrolledtext.ScrolledText(
             left_frame,
@@ -498,6 +1873,7 @@ class MarkdownConverterGUI:
         
         # 绑定输入文本变化事件，实现自动转换
         self.input_text.bind("<KeyRelease>", self.auto_convert)
+        self.input_text.bind("<<Modified>>", self.on_input_modified)
         
         # 添加示例文本
         example_text = """"""
@@ -551,6 +1927,20 @@ class MarkdownConverterGUI:
         )
         self.copy_all_btn.pack(side='left')
         
+        self.save_btn = tk.Button(
+            copy_frame,
+            text="💾 保存结果",
+            command=self.save_result,
+            bg='#27ae60',
+            fg='black',
+            font=(self.button_font, 9, 'bold'),
+            relief='flat',
+            padx=10,
+            pady=3,
+            cursor='hand2'
+        )
+        self.save_btn.pack(side='left', padx=(10, 0))
+        
         # 输出文本框
         self.output_text = scrolledtext.ScrolledText(
             right_frame,
@@ -565,9 +1955,107 @@ class MarkdownConverterGUI:
         )
         self.output_text.pack(fill='both', expand=True)
         
+        # 大纲面板（默认收起，点击“大纲”按钮后显示在输入区域左侧）
+        self.setup_outline_panel(content_frame)
+        
         # 设置按钮悬停效果
         self.setup_hover_effects()
     
+    def setup_outline_panel(self, parent):
+        """创建大纲面板：按转换结果列出标题，点击后两侧文本框同时跳转到对应位置"""
+        self.outline_frame = tk.LabelFrame(
+            parent,
+            text="📑 大纲",
+            font=(self.default_font, 12, 'bold'),
+            bg='white',
+            fg='#2c3e50',
+            padx=5,
+            pady=5
+        )
+        
+        self.outline_tree = ttk.Treeview(self.outline_frame, show='tree', selectmode='browse')
+        self.outline_tree.column('#0', width=220, stretch=True)
+        outline_scroll = ttk.Scrollbar(self.outline_frame, orient='vertical', command=self.outline_tree.yview)
+        self.outline_tree.configure(yscrollcommand=outline_scroll.set)
+        outline_scroll.pack(side='right', fill='y')
+        self.outline_tree.pack(side='left', fill='both', expand=True)
+        self.outline_tree.bind('<<TreeviewSelect>>', self.on_outline_select)
+        
+        # 跳转后高亮对应的行
+        for widget in (self.input_text, self.output_text):
+            widget.tag_configure('outline_current', background='#fdebd0')
+    
+    def toggle_outline(self):
+        """显示或收起大纲面板；收起期间不更新列表，显示时再一次性同步"""
+        if self.outline_visible:
+            self.outline_frame.pack_forget()
+            self.outline_visible = False
+            return
+        self.outline_frame.pack(side='left', fill='y', padx=(0, 10), before=self.left_frame)
+        self.outline_visible = True
+        if self.outline_dirty:
+            self.update_outline(self.outline_headings, force=True)
+    
+    def update_outline(self, headings, force=False):
+        """用新的标题索引更新大纲列表
+        
+        只比较列表的首尾：相同的条目保留不动，中间变化的部分优先改写已有条目的文字，
+        多出或缺少的再插入或删除，编辑时通常只需改动少数几个条目。
+        force 为 True 时清空列表后全部重建。
+        """
+        previous = self.outline_headings
+        self.outline_headings = headings
+        if not self.outline_visible:
+            self.outline_dirty = True
+            return
+        self.outline_dirty = False
+        tree = self.outline_tree
+        if force:
+            tree.delete(*self.outline_items)
+            self.outline_items = []
+            previous = []
+        
+        common = min(len(previous), len(headings))
+        head = 0
+        while head < common and previous[head][:2] == headings[head][:2]:
+            head += 1
+        tail = 0
+        while tail < common - head and previous[-1 - tail][:2] == headings[-1 - tail][:2]:
+            tail += 1
+        
+        items = self.outline_items
+        old_middle = items[head:len(items) - tail]
+        new_middle = headings[head:len(headings) - tail]
+        reused = min(len(old_middle), len(new_middle))
+        for item, heading in zip(old_middle, new_middle):
+            tree.item(item, text=self.outline_label(heading))
+        if len(old_middle) > reused:
+            tree.delete(*old_middle[reused:])
+        new_items = old_middle[:reused]
+        for index, heading in enumerate(new_middle[reused:], start=head + reused):
+            new_items.append(tree.insert('', index, text=self.outline_label(heading)))
+        self.outline_items = items[:head] + new_items + items[len(items) - tail:]
+    
+    def outline_label(self, heading):
+        """按级别缩进显示标题"""
+        level, text = heading[0], heading[1]
+        return '　' * (level - 1) + text
+    
+    def on_outline_select(self, event=None):
+        """跳转到所选标题在输入和输出中的位置"""
+        selection = self.outline_tree.selection()
+        if not selection:
+            return
+        index = self.outline_tree.index(selection[0])
+        if index >= len(self.outline_headings):
+            return
+        _, _, input_line, output_line = self.outline_headings[index]
+        for widget, line in ((self.input_text, input_line), (self.output_text, output_line)):
+            widget.tag_remove('outline_current', '1.0', tk.END)
+            widget.tag_add('outline_current', f'{line}.0', f'{line}.end')
+            widget.yview(f'{line}.0')
+        self.input_text.mark_set('insert', f'{input_line}.0')
+    
     def setup_rules_page(self, parent):
         """设置格式规则页面"""
         # 创建左右分栏
@@ -647,14 +2135,27 @@ class MarkdownConverterGUI:
         preview_frame.pack(fill='both', expand=True, pady=0)
         
         # 预览说明
+        preview_info_frame = tk.Frame(preview_frame, bg='white')
+        preview_info_frame.pack(fill='x', pady=(0, 5))
         preview_info = tk.Label(
-            preview_frame,
+            preview_info_frame,
             text="根据你的设置，以下是转换效果对比预览：",
             font=('微软雅黑', 10),
             bg='white',
             fg='#2c3e50'
         )
-        preview_info.pack(anchor='w', pady=(0, 5))
+        preview_info.pack(side='left')
+        
+        # 预览来源开关：内置示例 / 当前输入文档的片段
+        self.preview_document_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            preview_info_frame,
+            text="用我的文档预览（开头和光标附近的章节）",
+            variable=self.preview_document_var,
+            command=self.update_preview,
+            bg='white',
+            font=('微软雅黑', 9)
+        ).pack(side='right')
         
         # 创建左右对比容器
         preview_container = tk.Frame(preview_frame, bg='white')
@@ -760,41 +2261,36 @@ class MarkdownConverterGUI:
 这是普通文本段落，不会被识别为标题格式。
 以上示例涵盖了所有支持的标题格式，你可以通过设置不同的输入输出规则来测试转换效果。"""
             
+            # 预览片段 [(文本, 起始行号, 初始计数器)]；默认使用内置示例
+            segments = None
+            if input_rules and self.preview_document_var.get():
+                segments = self.preview_document_window(input_rules)
+            if not segments:
+                segments = [(sample_text, 1, None)]
+            
+            # 片段之间插入省略标记
+            gaps = []
+            for (text, first_line, _), (_, next_line, _) in zip(segments, segments[1:]):
+                last_line = first_line + text.count('\n')
+                gaps.append(f"\n……（省略第 {last_line + 1}–{next_line - 1} 行）……\n")
+            gaps.append('')
+            
             # 更新转换前的内容
             self.preview_before_text.delete('1.0', tk.END)
-            self.preview_before_text.insert('1.0', sample_text)
+            self.preview_before_text.insert('1.0', ''.join(text + gap for (text, _, _), gap in zip(segments, gaps)))
             
             # 更新转换后的内容
             if input_rules:
-               
-                # 先找出所有会被转换的原始标题内容
-                original_lines = sample_text.split('\n')
-                converted_titles = set()  # 存储会被转换的标题的清理后内容
-                
-                for original_line in original_lines:
-                    if not original_line.strip():
-                        continue
-                        
-                    for level_name, pattern_key in input_rules.items():
-                        if pattern_key and pattern_key in self.converter.title_patterns:
-                            pattern = self.converter.title_patterns[pattern_key]['pattern']
-                            match = re.match(pattern, original_line)
-                            if match:
-                                # 提取并清理标题内容
-                                if len(match.groups()) == 1:
-                                    title = match.group(1).strip()
-                                elif len(match.groups()) == 2:
-                                    title = match.group(2).strip()
-                                else:
-                                    title = match.group(-1).strip()
-                                
-                                clean_title = self.converter.clean_markdown_symbols(title)
-                                clean_title = self.converter.clean_existing_title_numbers(clean_title)
-                                converted_titles.add(clean_title)
-                                break
-                
-                # 进行转换
-                result = self.converter.convert_text(sample_text, input_rules, output_formats)
+                converted_titles = set()
+                result_parts = []
+                for index, (text, _, counters) in enumerate(segments):
+                    # 解析结果按输入规则缓存，只改输出格式时直接重新编号
+                    document = self.parse_cached(f'preview{index}', text, input_rules)
+                    # 存储会被转换的标题的清理后内容
+                    converted_titles.update(document.titles())
+                    # 进行转换；文档中间的片段从预扫描得到的计数器接着编号
+                    result_parts.append(self.converter.render_document(document, output_formats, counters))
+                result = ''.join(part + gap for part, gap in zip(result_parts, gaps))
                 
                 # 清空转换后的文本框
                 self.preview_after_text.delete('1.0', tk.END)
@@ -833,30 +2329,66 @@ class MarkdownConverterGUI:
             self.preview_after_text.delete('1.0', tk.END)
             self.preview_after_text.insert('1.0', error_msg)
     
+    def on_input_modified(self, event=None):
+        """输入框内容变化：递增修改代数，预览的预扫描缓存随之失效"""
+        if not self.input_text.edit_modified():
+            # 下面清除修改标志时也会触发一次 <<Modified>>
+            return
+        self._edit_generation += 1
+        self._prescan_cache = None
+        # 清除修改标志，下次修改才会再次触发 <<Modified>>
+        self.input_text.edit_modified(False)
+    
+    def preview_document_window(self, input_rules):
+        """从输入框取有界的预览片段：文档开头若干行，以及光标所在章节附近的若干行
+        
+        返回 [(文本, 起始行号, 初始计数器)]，输入为空时返回空列表。
+        只有片段内的行参与转换；跳过的部分只做标题计数预扫描，用于接续编号。
+        """
+        if self.input_text.compare('end-1c', '==', '1.0'):
+            return []
+        total_lines = int(self.input_text.index('end-1c').split('.')[0])
+        cursor_line = int(self.input_text.index('insert').split('.')[0])
+        head_end = min(PREVIEW_HEAD_LINES, total_lines)
+        window_start = max(cursor_line - PREVIEW_CONTEXT_LINES, 1)
+        window_end = min(cursor_line + PREVIEW_CONTEXT_LINES, total_lines)
+        if window_start <= head_end + 1:
+            # 光标就在文档开头附近：开头和光标附近合成一个片段
+            return [(self.input_text.get('1.0', f'{max(head_end, window_end)}.end'), 1, None)]
+        
+        window_lines = self.input_text.get(f'{window_start}.0', f'{window_end}.end').split('\n')
+        # 从光标处向前最近的标题开始，即光标所在章节的开头；没有标题时从最近的空行开始，避免截断段落
+        cursor_index = cursor_line - window_start
+        before_cursor = window_lines[:cursor_index + 1]
+        skip = None
+        for index, _, _ in self.converter.iter_heading_matches(((before_cursor, None),), input_rules,
+                                                                clean_titles=False):
+            skip = index
+        if skip is None:
+            skip = next((index for index in range(cursor_index, -1, -1) if not before_cursor[index].strip()), 0)
+        window_start += skip
+        
+        # 跳过部分（包括开头片段）只统计标题数。内容和规则未变化（修改代数相同）时复用上次的结果，
+        # 光标向后移动只需接着扫描新跳过的行，不必每次从头读取整个前缀
+        rules_key = tuple(input_rules.items())
+        cache = self._prescan_cache
+        if cache is not None and cache[:2] == (self._edit_generation, rules_key) and cache[2] <= window_start:
+            scanned_line, counters = cache[2], cache[3]
+        else:
+            scanned_line, counters = 1, None
+        if scanned_line < window_start:
+            skipped_text = self.input_text.get(f'{scanned_line}.0', f'{window_start - 1}.end')
+            counters = self.converter.count_headings(skipped_text.split('\n'), input_rules, skipped_text, counters)
+        self._prescan_cache = (self._edit_generation, rules_key, window_start, counters)
+        return [(self.input_text.get('1.0', f'{head_end}.end'), 1, None),
+                ('\n'.join(window_lines[skip:]), window_start, counters)]
+    
     def setup_input_format_selectors(self, parent):
         """设置输入格式选择器"""
         self.input_vars = {}
         
         # 可用的输入格式选项
-        input_options = [
-            ('不使用', ''),
-            ('#### 标题', 'markdown_h4'),
-            ('### 标题', 'markdown_h3'),
-            ('## 标题', 'markdown_h2'),
-            ('# 标题', 'markdown_h1'),
-            ('（一）标题', 'chinese_paren'),
-            ('一、标题', 'chinese_dot'),
-            ('(1)标题', 'number_paren'),
-            ('1、标题', 'number_dot'),
-            ('1. 标题', 'number_period'),
-            ('(A)标题', 'letter_paren'),
-            ('A. 标题', 'letter_period'),
-            ('(a)标题', 'letter_paren_lower'),
-            ('- 标题', 'dash'),
-            ('* 标题', 'asterisk'),
-            ('（Ⅰ）标题', 'roman_paren'),
-            ('Ⅰ、标题', 'roman_dot'),
-        ]
+        input_options = INPUT_FORMAT_OPTIONS
         
         # 创建输入格式映射
         self.input_option_mapping = {opt[0]: opt[1] for opt in input_options}
@@ -927,49 +2459,104 @@ class MarkdownConverterGUI:
             )
             preview_btn.pack(side='left', padx=5)
         
-        # 不再需要在这里保存初始状态，因为我们在__init__中已经处理了
-    
-    def setup_output_format_selectors(self, parent):
-        """设置输出格式选择器"""
-        # 格式设置
-        format_options = {
-            'level1': {
-                'label': '一级标题输出',
-                'options': [
-                    ('一、二、三、', 'chinese'),
-                    ('1、2、3、', 'number'),
-                    ('Ⅰ、Ⅱ、Ⅲ、', 'roman')
-                ],
-                'default': 'chinese'
-            },
-            'level2': {
-                'label': '二级标题输出',
-                'options': [
-                    ('（一）（二）（三）', 'chinese_paren'),
-                    ('(1)(2)(3)', 'number_paren'),
-                    ('(A)(B)(C)', 'letter_paren')
-                ],
-                'default': 'chinese_paren'
-            },
-            'level3': {
-                'label': '三级标题输出',
-                'options': [
-                    ('1. 2. 3.', 'number_dot'),
-                    ('A. B. C.', 'letter_dot'),
-                    ('一. 二. 三.', 'chinese_dot')
-                ],
-                'default': 'number_dot'
-            },
-            'level4': {
-                'label': '四级标题输出',
-                'options': [
-                    ('(1)(2)(3)', 'number_paren'),
-                    ('(a)(b)(c)', 'letter_paren'),
-                    ('（一）（二）（三）', 'chinese_paren')
-                ],
-                'default': 'number_paren'
-            }
-        }
+        # 自动识别按钮：根据当前输入文本推断输入格式
+        detect_frame = tk.Frame(parent, bg='white')
+        detect_frame.pack(fill='x', pady=(5, 0))
+        tk.Button(
+            detect_frame,
+            text="🔍 根据输入文本自动识别",
+            command=self.auto_detect_input_rules,
+            bg='#1abc9c',
+            fg='black',
+            font=(self.button_font, 9),
+            padx=10,
+            pady=2
+        ).pack(side='left')
+        
+        # 全角/半角统一开关
+        self.normalize_width_var = tk.BooleanVar(value=False)
+        
+        def on_toggle(self=self):
+            self.update_preview()
+            self.save_current_rules_state()
+        
+        tk.Checkbutton(
+            detect_frame,
+            text="统一全角/半角后再匹配（识别 （1) 1． 等混写）",
+            variable=self.normalize_width_var,
+            command=on_toggle,
+            bg='white',
+            font=(self.default_font, 9)
+        ).pack(side='left', padx=(15, 0))
+        
+        # Markdown 清理阶段开关：勾选的阶段会被清理，取消勾选则原样保留
+        clean_frame = tk.Frame(parent, bg='white')
+        clean_frame.pack(fill='x', pady=(5, 0))
+        tk.Label(
+            clean_frame,
+            text="清理：",
+            font=(self.default_font, 9),
+            bg='white',
+            fg='#2c3e50'
+        ).pack(side='left')
+        self.clean_stage_vars = {}
+        for stage, label in CLEAN_STAGES:
+            self.clean_stage_vars[stage] = tk.BooleanVar(value=True)
+            tk.Checkbutton(
+                clean_frame,
+                text=label,
+                variable=self.clean_stage_vars[stage],
+                command=on_toggle,
+                bg='white',
+                font=(self.default_font, 9)
+            ).pack(side='left')
+        
+        # 不再需要在这里保存初始状态，因为我们在__init__中已经处理了
+    
+    def sample_input_windows(self, prefix_lines=1000, window_count=24, window_lines=50, seed=0):
+        """按行号从输入框抽样，不取出整个文本"""
+        total_lines = int(self.input_text.index('end-1c').split('.')[0])
+        windows = [self.input_text.get('1.0', f'{prefix_lines + 1}.0').split('\n')]
+        rest = total_lines - prefix_lines
+        if rest > 0:
+            rng = random.Random(seed)
+            span = rest / window_count
+            for k in range(window_count):
+                start = prefix_lines + 1 + int(span * (k + rng.random()))
+                windows.append(self.input_text.get(f'{start}.0', f'{start + window_lines}.0').split('\n'))
+        return windows
+    
+    def auto_detect_input_rules(self):
+        """抽样分析输入文本，推断并应用输入格式"""
+        if self.input_text.index('end-1c') == '1.0':
+            self.show_top_right_notification("请先在【文本转换】页面输入要识别的文本！")
+            return
+        
+        detection = self.converter.detect_input_rules(self.sample_input_windows())
+        detected = detection['input_rules']
+        if not detected:
+            self.show_top_right_notification("未能识别出标题格式，请手动设置")
+            self.status_var.set("自动识别失败：未找到标题")
+            return
+        
+        for level, var in self.input_vars.items():
+            var.set(self.internal_to_display.get(detected.get(level), '不使用'))
+        
+        # 与手动修改下拉框的处理一致
+        self.update_preview()
+        self.save_current_rules_state()
+        
+        summary = ' | '.join(
+            f"{level[-1]}: {self.internal_to_display[key]}" for level, key in detected.items()
+        )
+        confidence = int(detection['confidence'] * 100)
+        self.status_var.set(f"自动识别完成（置信度 {confidence}%）：{summary}")
+        self.show_top_right_notification(f"已自动识别输入格式，置信度 {confidence}%")
+    
+    def setup_output_format_selectors(self, parent):
+        """设置输出格式选择器"""
+        # 格式设置
+        format_options = OUTPUT_FORMAT_OPTIONS
         
         # 初始化变量和映射
         self.output_vars = {}
@@ -1039,59 +2626,8 @@ class MarkdownConverterGUI:
     
     def setup_preset_buttons(self, parent):
         """设置预设按钮 - 优化布局"""
-        presets = [
-            {
-                'name': '标准文档格式',
-                'description': '一、（一）1. (1)',
-                'input': {
-                    'level1': '（一）标题',
-                    'level2': '1、标题',
-                    'level3': '- 标题',
-                    'level4': '* 标题'
-                },
-                'output': {
-                    'level1': '一、标题',
-                    'level2': '（一）标题',
-                    'level3': '1. 标题',
-                    'level4': '(1)标题'
-                }
-            },
-            {
-                'name': 'Markdown转中文',
-                'description': '#### → 一、',
-                'input': {
-                    'level1': '#### 标题',
-                    'level2': '### 标题',
-                    'level3': '## 标题',
-                    'level4': '# 标题'
-                },
-                'output': {
-                    'level1': '一、标题',
-                    'level2': '（一）标题',
-                    'level3': '1. 标题',
-                    'level4': '(1)标题'
-                }
-            },
-            {
-                'name': '全数字格式',
-                'description': '1、(1)1. (a)',
-                'input': {
-                    'level1': '（一）标题',
-                    'level2': '- 标题',
-                    'level3': '* 标题',
-                    'level4': '1. 标题'
-                },
-                'output': {
-                    'level1': '1、标题',
-                    'level2': '(1)标题',
-                    'level3': '1. 标题',
-                    'level4': '(a)标题'
-                }
-            }
-        ]
-        
         # 创建网格布局来更好地显示预设按钮
-        for i, preset in enumerate(presets):
+        for i, preset in enumerate(RULE_PRESETS):
             preset_container = tk.Frame(parent, bg='white', relief='raised', bd=1)
             preset_container.pack(fill='x', pady=5, padx=5)  # 减小垂直内边距
             
@@ -1228,33 +2764,10 @@ class MarkdownConverterGUI:
                 self.input_vars[level].set(format_name)
         
         # 设置输出格式
-        output_mappings = {
-            'level1': {
-                '一、标题': '一、二、三、',
-                '1、标题': '1、2、3、',
-                'Ⅰ、标题': 'Ⅰ、Ⅱ、Ⅲ、'
-            },
-            'level2': {
-                '（一）标题': '（一）（二）（三）',
-                '(1)标题': '(1)(2)(3)',
-                '(A)标题': '(A)(B)(C)'
-            },
-            'level3': {
-                '1. 标题': '1. 2. 3.',
-                'A. 标题': 'A. B. C.',
-                '一. 标题': '一. 二. 三.'
-            },
-            'level4': {
-                '(1)标题': '(1)(2)(3)',
-                '(a)标题': '(a)(b)(c)',
-                '（一）标题': '（一）（二）（三）'
-            }
-        }
-        
         for level, format_name in preset['output'].items():
-            if level in self.output_vars and level in output_mappings:
-                if format_name in output_mappings[level]:
-                    self.output_vars[level].set(output_mappings[level][format_name])
+            if level in self.output_vars and level in PRESET_OUTPUT_NAMES:
+                if format_name in PRESET_OUTPUT_NAMES[level]:
+                    self.output_vars[level].set(PRESET_OUTPUT_NAMES[level][format_name])
         
         # 更新预览
         if hasattr(self, 'update_preview'):
@@ -1288,12 +2801,22 @@ class MarkdownConverterGUI:
         self.refresh_btn.bind("<Enter>", on_enter(self.refresh_btn, '#2980b9'))
         self.refresh_btn.bind("<Leave>", on_leave(self.refresh_btn, '#3498db'))
         
+        # 大纲按钮
+        self.outline_btn.bind("<Enter>", on_enter(self.outline_btn, '#7f8c8d'))
+        self.outline_btn.bind("<Leave>", on_leave(self.outline_btn, '#95a5a6'))
+        
         # 复制按钮
         self.copy_selected_btn.bind("<Enter>", on_enter(self.copy_selected_btn, '#2980b9'))
         self.copy_selected_btn.bind("<Leave>", on_leave(self.copy_selected_btn, '#3498db'))
         
         self.copy_all_btn.bind("<Enter>", on_enter(self.copy_all_btn, '#229954'))
         self.copy_all_btn.bind("<Leave>", on_leave(self.copy_all_btn, '#27ae60'))
+        
+        # 打开/保存按钮
+        self.open_btn.bind("<Enter>", on_enter(self.open_btn, '#2980b9'))
+        self.open_btn.bind("<Leave>", on_leave(self.open_btn, '#3498db'))
+        self.save_btn.bind("<Enter>", on_enter(self.save_btn, '#229954'))
+        self.save_btn.bind("<Leave>", on_leave(self.save_btn, '#27ae60'))
     
     def get_input_rules(self):
         """获取输入规则设置"""
@@ -1304,8 +2827,17 @@ class MarkdownConverterGUI:
                 internal_value = self.input_option_mapping.get(display_value)
                 if internal_value:
                     rules[level] = internal_value
+        if rules and self.normalize_width_var.get():
+            rules[NORMALIZE_WIDTH_KEY] = True
+        keep = clean_keep_value(self.kept_clean_stages())
+        if rules and keep:
+            rules[CLEAN_KEEP_KEY] = keep
         return rules
     
+    def kept_clean_stages(self):
+        """取消勾选（保留不清理）的清理阶段"""
+        return [stage for stage, var in self.clean_stage_vars.items() if not var.get()]
+    
     def get_output_formats(self):
         """获取输出格式设置"""
         formats = {}
@@ -1345,10 +2877,11 @@ class MarkdownConverterGUI:
                 self.status_var.set("转换失败：未设置输入格式")
                 return
             
-            result = self.converter.convert_text(input_text, input_rules, output_formats)
-            
-            self.output_text.delete('1.0', tk.END)
-            self.output_text.insert('1.0', result)
+            with profile_conversion(self.profiler, 'gui-convert_text', input_rules, output_formats):
+                result = self.converter.convert_text(input_text, input_rules, output_formats)
+                
+                self.output_text.delete('1.0', tk.END)
+                self.output_text.insert('1.0', result)
             
             self.status_var.set("转换完成！")
             messagebox.showinfo("成功", "文本转换完成！")
@@ -1360,11 +2893,17 @@ class MarkdownConverterGUI:
     
     def auto_convert(self, event=None):
         """自动转换文本，无需点击按钮"""
-        # 获取输入文本并去掉首尾空白
-        input_text = self.input_text.get('1.0', tk.END).strip()
+        # 文件还在分块载入时不转换，载入完成后会统一转换一次
+        if self.file_task is not None and self.file_task['kind'] == 'open':
+            return
+        
+        # 获取输入文本并去掉首尾空白；大纲中的输入行号要加上开头去掉的空行数
+        raw_text = self.input_text.get('1.0', tk.END)
+        input_text = raw_text.strip()
         
         if not input_text:
             self.output_text.delete('1.0', tk.END)
+            self.update_outline([])
             return
         
         try:
@@ -1376,10 +2915,19 @@ class MarkdownConverterGUI:
                 self.output_text.insert('1.0', "请先在【格式规则】页面设置至少一个输入格式！")
                 return
 
-            # 执行转换（convert_text方法已经包含去除多余换行的逻辑）
-            result = self.converter.convert_text(input_text, input_rules, output_formats)
+            # 执行转换；输入文本和输入规则未变化时复用上次的解析结果，只重新编号
+            document = self.parse_cached('input', input_text, input_rules)
+            first_line = 1 + raw_text.count('\n', 0, len(raw_text) - len(raw_text.lstrip()))
+            output_lines = []
+            headings = []
+            # 渲染的同时建立标题索引（每个事件对应一行输出），无需再扫描文本框
+            for event in document.iter_render(self.converter, output_formats):
+                if event.kind == 'title':
+                    headings.append((event.level, event.text, first_line + event.start, len(output_lines) + 1))
+                output_lines.append(event.text)
             self.output_text.delete('1.0', tk.END)
-            self.output_text.insert('1.0', result)
+            self.output_text.insert('1.0', '\n'.join(output_lines))
+            self.update_outline(headings)
             
             if hasattr(self, 'status_var') and self.status_var.get().startswith("格式规则已更改"):
                 self.status_var.set("格式规则已更改，转换结果已更新")
@@ -1391,6 +2939,16 @@ class MarkdownConverterGUI:
             self.output_text.insert('1.0', f"转换过程中出现错误：{str(e)}")
             self.status_var.set(f"转换失败：{str(e)}")
     
+    def parse_cached(self, name, text, input_rules):
+        """解析文本并缓存；文本和输入规则都未变化时直接复用上次的解析结果"""
+        key = (text, tuple(input_rules.items()))
+        cached = self._parse_cache.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        document = self.converter.parse_text(text, input_rules)
+        self._parse_cache[name] = (key, document)
+        return document
+    
     def copy_selected(self):
         """复制选中的文本"""
         try:
@@ -1422,6 +2980,235 @@ class MarkdownConverterGUI:
         self.show_top_right_notification("全部内容已复制到剪贴板！")
 
 
+    def setup_progress_bar(self):
+        """创建后台任务的进度条和取消按钮，任务开始时才显示在状态栏上方"""
+        self.progress_frame = tk.Frame(self.root, bg='#ecf0f1')
+        self.progress_label = tk.Label(
+            self.progress_frame,
+            bg='#ecf0f1',
+            fg='#2c3e50',
+            font=(self.default_font, 9)
+        )
+        self.progress_label.pack(side='left', padx=(10, 10))
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode='determinate', maximum=100)
+        self.progress_bar.pack(side='left', fill='x', expand=True, pady=3)
+        tk.Button(
+            self.progress_frame,
+            text="取消",
+            command=self.cancel_file_task,
+            bg='#95a5a6',
+            fg='black',
+            font=(self.button_font, 9, 'bold'),
+            relief='flat',
+            padx=10,
+            cursor='hand2'
+        ).pack(side='left', padx=10, pady=3)
+    
+    def start_file_task(self, kind, label):
+        """开始一个后台文件任务；同一时间只允许一个任务，返回任务状态字典"""
+        task = {
+            'kind': kind,
+            'cancel': threading.Event(),
+            # 工作线程只往队列里放消息，所有界面操作都在主线程的定时回调中完成
+            'queue': queue.Queue(maxsize=16),
+        }
+        self.file_task = task
+        self.open_btn.config(state='disabled')
+        self.save_btn.config(state='disabled')
+        self.progress_label.config(text=label)
+        self.progress_bar['value'] = 0
+        self.progress_frame.pack(side='bottom', fill='x', after=self.status_bar)
+        return task
+    
+    def finish_file_task(self, status):
+        self.file_task = None
+        self.progress_frame.pack_forget()
+        self.open_btn.config(state='normal')
+        self.save_btn.config(state='normal')
+        self.status_var.set(status)
+    
+    def cancel_file_task(self):
+        if self.file_task is not None:
+            self.file_task['cancel'].set()
+    
+    def open_file(self):
+        """在后台线程读取并解码文件，分块填入输入框"""
+        if self.file_task is not None:
+            return
+        path = filedialog.askopenfilename(
+            title="打开文件",
+            filetypes=[("Markdown/文本文件", "*.md *.markdown *.txt"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        task = self.start_file_task('open', f"正在打开：{os.path.basename(path)}")
+        task['path'] = path
+        self.input_text.delete('1.0', tk.END)
+        self.output_text.delete('1.0', tk.END)
+        self.update_outline([])
+        threading.Thread(target=self._read_file_worker, args=(task, path), daemon=True).start()
+        self.root.after(30, self._pump_open_task, task)
+    
+    def _read_file_worker(self, task, path):
+        """工作线程：识别编码并增量解码，把文本块放入队列（队列满时等待，避免读得比界面快太多）"""
+        try:
+            size = os.path.getsize(path) or 1
+            encoding = detect_file_encoding(path)
+            task['encoding'] = encoding
+            with open_text_input(path, encoding) as f:
+                # size 是磁盘上的文件大小；.gz 文件按压缩数据的读取位置计算进度
+                raw = f.buffer.fileobj if is_compressed_file(path) else f.buffer
+                while not task['cancel'].is_set():
+                    chunk = f.read(GUI_LOAD_CHUNK_CHARS)
+                    if not chunk:
+                        break
+                    progress = min(100, raw.tell() * 100 // size)
+                    self._put_task_message(task, ('data', chunk, progress))
+            self._put_task_message(task, ('done', None, 100))
+        except Exception as e:
+            self._put_task_message(task, ('error', str(e), 0))
+    
+    def _put_task_message(self, task, message):
+        """队列满时等待主线程取走；任务被取消后主线程不再读取，直接放弃"""
+        while not task['cancel'].is_set():
+            try:
+                task['queue'].put(message, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    
+    def _pump_open_task(self, task):
+        """主线程定时回调：在时间片内把已读到的文本块插入输入框"""
+        if task['cancel'].is_set():
+            self.input_text.delete('1.0', tk.END)
+            self.finish_file_task("已取消打开文件")
+            return
+        deadline = time.perf_counter() + GUI_TASK_TIME_SLICE
+        delay = 1
+        while time.perf_counter() < deadline:
+            try:
+                kind, payload, progress = task['queue'].get_nowait()
+            except queue.Empty:
+                # 暂时没有数据，稍后再来，不占用主线程
+                delay = 20
+                break
+            if kind == 'data':
+                self.input_text.insert('end-1c', payload)
+                self.progress_bar['value'] = progress
+            elif kind == 'error':
+                self.input_text.delete('1.0', tk.END)
+                self.finish_file_task(f"打开失败：{payload}")
+                messagebox.showerror("错误", f"打开文件失败：{payload}")
+                return
+            else:
+                self.input_text.mark_set('insert', '1.0')
+                self.input_text.see('1.0')
+                self.finish_file_task(f"已打开：{task['path']}（{task.get('encoding', '')}）")
+                self.auto_convert()
+                return
+        self.root.after(delay, self._pump_open_task, task)
+    
+    def save_result(self):
+        """把转换结果直接从转换器写入文件（不经过输出文本框）；按扩展名选择文本、HTML 或 DOCX"""
+        if self.file_task is not None:
+            return
+        input_text = self.input_text.get('1.0', tk.END).strip()
+        input_rules = self.get_input_rules()
+        if not input_text or not input_rules:
+            self.show_top_right_notification("没有可保存的内容！")
+            self.status_var.set("保存失败：无内容")
+            return
+        path = filedialog.asksaveasfilename(
+            title="保存转换结果",
+            defaultextension='.txt',
+            filetypes=[("文本文件", "*.txt"), ("HTML 文件", "*.html"), ("Word 文档", "*.docx"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        suffix = os.path.splitext(path)[1].lower()
+        output_format = {'.html': 'html', '.htm': 'html', '.docx': 'docx'}.get(suffix, 'text')
+        
+        # 输入未变化时直接使用自动转换缓存的解析结果，否则在工作线程中重新解析
+        key = (input_text, tuple(input_rules.items()))
+        cached = self._parse_cache.get('input')
+        document = cached[1] if cached is not None and cached[0] == key else None
+        
+        task = self.start_file_task('save', f"正在保存：{os.path.basename(path)}")
+        task['path'] = path
+        args = (task, path, output_format, document, input_text, input_rules, self.get_output_formats())
+        threading.Thread(target=self._save_worker, args=args, daemon=True).start()
+        self.root.after(30, self._poll_save_task, task)
+    
+    def _save_worker(self, task, path, output_format, document, input_text, input_rules, output_formats):
+        """工作线程：用独立的转换器渲染并写入临时文件，取消时丢弃临时文件"""
+        messages = task['queue']
+        try:
+            converter = MarkdownConverter()
+            if document is None:
+                document = converter.parse_text(input_text, input_rules)
+            total = max(1, len(document))
+            renderer_class = OUTPUT_RENDERERS[output_format]
+            with atomic_output(path, None if renderer_class.binary else 'utf-8') as out:
+                renderer = renderer_class(out, 'utf-8', document_title(path))
+                renderer.begin()
+                for i, event in enumerate(document.iter_render(converter, output_formats)):
+                    renderer.write(event)
+                    if i % 4096 == 0:
+                        if task['cancel'].is_set():
+                            raise InterruptedError
+                        task['progress'] = i * 100 // total
+                renderer.end()
+            messages.put(('done', None, 100))
+        except InterruptedError:
+            messages.put(('cancelled', None, 0))
+        except Exception as e:
+            messages.put(('error', str(e), 0))
+    
+    def _poll_save_task(self, task):
+        try:
+            kind, payload, _ = task['queue'].get_nowait()
+        except queue.Empty:
+            self.progress_bar['value'] = task.get('progress', 0)
+            self.root.after(50, self._poll_save_task, task)
+            return
+        if kind == 'done':
+            self.finish_file_task(f"已保存：{task['path']}")
+            self.show_top_right_notification("转换结果已保存！")
+        elif kind == 'cancelled':
+            self.finish_file_task("已取消保存")
+        else:
+            self.finish_file_task(f"保存失败：{payload}")
+            messagebox.showerror("错误", f"保存文件失败：{payload}")
+    
+    def toggle_diagnostics(self):
+        """开关诊断模式：监视主循环卡顿，状态栏右侧显示延迟直方图，卡顿记入配置目录下的日志"""
+        if self.stall_monitor and self.stall_monitor.running:
+            self.stall_monitor.stop()
+            self.latency_label.place_forget()
+            self.status_var.set("诊断模式已关闭")
+            return
+        self.stall_monitor = StallMonitor(
+            self.root,
+            on_update=lambda monitor: self.latency_var.set(monitor.summary()),
+            log_path=os.path.join(self.config_dir, STALL_LOG_NAME)
+        )
+        self.latency_var.set(self.stall_monitor.summary())
+        self.latency_label.place(relx=1.0, rely=0.5, anchor='e')
+        self.stall_monitor.start()
+        self.status_var.set(f"诊断模式已开启，卡顿记录写入 {self.stall_monitor.log_path}")
+    
+    def toggle_profiling(self):
+        """开关性能分析：开启后每次点击【转换】都在配置目录的 profiles 下写出 cProfile 结果
+        
+        输入时的自动转换不做分析，否则每次按键都会写出一组文件。
+        """
+        if self.profiler:
+            self.profiler = None
+            self.status_var.set("性能分析已关闭")
+            return
+        self.profiler = ConversionProfiler(os.path.join(self.config_dir, PROFILE_DIR_NAME))
+        self.status_var.set(f"性能分析已开启（仅分析手动转换），结果写入 {self.profiler.profile_dir}")
+    
     def show_top_right_notification(self, message, duration=3000):
         """在右上角显示自动消失的通知"""
         notification = tk.Toplevel(self.root)
@@ -1541,6 +3328,7 @@ class MarkdownConverterGUI:
         if result:
             self.input_text.delete('1.0', tk.END)
             self.output_text.delete('1.0', tk.END)
+            self.update_outline([])
             self.status_var.set("已清空所有内容")
             # 清空后焦点回到输入框
             self.input_text.focus_set()
@@ -1578,6 +3366,9 @@ class MarkdownConverterGUI:
         elif current_tab == "⚙️ 格式规则":
             # 切换到格式规则页面时，保存当前规则状态以便后续比较
             self.save_current_rules_state()
+            # 用文档预览时，输入内容和光标位置可能已经变化
+            if self.preview_document_var.get():
+                self.update_preview()
     
     def _dict_changed(self, dict1, dict2):
         """比较两个字典是否有变化"""
@@ -1623,6 +3414,8 @@ class MarkdownConverterGUI:
             for level, var in self.output_vars.items():
                 display_value = var.get()
                 config['output_formats'][level] = display_value
+            config[NORMALIZE_WIDTH_KEY] = self.normalize_width_var.get()
+            config[CLEAN_KEEP_KEY] = self.kept_clean_stages()
             
             # 写入配置文件
             with open(self.config_file, 'w', encoding='utf-8') as f:
@@ -1654,6 +3447,10 @@ class MarkdownConverterGUI:
                 for level, display_value in config['output_formats'].items():
                     if level in self.output_vars and display_value:
                         self.output_vars[level].set(display_value)
+            self.normalize_width_var.set(bool(config.get(NORMALIZE_WIDTH_KEY)))
+            kept = set(config.get(CLEAN_KEEP_KEY) or ())
+            for stage, var in self.clean_stage_vars.items():
+                var.set(stage not in kept)
             
             # 更新预览
             self.update_preview()
@@ -1680,12 +3477,18 @@ class MarkdownConverterGUI:
             for level, var in self.output_vars.items():
                 display_value = var.get()
                 config['output_formats'][level] = display_value
+            config[NORMALIZE_WIDTH_KEY] = self.normalize_width_var.get()
+            config[CLEAN_KEEP_KEY] = self.kept_clean_stages()
             
             # 写入配置文件
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=4)
         except Exception:
             pass  # 如果保存失败，不阻止关闭
+        # 通知后台文件任务停止（未完成的保存会丢弃临时文件）
+        self.cancel_file_task()
+        if self.stall_monitor:
+            self.stall_monitor.stop()
         self.root.destroy()
     
     def save_config(self):
@@ -1760,9 +3563,10 @@ class MarkdownConverterGUI:
         # 点击任意位置关闭窗口
         popup.bind("<Button-1>", lambda e: popup.destroy())
 
-def main():
+def run_gui(diagnostics=False):
+    """启动图形界面；diagnostics 为 True 时开启主循环卡顿监视"""
     root = tk.Tk()
-    app = MarkdownConverterGUI(root)
+    app = MarkdownConverterGUI(root, diagnostics=diagnostics)
     
     # 设置窗口图标（如果有的话）
     try:
@@ -1780,5 +3584,2405 @@ def main():
     
     root.mainloop()
 
+def load_rule_config(config_path=None):
+    """从配置文件读取规则，返回 (input_rules, output_formats)
+
+    配置文件与界面保存的格式相同（显示名称），也接受内部名称。
+    文件不存在时使用界面的默认规则。
+    """
+    path = config_path or DEFAULT_CONFIG_FILE
+    if not os.path.exists(path):
+        if config_path:
+            raise FileNotFoundError(f"配置文件不存在：{config_path}")
+        return rule_config_from_dict({})
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return rule_config_from_dict(config)
+
+def rule_config_from_dict(config):
+    """把配置字典 {'input_rules': {...}, 'output_formats': {...}} 转换为 (input_rules, output_formats)
+    
+    取值可以是显示名称或内部名称，未给出的级别使用默认规则；未知的级别或取值都会引发 ValueError。
+    顶层的 normalize_width 为 True 时，作为选项加入 input_rules。
+    """
+    if not isinstance(config, dict):
+        raise ValueError("规则配置必须是 JSON 对象")
+    input_rules = dict(DEFAULT_INPUT_RULES)
+    output_formats = {level: cfg['default'] for level, cfg in OUTPUT_FORMAT_OPTIONS.items()}
+    
+    display_to_internal = {display: internal for display, internal in INPUT_FORMAT_OPTIONS}
+    internal_names = set(display_to_internal.values())
+    for level, value in config.get('input_rules', {}).items():
+        if level not in DEFAULT_INPUT_RULES:
+            raise ValueError(f"未知的标题级别：input_rules.{level}")
+        if value in display_to_internal:
+            value = display_to_internal[value]
+        elif value not in internal_names:
+            raise ValueError(f"未知的输入格式：{level} = {value}")
+        if value:
+            input_rules[level] = value
+        else:
+            input_rules.pop(level, None)
+    
+    for level, value in config.get('output_formats', {}).items():
+        if level not in OUTPUT_FORMAT_OPTIONS:
+            raise ValueError(f"未知的标题级别：output_formats.{level}")
+        mapping = dict(OUTPUT_FORMAT_OPTIONS[level]['options'])
+        if value in mapping:
+            value = mapping[value]
+        elif value not in mapping.values():
+            raise ValueError(f"未知的输出格式：{level} = {value}")
+        output_formats[level] = value
+    
+    if config.get(NORMALIZE_WIDTH_KEY):
+        input_rules[NORMALIZE_WIDTH_KEY] = True
+    keep = clean_keep_value(config.get(CLEAN_KEEP_KEY) or ())
+    if keep:
+        input_rules[CLEAN_KEEP_KEY] = keep
+    return input_rules, output_formats
+
+def with_rule_options(input_rules, options_from):
+    """把 options_from 中的规则选项（如全角/半角统一）加到 input_rules 上，用于自动识别得到的规则"""
+    options = {key: options_from[key] for key in RULE_OPTION_KEYS if key in options_from}
+    return dict(input_rules, **options) if options else input_rules
+
+def preset_rule_config(name):
+    """按名称取规则预设，返回 (input_rules, output_formats)"""
+    for preset in RULE_PRESETS:
+        if preset['name'] == name:
+            output_formats = {
+                level: PRESET_OUTPUT_NAMES[level].get(value, value)
+                for level, value in preset['output'].items()
+            }
+            return rule_config_from_dict({'input_rules': preset['input'], 'output_formats': output_formats})
+    raise ValueError(f"未知的预设：{name}")
+
+def rule_config_fingerprint(input_rules, output_formats):
+    """计算规则配置的指纹，用于判断规则是否变化"""
+    payload = json.dumps([input_rules, output_formats], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def file_digest(path, chunk_size=1 << 20):
+    """计算文件内容的哈希值"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_compressed_file(path):
+    """是否为单个压缩文档（.gz，但不是 .tar.gz 归档）"""
+    name = path.lower()
+    return name.endswith(COMPRESSED_SUFFIX) and not name.endswith('.tar.gz')
+
+def is_archive_file(path):
+    """是否为按成员读取的归档（zip、tar、tar.gz）"""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def is_convertible_file(path):
+    """判断文件是否需要转换；压缩文档按去掉 .gz 后的扩展名判断"""
+    name = path.lower()
+    if is_compressed_file(name):
+        name = name[:-len(COMPRESSED_SUFFIX)]
+    return name.endswith(CONVERTIBLE_EXTENSIONS)
+
+def iter_convertible_files(root_dir, exclude_dir=None, include_archives=False):
+    """遍历目录下需要转换的文件，产出 (绝对路径, 相对路径)；include_archives 为 True 时也产出归档文件"""
+    root_dir = os.path.abspath(root_dir)
+    exclude_dir = os.path.abspath(exclude_dir) if exclude_dir else None
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        # 不进入输出目录，避免把结果再次当作输入
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if not d.startswith('.') and os.path.join(dirpath, d) != exclude_dir
+        )
+        for name in sorted(filenames):
+            if name.startswith('.') or not (is_convertible_file(name) or include_archives and is_archive_file(name)):
+                continue
+            path = os.path.join(dirpath, name)
+            yield path, os.path.relpath(path, root_dir)
+
+def mirrored_output_path(rel_path, output_dir, suffix='.txt'):
+    """根据相对路径计算镜像输出树中的文件路径（扩展名统一替换为 suffix，压缩文档同时去掉 .gz）
+    
+    suffix 为 None 时保留原扩展名。
+    """
+    if is_compressed_file(rel_path):
+        rel_path = rel_path[:-len(COMPRESSED_SUFFIX)]
+    if suffix is None:
+        return os.path.join(output_dir, rel_path)
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0] + suffix)
+
+def archive_stem(path):
+    """归档文件名去掉归档扩展名，用作其成员的输出目录名"""
+    name = os.path.basename(path)
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+def temp_output_path(path):
+    """目标文件旁的临时文件名：带主机名和进程号，共享目录上不同主机的同号进程也不会冲突"""
+    return f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+
+@contextlib.contextmanager
+def atomic_output(path, encoding='utf-8'):
+    """写入临时文件，成功后再替换目标文件，避免其他程序读到写了一半的结果
+    
+    encoding 为 None 时以二进制方式打开（用于 DOCX 等二进制输出）。
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = temp_output_path(path)
+    if encoding is None:
+        f = open(tmp_path, 'wb')
+    else:
+        f = open(tmp_path, 'w', encoding=encoding, errors='replace', newline='\n')
+    try:
+        yield f
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    f.close()
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+def write_file_atomic(path, text, encoding='utf-8'):
+    """先写临时文件再替换"""
+    with atomic_output(path, encoding) as f:
+        f.write(text)
+
+def _skip_utf8_continuation(data):
+    """跳过开头不完整的 UTF-8 字符（最多 3 个后续字节）"""
+    skip = 0
+    while skip < min(3, len(data)) and 0x80 <= data[skip] <= 0xBF:
+        skip += 1
+    return data[skip:]
+
+def detect_encoding(sample, extra_samples=()):
+    """根据字节样本判断编码，返回 Python 编解码器名称
+    
+    依次检查 BOM、无 BOM 的 UTF-16（0 字节集中在奇数或偶数位置）、
+    UTF-8 是否能解码（允许样本末尾截断），都不满足时按 GB18030（GBK 的超集）处理。
+    extra_samples 为文件中间抽取的其他样本，只用于确认 UTF-8。
+    """
+    if sample.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+        return 'utf-32'
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    
+    zeros = sample.count(0)
+    if zeros and zeros >= len(sample) // 100:
+        odd_zeros = sample[1::2].count(0)
+        if odd_zeros >= zeros * 0.9:
+            return 'utf-16-le'
+        if odd_zeros <= zeros * 0.1:
+            return 'utf-16-be'
+    
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        for extra in extra_samples:
+            codecs.getincrementaldecoder('utf-8')().decode(_skip_utf8_continuation(extra), final=False)
+    except UnicodeDecodeError:
+        return 'gb18030'
+    return 'utf-8'
+
+def detect_file_encoding(path, sample_size=ENCODING_SAMPLE_SIZE, extra_count=4):
+    """读取文件开头以及中间几处的有限字节样本来判断编码"""
+    size = input_file_size(path)
+    with open_binary_input(path) as f:
+        sample = f.read(sample_size)
+        extra = []
+        if size > sample_size * 2:
+            chunk = sample_size // 4
+            for k in range(1, extra_count + 1):
+                f.seek(size * k // (extra_count + 1))
+                extra.append(f.read(chunk))
+    return detect_encoding(sample, extra)
+
+def is_line_splittable_encoding(encoding):
+    """该编码下字节 0x0A 是否一定表示换行（UTF-16/32 不满足）"""
+    return not codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32'))
+
+def open_text_input(path, encoding=None, newline=None, errors='replace'):
+    """以文本流打开输入文件：自动识别编码、增量解码、统一换行符；.gz 文件边读边解压
+    
+    newline 和 errors 的含义同 open()；newline='' 时保留原换行符。
+    """
+    encoding = encoding or detect_file_encoding(path)
+    if is_compressed_file(path):
+        return gzip.open(path, 'rt', encoding=encoding, errors=errors, newline=newline)
+    return open(path, 'r', encoding=encoding, errors=errors, newline=newline)
+
+def open_binary_input(path):
+    """以二进制流打开输入文件；.gz 文件边读边解压（支持向后定位，代价是顺序解压）"""
+    return gzip.open(path, 'rb') if is_compressed_file(path) else open(path, 'rb')
+
+def input_file_size(path):
+    """输入文件解压后的大小；.gz 取文件尾记录的原始大小（对 4GB 取模，只用于抽样定位）"""
+    if not is_compressed_file(path):
+        return os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < 4:
+            return 0
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0]
+
+def iter_text_blocks(stream, block_size=STREAM_BLOCK_CHARS):
+    """从文本流按块读取，每块在换行处截断
+    
+    各块之间补上 '\\n' 拼接起来就是完整文本，因此逐块 split('\\n') 得到的行与整体 split 相同。
+    """
+    carry = ''
+    while True:
+        chunk = stream.read(block_size)
+        if not chunk:
+            break
+        chunk = carry + chunk
+        cut = chunk.rfind('\n')
+        if cut < 0:
+            carry = chunk
+            continue
+        yield chunk[:cut]
+        carry = chunk[cut + 1:]
+    yield carry
+
+def write_events(out, events):
+    """把转换事件逐行写入文本流"""
+    write = out.write
+    for event in events:
+        write(event.text)
+        write('\n')
+
+# 文件名中不允许的字符（按 Windows 的限制，各平台统一）
+_FILE_NAME_INVALID_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+# XML 1.0 不允许的控制字符（HTML 和 DOCX 输出时去掉）
+_XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+class TextRenderer:
+    """纯文本输出：每个事件一行，与 convert_text 的结果一致"""
+    
+    binary = False
+    
+    def __init__(self, out, encoding='utf-8', title=''):
+        self.out = out
+    
+    def begin(self):
+        pass
+    
+    def write(self, event):
+        self.out.write(event.text)
+        self.out.write('\n')
+    
+    def end(self):
+        pass
+
+class HtmlRenderer:
+    """HTML 输出：标题写为 <h1>~<h4>（含生成的编号），每个正文行一个 <p>（与 DOCX 输出一致）
+    
+    逐个事件写入文本流，不在内存中保留整篇文档。
+    """
+    
+    binary = False
+    
+    def __init__(self, out, encoding='utf-8', title=''):
+        self.out = out
+        self.encoding = encoding
+        self.title = title
+    
+    @staticmethod
+    def escape(text):
+        return html.escape(_XML_INVALID_CHARS.sub('', text), quote=False)
+    
+    def begin(self):
+        self.out.write(
+            '<!DOCTYPE html>\n<html lang="zh-CN">\n<head>\n'
+            f'<meta charset="{self.encoding}">\n'
+            f'<title>{self.escape(self.title)}</title>\n'
+            '</head>\n<body>\n'
+        )
+    
+    def write(self, event):
+        if event.kind == 'title':
+            level = min(max(event.level, 1), 6)
+            self.out.write(f'<h{level}>{self.escape(event.text)}</h{level}>\n')
+        else:
+            self.out.write(f'<p>{self.escape(event.text)}</p>\n')
+    
+    def end(self):
+        self.out.write('</body>\n</html>\n')
+
+class DocxRenderer:
+    """DOCX 输出：标题使用“标题 1~4”样式，每个非空正文行一个段落
+    
+    固定的部件先写入 zip，word/document.xml 最后以流的方式边转换边压缩写入，
+    输出流可以是文件或不可 seek 的管道（二进制）。
+    """
+    
+    binary = True
+    
+    WORD_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '<Override PartName="/word/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+        '</Types>'
+    )
+    
+    PACKAGE_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        '</Relationships>'
+    )
+    
+    DOCUMENT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    )
+    
+    # 各级标题的字号（半磅）
+    HEADING_SIZES = {1: 32, 2: 30, 3: 28, 4: 24}
+    
+    def __init__(self, out, encoding='utf-8', title=''):
+        self.out = out
+        self.zip_file = None
+        self.document = None
+    
+    @classmethod
+    def styles_xml(cls):
+        heading_styles = ''.join(
+            f'<w:style w:type="paragraph" w:styleId="Heading{level}">'
+            f'<w:name w:val="heading {level}"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+            f'<w:uiPriority w:val="9"/><w:qFormat/>'
+            f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/>'
+            f'<w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+            f'<w:rPr><w:b/><w:sz w:val="{size}"/><w:szCs w:val="{size}"/></w:rPr>'
+            f'</w:style>'
+            for level, size in cls.HEADING_SIZES.items()
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:styles xmlns:w="{cls.WORD_NS}">'
+            '<w:docDefaults><w:rPrDefault><w:rPr>'
+            '<w:rFonts w:eastAsia="宋体"/><w:sz w:val="24"/><w:szCs w:val="24"/><w:lang w:eastAsia="zh-CN"/>'
+            '</w:rPr></w:rPrDefault></w:docDefaults>'
+            '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/>'
+            '<w:pPr><w:spacing w:after="120"/></w:pPr></w:style>'
+            + heading_styles +
+            '</w:styles>'
+        )
+    
+    @staticmethod
+    def run_xml(text):
+        text = html.escape(_XML_INVALID_CHARS.sub('', text), quote=False)
+        return f'<w:r><w:t xml:space="preserve">{text}</w:t></w:r>'
+    
+    def begin(self):
+        self.zip_file = zipfile.ZipFile(self.out, 'w', zipfile.ZIP_DEFLATED)
+        self.zip_file.writestr('[Content_Types].xml', self.CONTENT_TYPES)
+        self.zip_file.writestr('_rels/.rels', self.PACKAGE_RELS)
+        self.zip_file.writestr('word/_rels/document.xml.rels', self.DOCUMENT_RELS)
+        self.zip_file.writestr('word/styles.xml', self.styles_xml())
+        # 文档大小未知，按 ZIP64 写入以支持超过 2GB 的正文
+        member = self.zip_file.open('word/document.xml', 'w', force_zip64=True)
+        self.document = io.TextIOWrapper(member, encoding='utf-8', newline='\n')
+        self.document.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<w:document xmlns:w="{self.WORD_NS}"><w:body>\n'
+        )
+    
+    def write(self, event):
+        if event.kind == 'title':
+            self.document.write(
+                f'<w:p><w:pPr><w:pStyle w:val="Heading{event.level}"/></w:pPr>'
+                f'{self.run_xml(event.text)}</w:p>\n'
+            )
+        elif event.text.strip():
+            self.document.write(f'<w:p>{self.run_xml(event.text)}</w:p>\n')
+    
+    def end(self):
+        self.document.write('<w:sectPr/></w:body></w:document>\n')
+        self.document.close()
+        self.zip_file.close()
+
+OUTPUT_RENDERERS = {'text': TextRenderer, 'html': HtmlRenderer, 'docx': DocxRenderer}
+
+def render_events(renderer, events):
+    """依次把事件交给渲染器写出"""
+    renderer.begin()
+    write = renderer.write
+    for event in events:
+        write(event)
+    renderer.end()
+
+def document_title(path):
+    """用文件名（不含扩展名，压缩文档同时去掉 .gz）作为 HTML 文档标题"""
+    name = os.path.basename(path)
+    if is_compressed_file(name):
+        name = name[:-len(COMPRESSED_SUFFIX)]
+    return os.path.splitext(name)[0]
+
+def convert_file(converter, src_path, dst_path, input_rules, output_formats,
+                 encoding=None, output_encoding='utf-8', output_format='text'):
+    """流式转换单个文件并写入目标路径；encoding 为 None 时自动识别输入编码
+    
+    output_format 为 'text'、'html' 或 'docx'，各渲染器都直接消费转换事件，边转换边写出。
+    """
+    renderer_class = OUTPUT_RENDERERS[output_format]
+    with open_text_input(src_path, encoding) as f, \
+            atomic_output(dst_path, None if renderer_class.binary else output_encoding) as out:
+        renderer = renderer_class(out, output_encoding, document_title(src_path))
+        render_events(renderer, converter.iter_stream_events(f, input_rules, output_formats))
+
+def decode_document_bytes(data, encoding='utf-8'):
+    """解码并统一换行符，结果与文本模式读取文件一致"""
+    return data.decode(encoding, errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+def find_shard_boundaries(converter, src_path, input_rules, shard_count, encoding='utf-8'):
+    """返回各分片的起始字节偏移
+    
+    从均分的目标偏移向后寻找最近的标题行（任意级别）作为分片起点。
+    标题行会结束当前段落，因此分片之间只有标题编号相互依赖，合并时由 convert_file_parallel 续接。
+    """
+    size = os.path.getsize(src_path)
+    rules = converter.sort_rules(input_rules)
+    normalize = bool(input_rules.get(NORMALIZE_WIDTH_KEY))
+    clean_title = converter.title_cleaner_for(input_rules)
+    boundaries = [0]
+    with open(src_path, 'rb') as f:
+        for k in range(1, shard_count):
+            target = max(size * k // shard_count, boundaries[-1] + 1)
+            if target >= size:
+                break
+            # 从 target-1 读掉半行，保证 target 恰好在行首时不会跳过该行
+            f.seek(target - 1)
+            f.readline()
+            while True:
+                pos = f.tell()
+                line = f.readline()
+                if not line:
+                    return boundaries
+                # 按统一换行后的第一行判断，单独的 \r 也算换行
+                first_line = decode_document_bytes(line, encoding).split('\n', 1)[0]
+                if converter.match_title(first_line.strip(), rules, normalize, clean_title):
+                    boundaries.append(pos)
+                    break
+    return boundaries
+
+class ByteRangeReader(io.RawIOBase):
+    """只读出文件 [start, end) 字节范围的原始流，供 TextIOWrapper 增量解码一个分片"""
+    
+    def __init__(self, f, start, end):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = end - start
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        view = memoryview(buffer)[:self.remaining]
+        n = self.f.readinto(view)
+        self.remaining -= n
+        return n
+
+def _convert_shard(job):
+    """在子进程中流式转换一个分片（计数器从零开始），结果写入分片文件
+    
+    返回 (需要续接编号的标题 [(输出行号, 级别, 分片内计数, 标题)], 分片结束时的计数器, 分片内最高的标题级别)。
+    在分片内出现更高级标题之前的标题，其计数没有在分片内重置过，实际编号是进入分片时的计数加上分片内计数；
+    其余标题的编号与之前的分片无关。
+    """
+    src_path, start, end, encoding, input_rules, output_formats, part_path = job
+    converter = MarkdownConverter()
+    carried = []
+    state = {'shallowest': 5, 'carry': False}
+    
+    def track(events):
+        # number_events 产出一个标题后才取下一个事件，所以收到输出事件时 state 对应的正是该标题；
+        # 转换后为空、不会输出的标题也在这里计入 shallowest
+        for event in events:
+            if event.kind == 'title':
+                state['carry'] = event.level <= state['shallowest']
+                state['shallowest'] = min(state['shallowest'], event.level)
+            yield event
+    
+    count = 0
+    with open(src_path, 'rb') as raw, \
+            io.TextIOWrapper(io.BufferedReader(ByteRangeReader(raw, start, end)),
+                             encoding=encoding, errors='replace') as f, \
+            open(part_path, 'w', encoding='utf-8', newline='\n') as out:
+        events = converter.number_events(track(converter.iter_stream_parse(f, input_rules)), output_formats)
+        for event in events:
+            if event.kind == 'title' and state['carry']:
+                carried.append((count, event.level, converter.counters[f'level{event.level}'], event.title))
+            out.write(event.text)
+            out.write('\n')
+            count += 1
+    return carried, dict(converter.counters), state['shallowest']
+
+def convert_file_parallel(src_path, out, input_rules, output_formats, jobs, encoding=None):
+    """按标题行把单个大文档分片，在进程池中并行转换后写入 out（文本流）
+    
+    分片可以从任意级别的标题开始，一级标题很少的文档也能均匀分片；每个分片边读边转换，
+    内存占用与分片大小无关。各分片以零计数转换，合并时依次求出进入每个分片时的各级计数，
+    只重写需要续接编号的标题。
+    UTF-16/32 编码无法按字节找行首，改为单进程流式转换。
+    """
+    converter = MarkdownConverter()
+    encoding = encoding or detect_file_encoding(src_path)
+    if not is_line_splittable_encoding(encoding):
+        with open_text_input(src_path, encoding) as f:
+            write_events(out, converter.iter_stream_events(f, input_rules, output_formats))
+        return
+    size = os.path.getsize(src_path)
+    shard_count = max(1, min(jobs * 4, size // PARALLEL_MIN_SHARD))
+    boundaries = find_shard_boundaries(converter, src_path, input_rules, shard_count, encoding)
+    ranges = list(zip(boundaries, boundaries[1:] + [size]))
+    
+    with tempfile.TemporaryDirectory(prefix='md_shards_') as tmp_dir:
+        shard_jobs = [
+            (src_path, start, end, encoding, input_rules, output_formats, os.path.join(tmp_dir, f"{n:05d}.part"))
+            for n, (start, end) in enumerate(ranges)
+        ]
+        if len(shard_jobs) == 1:
+            results = [_convert_shard(shard_jobs[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(shard_jobs))) as pool:
+                results = list(pool.map(_convert_shard, shard_jobs))
+        
+        # 进入每个分片时的各级计数：上一分片内被更高级标题重置过的级别取其分片内计数，否则累加
+        counters = {f'level{n}': 0 for n in range(1, 5)}
+        for job, (carried, final_counters, shallowest) in zip(shard_jobs, results):
+            rewrites = {index: (level, number, title) for index, level, number, title in carried
+                        if counters[f'level{level}']}
+            with open(job[-1], 'r', encoding='utf-8', newline='\n') as part:
+                if not rewrites:
+                    shutil.copyfileobj(part, out)
+                else:
+                    for index, line in enumerate(part):
+                        if index in rewrites:
+                            level, number, title = rewrites[index]
+                            converter.counters[f'level{level}'] = counters[f'level{level}'] + number - 1
+                            line = converter.get_formatted_title(level, title, output_formats) + '\n'
+                        out.write(line)
+            for n in range(1, 5):
+                key = f'level{n}'
+                counters[key] = final_counters[key] if shallowest < n else counters[key] + final_counters[key]
+
+def collect_batch_jobs(inputs, output, suffix='.txt', include_archives=False):
+    """把命令行给出的文件和目录展开为 (源文件, 目标文件) 列表；suffix 为输出文件扩展名（None 时保留原扩展名）
+    
+    include_archives 为 True 时归档文件按目录对待：目标为其成员的输出目录。
+    output 为归档文件时，目标路径相对于 output 的部分就是结果在归档中的成员名。
+    """
+    jobs = []
+    dir_inputs = [p for p in inputs if os.path.isdir(p) or include_archives and is_archive_file(p)]
+    for path in inputs:
+        if os.path.isdir(path):
+            # 多个输入目录时，每个目录镜像到输出目录下的同名子目录
+            target_dir = output
+            if len(dir_inputs) > 1:
+                target_dir = os.path.join(output, os.path.basename(os.path.abspath(path)))
+            for src, rel in iter_convertible_files(path, exclude_dir=output, include_archives=include_archives):
+                if is_archive_file(src):
+                    jobs.append((src, os.path.join(target_dir, os.path.dirname(rel), archive_stem(rel))))
+                else:
+                    jobs.append((src, mirrored_output_path(rel, target_dir, suffix)))
+        elif os.path.isfile(path):
+            if include_archives and is_archive_file(path):
+                jobs.append((path, output if len(dir_inputs) == 1 else os.path.join(output, archive_stem(path))))
+            elif len(inputs) == 1 and not os.path.isdir(output) and not is_archive_file(output):
+                jobs.append((path, output))
+            else:
+                jobs.append((path, mirrored_output_path(os.path.basename(path), output, suffix)))
+        else:
+            raise FileNotFoundError(f"输入不存在：{path}")
+    return jobs
+
+def convert_file_sharded(src_path, dst_path, input_rules, output_formats, jobs,
+                         encoding=None, output_encoding='utf-8'):
+    """并行转换单个大文件，先写临时文件再替换"""
+    with atomic_output(dst_path, output_encoding) as out:
+        convert_file_parallel(src_path, out, input_rules, output_formats, jobs, encoding)
+
+def detect_file_rules(converter, path, encoding=None):
+    """抽样文件并推断输入规则"""
+    return converter.detect_input_rules(sample_file_windows(path, encoding=encoding))
+
+def run_detect(inputs, encoding=None):
+    """对每个输入文件输出一行 JSON 形式的识别结果"""
+    converter = MarkdownConverter()
+    for path in inputs:
+        files = [src for src, _ in iter_convertible_files(path)] if os.path.isdir(path) else [path]
+        for src in files:
+            file_encoding = encoding or detect_file_encoding(src)
+            detection = detect_file_rules(converter, src, file_encoding)
+            detection['file'] = src
+            detection['encoding'] = file_encoding
+            print(json.dumps(detection, ensure_ascii=False))
+
+def run_outline(inputs, input_rules, output_formats, auto_rules=False, encoding=None, out=None):
+    """输出每个输入文件的标题大纲：每个标题一行 JSON（文件、级别、编号、标题、源行号）"""
+    out = out or sys.stdout
+    converter = MarkdownConverter()
+    for path in inputs:
+        files = [src for src, _ in iter_convertible_files(path)] if os.path.isdir(path) else [path]
+        for src in files:
+            file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+            with open_text_input(src, file_encoding) as f:
+                for entry in converter.iter_stream_outline(f, file_rules, output_formats):
+                    record = {'file': src}
+                    record.update(entry._asdict())
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+class SourceWindow:
+    """流式转换时保留尚未比较的源行，供补丁模式取事件对应的原文
+    
+    blocks() 产出交给 parse_blocks 的行块，同时把各块的行追加到窗口中；
+    release(upto) 丢弃 upto 之前的行，窗口大小只取决于尚未比较的部分。
+    多看一块：产出最后一块之前就已知道总行数 total 和末行 last_line。
+    
+    文本流应以 newline='' 打开：窗口中的行保留原换行符的 '\r' 和开头的 BOM，
+    交给 parse_blocks 的行则去掉 BOM（'\r' 会在解析时随首尾空白一起去掉）。
+    newline 为源文本第一行使用的换行符。
+    """
+    
+    RELEASE_LINES = 65536
+    
+    def __init__(self):
+        self.lines = []
+        self.base = 0
+        self.total = None
+        self.last_line = None
+        self.newline = '\n'
+        self.first_block = True
+    
+    def blocks(self, converter, stream, input_rules):
+        pending = None
+        for block in iter_text_blocks(stream):
+            if pending is not None:
+                yield self._add(converter, pending, input_rules)
+            pending = block
+        lines = pending.split('\n')
+        self.total = self.base + len(self.lines) + len(lines)
+        self.last_line = lines[-1]
+        yield self._add(converter, pending, input_rules, lines)
+    
+    def _add(self, converter, block, input_rules, lines=None):
+        if lines is None:
+            lines = block.split('\n')
+        self.lines.extend(lines)
+        if self.first_block:
+            self.first_block = False
+            if len(lines) > 1 and lines[0].endswith('\r'):
+                self.newline = '\r\n'
+            if block.startswith('\ufeff'):
+                block = block[1:]
+                lines = [lines[0][1:]] + lines[1:]
+        return lines, converter._line_kinds_for(block, lines, input_rules)
+    
+    def get(self, index):
+        return self.lines[index - self.base]
+    
+    def release(self, upto):
+        if upto - self.base >= self.RELEASE_LINES:
+            del self.lines[:upto - self.base]
+            self.base = upto
+
+def iter_diff_lines(converter, stream, input_rules, output_formats):
+    """边转换边与源文本逐行比较，产出 (标记, 行文字)：' ' 未变、'-' 删除、'+' 新增、'\\' 无换行说明
+    
+    每个事件对应源行 [start, end)，与事件之间没有被任何事件覆盖的源行（空行、分隔线）为删除；
+    事件只覆盖一行且转换结果与该行（去掉行尾 '\\r'）相同时未变，否则删除这些源行、新增转换结果。
+    stream 须以 newline='' 打开（见 SourceWindow）：未变和删除的行保留原文（包括 '\\r'），
+    新增的行使用源文本的换行符，因此补丁能直接应用到原文件上。转换结果每行都以换行结尾。
+    """
+    source = SourceWindow()
+    events = converter.number_events(converter.parse_blocks(source.blocks(converter, stream, input_rules), input_rules),
+                                     output_formats)
+    
+    def old_line(index):
+        # 源文本不以换行结尾时，最后一行与转换结果（以换行结尾）不可能相同
+        line = source.get(index)
+        missing_newline = source.total is not None and index == source.total - 1 and line != ''
+        return line, missing_newline
+    
+    def deleted(index):
+        line, missing_newline = old_line(index)
+        yield '-', line
+        if missing_newline:
+            yield '\\', ' No newline at end of file'
+    
+    position = 0
+    for event in events:
+        for index in range(position, event.start):
+            yield from deleted(index)
+        if event.end - event.start == 1:
+            line, missing_newline = old_line(event.start)
+            if (line[:-1] if line.endswith('\r') else line) == event.text and not missing_newline:
+                yield ' ', line
+                position = event.end
+                source.release(position)
+                continue
+        for index in range(event.start, event.end):
+            yield from deleted(index)
+        yield '+', event.text + source.newline[:-1]
+        position = event.end
+        source.release(position)
+    # 源文本以换行结尾时 split 得到的最后一个空串不是一行
+    end = source.total - 1 if source.last_line == '' else source.total
+    for index in range(position, end):
+        yield from deleted(index)
+
+def iter_unified_diff(diff_lines, context=3):
+    """把 iter_diff_lines 的逐行比较结果整理为统一差异格式（unified diff）的各块，逐行产出
+    
+    只缓存当前块（hunk）和两块之间最多 2 × context 个未变的行；没有变化时不产出任何内容。
+    文件头（--- / +++ 两行）由调用方在第一行之前写出。
+    """
+    hunk = []  # 当前块的 (标记, 行文字)
+    hunk_old = hunk_new = 0  # 当前块在新旧文本中的起始行号（从 0 开始）
+    after = 0  # 当前块最后一处变化之后已经收入块中的未变行数
+    lead = deque(maxlen=context)  # 最近的未变行，作为下一块开头的上下文
+    equal_run = 0  # 最后一处变化之后连续的未变行数
+    old_no = new_no = 0
+    
+    def flush():
+        old_count = sum(1 for tag, _ in hunk if tag in ' -')
+        new_count = sum(1 for tag, _ in hunk if tag in ' +')
+        old_start = hunk_old + 1 if old_count else hunk_old
+        new_start = hunk_new + 1 if new_count else hunk_new
+        yield f"@@ -{old_start},{old_count} +{new_start},{new_count} @@\n"
+        for tag, text in hunk:
+            yield f"{tag}{text}\n"
+    
+    for tag, text in diff_lines:
+        if tag == ' ':
+            if hunk and after < context:
+                hunk.append((tag, text))
+                after += 1
+            lead.append(text)
+            equal_run += 1
+            old_no += 1
+            new_no += 1
+            continue
+        if hunk and equal_run <= 2 * context:
+            # 与上一块之间的未变行不多，合并为一块：补上尚未收入块中的那部分
+            hunk.extend((' ', line) for line in list(lead)[len(lead) - (equal_run - after):])
+        else:
+            if hunk:
+                yield from flush()
+            hunk = [(' ', line) for line in lead]
+            hunk_old, hunk_new = old_no - len(lead), new_no - len(lead)
+        hunk.append((tag, text))
+        after = equal_run = 0
+        lead.clear()
+        if tag == '-':
+            old_no += 1
+        elif tag == '+':
+            new_no += 1
+    if hunk:
+        yield from flush()
+
+def diff_file(converter, src, out, from_name, to_name, input_rules, output_formats, encoding=None, context=3):
+    """把单个文件的补丁写入二进制流 out，返回是否有变化
+    
+    补丁内容按源文件的编码写出（无法解码的字节原样保留），文件名按文件系统编码写出；
+    UTF-8 的 BOM 作为第一行原文的一部分保留。UTF-16/32 的文件无法逐行打补丁，不支持。
+    """
+    encoding = codecs.lookup(encoding or detect_file_encoding(src)).name
+    if not is_line_splittable_encoding(encoding):
+        raise ValueError(f"补丁模式不支持 {encoding} 编码的源文件")
+    if encoding == 'utf-8-sig':
+        encoding = 'utf-8'
+    header = b'--- ' + os.fsencode(from_name) + b'\n+++ ' + os.fsencode(to_name) + b'\n'
+    with open_text_input(src, encoding, newline='', errors='surrogateescape') as f:
+        diff_lines = iter_diff_lines(converter, f, input_rules, output_formats)
+        for line in iter_unified_diff(diff_lines, context):
+            if header:
+                out.write(header)
+                header = None
+            out.write(line.encode(encoding, 'surrogateescape'))
+    return header is None
+
+def run_diff(inputs, input_rules, output_formats, auto_rules=False, encoding=None, context=3, out=None):
+    """把转换结果相对于源文件的统一差异格式补丁写入二进制流 out，多个文件依次写入同一个补丁
+    
+    补丁中的源文件名为 a/相对路径，转换结果为 b/相对路径（扩展名为 .txt）；没有变化的文件不输出。
+    返回失败的文件数。
+    """
+    out = out or sys.stdout.buffer
+    converter = MarkdownConverter()
+    failures = 0
+    for path in inputs:
+        if os.path.isdir(path):
+            files = list(iter_convertible_files(path))
+        else:
+            files = [(path, os.path.basename(path))]
+        for src, rel in files:
+            rel = rel.replace(os.sep, '/')
+            to_name = mirrored_output_path(rel, '', OUTPUT_FILE_SUFFIXES['text']).replace(os.sep, '/')
+            try:
+                file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+                diff_file(converter, src, out, f"a/{rel}", f"b/{to_name}", file_rules, output_formats,
+                          file_encoding, context)
+            except Exception as e:
+                failures += 1
+                print(f"生成补丁失败：{src}：{e}", file=sys.stderr)
+    return failures
+
+def run_check(inputs, input_rules, output_formats, auto_rules=False, encoding=None, fail_fast=False, out=None):
+    """检查输入文件的标题是否已经符合输出格式，不一致的标题每个一行：“文件:行号: 说明”
+    
+    fail_fast 为 True 时每个文件在第一个不一致处停止读取，只报告这一处。
+    返回不一致的文件数。
+    """
+    out = out or sys.stdout
+    converter = MarkdownConverter()
+    checked = failed = 0
+    for path in inputs:
+        files = [src for src, _ in iter_convertible_files(path)] if os.path.isdir(path) else [path]
+        for src in files:
+            file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+            checked += 1
+            with open_text_input(src, file_encoding) as f:
+                violations = converter.iter_stream_check(f, file_rules, output_formats)
+                if fail_fast:
+                    violations = itertools.islice(violations, 1)
+                found = False
+                for violation in violations:
+                    found = True
+                    out.write(f"{src}:{violation.line}: {violation.level}级标题应为“{violation.expected}”，"
+                              f"实际为“{violation.actual}”\n")
+            failed += found
+    print(f"已检查 {checked} 个文件，{failed} 个文件的标题与输出格式不一致", file=sys.stderr)
+    return failed
+
+def renumber_stream(converter, stream, out, input_rules, output_formats, encoding):
+    """把文本流 stream 重新编号后按 encoding 编码写入二进制流 out
+    
+    stream 应以 newline=''、errors='surrogateescape' 打开，这样标题以外的内容
+    （包括换行符和无法解码的字节）写出后与输入逐字节相同。
+    """
+    encoder = codecs.getincrementalencoder(encoding)(errors='surrogateescape')
+    separator = ''
+    for lines in converter.iter_stream_renumber(stream, input_rules, output_formats):
+        out.write(encoder.encode(separator + '\n'.join(lines)))
+        separator = '\n'
+    out.write(encoder.encode('', final=True))
+
+def renumber_file(converter, src_path, dst, input_rules, output_formats, encoding=None):
+    """只重新编号文件中的标题，其余内容逐字节保留；dst 为路径或二进制流，结果使用输入的编码"""
+    encoding = encoding or detect_file_encoding(src_path)
+    with open_text_input(src_path, encoding, newline='', errors='surrogateescape') as f:
+        if not isinstance(dst, str):
+            renumber_stream(converter, f, dst, input_rules, output_formats, encoding)
+            return
+        with atomic_output(dst, None) as out:
+            renumber_stream(converter, f, out, input_rules, output_formats, encoding)
+
+def run_renumber(inputs, output, input_rules, output_formats, auto_rules=False, encoding=None):
+    """批量重新编号：目录镜像到 output，文件名和扩展名不变，返回失败的文件数"""
+    converter = MarkdownConverter()
+    failures = 0
+    for src, dst in collect_batch_jobs(inputs, output, None):
+        try:
+            file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+            renumber_file(converter, src, dst, file_rules, output_formats, file_encoding)
+            print(f"已重新编号：{src} -> {dst}", file=sys.stderr)
+        except Exception as e:
+            failures += 1
+            print(f"重新编号失败：{src}：{e}", file=sys.stderr)
+    return failures
+
+def resolve_file_plan(converter, src, input_rules, auto_rules=False, encoding=None):
+    """确定单个文件的 (编码, 输入规则)：按需识别编码，auto_rules 时抽样识别输入规则
+    
+    识别出的规则只用于这一个文件；批量处理时每个文件都从配置的 input_rules 重新识别，
+    不能把上一个文件的识别结果当作下一个文件的默认规则。
+    """
+    file_encoding = encoding or detect_file_encoding(src)
+    file_rules = input_rules
+    if auto_rules:
+        detected = detect_file_rules(converter, src, file_encoding)['input_rules']
+        file_rules = with_rule_options(detected, input_rules) if detected else input_rules
+    return file_encoding, file_rules
+
+def convert_batch_file(converter, src, dst, input_rules, output_formats, jobs=1, auto_rules=False,
+                       encoding=None, output_encoding='utf-8', output_format='text'):
+    """批量模式下转换单个文件：按需识别编码和输入规则，大文件分片并行（压缩文档除外）"""
+    file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+    if (jobs > 1 and output_format == 'text' and not is_compressed_file(src)
+            and os.path.getsize(src) >= PARALLEL_MIN_SIZE):
+        convert_file_sharded(src, dst, file_rules, output_formats, jobs, file_encoding, output_encoding)
+    else:
+        convert_file(converter, src, dst, file_rules, output_formats,
+                     file_encoding, output_encoding, output_format)
+
+def render_to_binary(out, events, output_encoding='utf-8', output_format='text', title=''):
+    """把转换事件按输出格式渲染到二进制流 out，文本类格式按 output_encoding 编码"""
+    renderer_class = OUTPUT_RENDERERS[output_format]
+    if renderer_class.binary:
+        render_events(renderer_class(out, output_encoding, title), events)
+        return
+    text_out = io.TextIOWrapper(out, encoding=output_encoding, errors='replace', newline='\n')
+    try:
+        render_events(renderer_class(text_out, output_encoding, title), events)
+    finally:
+        text_out.flush()
+        text_out.detach()
+
+def iter_sections(events):
+    """按一级标题切分事件流，产出 (本节首个事件, 本节事件迭代器)
+    
+    第一个一级标题之前的内容（如果有）自成一节。各节的迭代器须按顺序读取，
+    取下一节时上一节未读完的事件会被跳过；整个过程只多看一个事件，不缓存文档。
+    """
+    events = iter(events)
+    lookahead = [next(events, None)]
+    
+    def section():
+        yield lookahead[0]
+        for event in events:
+            if event.kind == 'title' and event.level == 1:
+                lookahead[0] = event
+                return
+            yield event
+        lookahead[0] = None
+    
+    while lookahead[0] is not None:
+        body = section()
+        yield lookahead[0], body
+        for _ in body:
+            pass
+
+def section_file_name(index, head, suffix):
+    """分节文件名：序号_转换后的一级标题（含生成的编号），去掉文件名中不允许的字符"""
+    if head.kind == 'title' and head.level == 1:
+        name = _FILE_NAME_INVALID_CHARS.sub('_', head.text).strip().rstrip('.')[:SECTION_NAME_MAX_CHARS]
+    else:
+        name = SECTION_PREAMBLE_NAME
+    return f"{index:03d}_{name}{suffix}" if name else f"{index:03d}{suffix}"
+
+def section_output_dir(dst, suffix):
+    """分节输出时每个文档的结果目录：去掉目标文件的输出扩展名"""
+    return dst[:-len(suffix)] if dst.endswith(suffix) else dst
+
+def remove_stale_sections(dst_dir, paths, suffix):
+    """删除 dst_dir 中本次没有写出的分节文件（序号开头、扩展名为 suffix），返回删除的文件路径
+    
+    文档的章节减少或标题改名后，上次写出的分节文件不会被覆盖，留下会和新结果混在一起。
+    """
+    section_name = re.compile(r'\d{3,}(_.*)?' + re.escape(suffix))
+    produced = {os.path.basename(path) for path in paths}
+    removed = []
+    try:
+        names = os.listdir(dst_dir)
+    except FileNotFoundError:
+        return removed
+    for name in names:
+        path = os.path.join(dst_dir, name)
+        if name not in produced and section_name.fullmatch(name) and os.path.isfile(path):
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+def write_sections(events, dst_dir, output_encoding='utf-8', output_format='text', archive_out=None):
+    """按一级标题把转换事件边生成边写入 dst_dir 下的多个文件（或输出归档），返回写出的文件路径
+    
+    编号由同一个事件流生成，跨文件连续；每节写完即替换目标文件，内存中最多只有一节的渲染缓冲。
+    第一个一级标题之前的内容写入序号为 000 的文件，一级标题从 001 开始。
+    写入目录时，全部写完后删除上次留下、本次没有写出的分节文件。
+    """
+    suffix = OUTPUT_FILE_SUFFIXES[output_format]
+    paths = []
+    first_index = None
+    for head, body in iter_sections(events):
+        is_heading = head.kind == 'title' and head.level == 1
+        if first_index is None:
+            first_index = 1 if is_heading else 0
+        index = first_index + len(paths)
+        path = os.path.join(dst_dir, section_file_name(index, head, suffix))
+        opener = archive_out.member(path) if archive_out else atomic_output(path, None)
+        with opener as out:
+            title = head.text if is_heading else SECTION_PREAMBLE_NAME
+            render_to_binary(out, body, output_encoding, output_format, title)
+        paths.append(path)
+    if archive_out is None:
+        remove_stale_sections(dst_dir, paths, suffix)
+    return paths
+
+def convert_file_sections(converter, src_path, dst_dir, input_rules, output_formats,
+                          encoding=None, output_encoding='utf-8', output_format='text', archive_out=None):
+    """流式转换单个文件，按一级标题分别写入 dst_dir 下的文件，返回写出的文件路径"""
+    with open_text_input(src_path, encoding) as f:
+        return write_sections(converter.iter_stream_events(f, input_rules, output_formats),
+                              dst_dir, output_encoding, output_format, archive_out)
+
+def iter_archive_members(path):
+    """逐个读取归档中需要转换的成员，产出 (成员路径, 内容字节)，不解压到磁盘
+    
+    tar 以流方式顺序读取（tar.gz 边读边解压）；绝对路径或含 .. 的成员会被跳过。
+    """
+    def member_path(name):
+        """规范化成员路径（去掉 ./ 前缀），不需要转换或不安全时返回 None"""
+        name = name.replace('\\', '/')
+        parts = [part for part in name.split('/') if part not in ('', '.')]
+        if (name.startswith('/') or not parts or not is_convertible_file(parts[-1])
+                or any(part == '..' or part.startswith('.') or part == '__MACOSX' for part in parts)):
+            return None
+        return '/'.join(parts)
+    
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = None if info.is_dir() else member_path(info.filename)
+                if name:
+                    yield name, archive.read(info)
+        return
+    with tarfile.open(path, 'r|*') as archive:
+        for info in archive:
+            name = member_path(info.name) if info.isfile() else None
+            if name:
+                yield name, archive.extractfile(info).read()
+
+class ArchiveWriter:
+    """把转换结果逐个写入 zip 或 tar.gz/tar 归档（按扩展名选择），全部完成后替换目标文件
+    
+    每个成员先渲染到缓冲区（超过 ARCHIVE_SPOOL_SIZE 转存临时文件），成功后才追加进归档，
+    失败的成员不会留下半截内容；已写入的成员不在内存中保留。
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.tmp_path = temp_output_path(path)
+        if path.lower().endswith('.zip'):
+            self.zip = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_DEFLATED)
+            self.tar = None
+        else:
+            self.zip = None
+            mode = 'w|' if path.lower().endswith('.tar') else 'w|gz'
+            self.tar = tarfile.open(self.tmp_path, mode)
+    
+    def member_name(self, dst):
+        """目标路径相对于归档路径的部分作为成员名"""
+        return os.path.relpath(dst, self.path).replace(os.sep, '/')
+    
+    @contextlib.contextmanager
+    def member(self, dst):
+        """打开一个成员的二进制写入流；正常退出时追加进归档"""
+        with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as spool:
+            yield spool
+            size = spool.tell()
+            spool.seek(0)
+            name = self.member_name(dst)
+            if self.zip is not None:
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with self.zip.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as f:
+                    shutil.copyfileobj(spool, f)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = size
+                info.mtime = int(time.time())
+                self.tar.addfile(info, spool)
+    
+    def close(self):
+        (self.zip or self.tar).close()
+        os.replace(self.tmp_path, self.path)
+    
+    def abort(self):
+        try:
+            (self.zip or self.tar).close()
+        finally:
+            os.remove(self.tmp_path)
+
+def convert_archive(converter, src, dst_dir, input_rules, output_formats, auto_rules=False,
+                    encoding=None, output_encoding='utf-8', output_format='text', archive_out=None,
+                    split_sections=False):
+    """逐个转换归档中的成员，结果镜像到 dst_dir（或写入输出归档 archive_out），返回失败的成员数
+    
+    split_sections 为 True 时每个成员按一级标题分节，写入与其同名的目录。
+    """
+    suffix = OUTPUT_FILE_SUFFIXES[output_format]
+    failures = 0
+    for name, data in iter_archive_members(src):
+        dst = mirrored_output_path(name.replace('/', os.sep), dst_dir, suffix)
+        try:
+            if is_compressed_file(name):
+                # .md.gz 等压缩成员先解压，成员名和输出名中的 .gz 已由 mirrored_output_path 去掉
+                data = gzip.decompress(data)
+            member_encoding = encoding or detect_encoding(data[:ENCODING_SAMPLE_SIZE])
+            text = decode_document_bytes(data, member_encoding)
+            member_rules = input_rules
+            if auto_rules:
+                detected = converter.detect_input_rules(sample_text_windows(text))['input_rules']
+                member_rules = with_rule_options(detected, input_rules) if detected else input_rules
+            events = converter.iter_text_events(text, member_rules, output_formats)
+            if split_sections:
+                dst = section_output_dir(dst, suffix)
+                write_sections(events, dst, output_encoding, output_format, archive_out)
+            else:
+                opener = archive_out.member(dst) if archive_out else atomic_output(dst, None)
+                with opener as out:
+                    render_to_binary(out, events, output_encoding, output_format, document_title(name))
+            print(f"已转换：{src}:{name} -> {dst}", file=sys.stderr)
+        except Exception as e:
+            failures += 1
+            print(f"转换失败：{src}:{name}：{e}", file=sys.stderr)
+    return failures
+
+def run_batch(inputs, output, input_rules, output_formats, jobs=1, auto_rules=False,
+              encoding=None, output_encoding='utf-8', output_format='text', split_sections=False,
+              profile_dir=None, profile_mode='cprofile'):
+    """批量转换文件，返回失败的文件数
+    
+    jobs>1 时大文件按标题行分片并行转换（仅纯文本输出）；auto_rules 为 True 时按每个文件自动识别的输入规则转换。
+    encoding 为 None 时逐个文件自动识别输入编码。
+    输入中的 zip/tar/tar.gz 归档按目录对待，逐个成员转换；output 以归档扩展名结尾时所有结果流式写入该归档。
+    split_sections 为 True 时每个文档按一级标题流式拆分为多个文件，写入与目标文件同名（不含扩展名）的目录。
+    给出 profile_dir 时逐个文件以 profile_mode 方式做性能分析，结果写入该目录（见 ConversionProfiler）。
+    """
+    converter = MarkdownConverter()
+    profiler = ConversionProfiler(profile_dir, profile_mode) if profile_dir else None
+    suffix = OUTPUT_FILE_SUFFIXES[output_format]
+    failures = 0
+    archive_out = ArchiveWriter(output) if is_archive_file(output) else None
+    try:
+        for src, dst in collect_batch_jobs(inputs, output, suffix, include_archives=True):
+            if archive_out is not None and os.path.abspath(src) == os.path.abspath(output):
+                continue
+            try:
+                with profile_conversion(profiler, document_title(src), input_rules, output_formats, src):
+                    if is_archive_file(src):
+                        failures += convert_archive(converter, src, dst, input_rules, output_formats, auto_rules,
+                                                    encoding, output_encoding, output_format, archive_out,
+                                                    split_sections)
+                        continue
+                    if split_sections:
+                        file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+                        dst = section_output_dir(dst, suffix)
+                        paths = convert_file_sections(converter, src, dst, file_rules, output_formats,
+                                                      file_encoding, output_encoding, output_format, archive_out)
+                        print(f"已转换：{src} -> {dst}（{len(paths)} 个文件）", file=sys.stderr)
+                        continue
+                    if archive_out is None:
+                        convert_batch_file(converter, src, dst, input_rules, output_formats, jobs, auto_rules,
+                                           encoding, output_encoding, output_format)
+                    else:
+                        file_encoding, file_rules = resolve_file_plan(converter, src, input_rules, auto_rules, encoding)
+                        with open_text_input(src, file_encoding) as f, archive_out.member(dst) as out:
+                            render_to_binary(out, converter.iter_stream_events(f, file_rules, output_formats),
+                                             output_encoding, output_format, document_title(src))
+                print(f"已转换：{src} -> {dst}", file=sys.stderr)
+            except Exception as e:
+                failures += 1
+                print(f"转换失败：{src}：{e}", file=sys.stderr)
+    except BaseException:
+        if archive_out is not None:
+            archive_out.abort()
+        raise
+    if archive_out is not None:
+        archive_out.close()
+    print(converter.clean_memo.summary(), file=sys.stderr)
+    return failures
+
+class MonitoredQueue(queue.Queue):
+    """记录深度和入队等待时间的有界队列，用于流水线统计"""
+    
+    def __init__(self, name, maxsize):
+        super().__init__(maxsize)
+        self.name = name
+        self.puts = 0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.put_wait = 0.0
+    
+    def put(self, item, block=True, timeout=None):
+        started = time.perf_counter()
+        super().put(item, block, timeout)
+        waited = time.perf_counter() - started
+        with self.mutex:
+            depth = self._qsize()
+            self.puts += 1
+            self.depth_total += depth
+            self.depth_max = max(self.depth_max, depth)
+            self.put_wait += waited
+    
+    def report(self):
+        mean = self.depth_total / self.puts if self.puts else 0.0
+        return (f"  {self.name} 队列：容量 {self.maxsize}，平均深度 {mean:.1f}，"
+                f"最大深度 {self.depth_max}，入队等待共 {self.put_wait:.2f} 秒")
+
+# 流水线转换进程中复用的转换器
+_pipeline_converter = None
+
+def _run_pipeline_job(job):
+    """在转换进程中转换一个文件，返回 (输出字节或 None, 错误信息或 None, 转换用时, 清理缓存命中数, 未命中数)
+    
+    text 为 None 的大文件在这里直接流式转换并写出目标文件。
+    同一进程内的各个文件共用一个转换器，逐行清理缓存也随之共用。
+    """
+    global _pipeline_converter
+    src, dst, text, encoding, input_rules, output_formats, output_encoding, output_format = job
+    if _pipeline_converter is None:
+        _pipeline_converter = MarkdownConverter()
+    memo = _pipeline_converter.clean_memo
+    hits, misses = memo.hits, memo.misses
+    started = time.perf_counter()
+    data = error = None
+    try:
+        if text is None:
+            convert_batch_file(_pipeline_converter, src, dst, input_rules, output_formats,
+                               encoding=encoding, output_encoding=output_encoding, output_format=output_format)
+        else:
+            out = io.BytesIO()
+            render_to_binary(out, _pipeline_converter.iter_text_events(text, input_rules, output_formats),
+                             output_encoding, output_format, document_title(src))
+            data = out.getvalue()
+    except Exception as e:
+        error = str(e)
+    return data, error, time.perf_counter() - started, memo.hits - hits, memo.misses - misses
+
+class BatchPipeline:
+    """流水线批量转换：读取线程预读并解码文件，转换进程池转换，写出线程写入结果
+    
+    各阶段之间用有界队列连接，下游跟不上时上游阻塞（背压），内存中的文档数有上限。
+    结束时报告各队列的深度和各阶段的利用率。
+    不小于 PARALLEL_MIN_SIZE 的大文件不整体读入内存，由转换进程直接流式转换并写出。
+    """
+    
+    def __init__(self, input_rules, output_formats, jobs=1, io_threads=2, auto_rules=False,
+                 encoding=None, output_encoding='utf-8', output_format='text'):
+        self.input_rules = input_rules
+        self.output_formats = output_formats
+        self.jobs = max(jobs, 1)
+        self.readers = max(io_threads, 1)
+        self.writers = max(io_threads, 1)
+        self.auto_rules = auto_rules
+        self.encoding = encoding
+        self.output_encoding = output_encoding
+        self.output_format = output_format
+        self.stats_lock = threading.Lock()
+        self.busy = {'read': 0.0, 'convert': 0.0, 'write': 0.0}
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.converted = 0
+        self.failures = 0
+    
+    def add_busy(self, stage, seconds):
+        with self.stats_lock:
+            self.busy[stage] += seconds
+    
+    def record_result(self, src, dst, error):
+        with self.stats_lock:
+            if error is None:
+                self.converted += 1
+            else:
+                self.failures += 1
+        if error is None:
+            print(f"已转换：{src} -> {dst}", file=sys.stderr)
+        else:
+            print(f"转换失败：{src}：{error}", file=sys.stderr)
+    
+    def read_file(self, converter, src, dst):
+        """读取阶段：识别编码和输入规则，读入并解码文件，返回转换任务"""
+        file_encoding, file_rules = resolve_file_plan(converter, src, self.input_rules,
+                                                      self.auto_rules, self.encoding)
+        text = None
+        if input_file_size(src) < PARALLEL_MIN_SIZE:
+            with open_binary_input(src) as f:
+                text = decode_document_bytes(f.read(), file_encoding)
+        return (src, dst, text, file_encoding, file_rules, self.output_formats,
+                self.output_encoding, self.output_format)
+    
+    def reader(self, pending, read_queue):
+        converter = MarkdownConverter()
+        while True:
+            try:
+                src, dst = pending.get_nowait()
+            except queue.Empty:
+                break
+            started = time.perf_counter()
+            try:
+                item = ('job', self.read_file(converter, src, dst))
+            except Exception as e:
+                item = ('error', (src, dst, str(e)))
+            self.add_busy('read', time.perf_counter() - started)
+            read_queue.put(item)
+        read_queue.put(None)
+    
+    def writer(self, write_queue):
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            src, dst, future = item
+            try:
+                data, error, seconds, hits, misses = future.result()
+            except Exception as e:
+                # 转换进程崩溃（BrokenProcessPool 等）：记为失败并继续取队列，
+                # 否则写出线程退出后主线程会在有界的写出队列上永远阻塞
+                self.record_result(src, dst, f"转换进程异常：{e!r}")
+                continue
+            self.add_busy('convert', seconds)
+            with self.stats_lock:
+                self.memo_hits += hits
+                self.memo_misses += misses
+            if data is not None:
+                started = time.perf_counter()
+                try:
+                    with atomic_output(dst, None) as out:
+                        out.write(data)
+                except OSError as e:
+                    error = str(e)
+                self.add_busy('write', time.perf_counter() - started)
+            self.record_result(src, dst, error)
+    
+    def run(self, inputs, output):
+        """转换全部文件，返回失败的文件数"""
+        pending = queue.Queue()
+        for job in collect_batch_jobs(inputs, output, OUTPUT_FILE_SUFFIXES[self.output_format]):
+            pending.put(job)
+        read_queue = MonitoredQueue("读取→转换", self.jobs * 2)
+        write_queue = MonitoredQueue("转换→写出", self.jobs * 2)
+        started = time.perf_counter()
+        readers = [threading.Thread(target=self.reader, args=(pending, read_queue), daemon=True)
+                   for _ in range(self.readers)]
+        writers = [threading.Thread(target=self.writer, args=(write_queue,), daemon=True)
+                   for _ in range(self.writers)]
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            for thread in readers + writers:
+                thread.start()
+            finished_readers = 0
+            while finished_readers < self.readers:
+                item = read_queue.get()
+                if item is None:
+                    finished_readers += 1
+                    continue
+                kind, payload = item
+                if kind == 'error':
+                    src, dst, error = payload
+                    self.record_result(src, dst, error)
+                    continue
+                try:
+                    future = pool.submit(_run_pipeline_job, payload)
+                except Exception as e:
+                    # 进程池已损坏时不再能提交，剩余文件逐个记为失败，读取线程照常结束
+                    self.record_result(payload[0], payload[1], f"转换进程异常：{e!r}")
+                    continue
+                # 写出队列满时在这里阻塞，读取线程随之在读取队列上阻塞
+                write_queue.put((payload[0], payload[1], future))
+            for _ in writers:
+                write_queue.put(None)
+            for thread in writers:
+                thread.join()
+        self.report(time.perf_counter() - started, (read_queue, write_queue))
+        return self.failures
+    
+    def report(self, elapsed, queues):
+        """输出队列深度和各阶段利用率（忙碌时间 / (总用时 × 并发数)）"""
+        elapsed = max(elapsed, 1e-9)
+        lines = [f"流水线统计：用时 {elapsed:.2f} 秒，转换 {self.converted} 个文件，失败 {self.failures} 个"]
+        for stage, label, workers in (('read', "读取", self.readers), ('convert', "转换", self.jobs),
+                                      ('write', "写出", self.writers)):
+            unit = "进程" if stage == 'convert' else "线程"
+            utilisation = self.busy[stage] / (elapsed * workers)
+            lines.append(f"  {label}：{workers} 个{unit}，忙碌 {self.busy[stage]:.2f} 秒，利用率 {utilisation:.0%}")
+        lines.extend(q.report() for q in queues)
+        lookups = self.memo_hits + self.memo_misses
+        lines.append(f"  清理缓存：命中 {self.memo_hits} / {lookups} 次（{self.memo_hits / lookups if lookups else 0:.1%}）")
+        print('\n'.join(lines), file=sys.stderr)
+
+class SharedWorkQueue:
+    """多个进程（可在不同主机上，经 NFS/SMB 共享目录）协作完成同一批转换
+    
+    每个进程按相同规则展开任务列表，在队列目录中领取任务：
+    claims/<任务ID>.lock 以 O_CREAT|O_EXCL 创建，只有一个进程能成功；
+    完成后写 done/<任务ID>.json，失败写 failed/<任务ID>.json，再删除锁文件。
+    处理期间定期刷新锁文件的修改时间作为心跳；超过 claim_timeout 未刷新的锁视为
+    持有者已退出，先原子地改名（只有一个进程能改名成功）再删除，然后重新领取。
+    任务ID 包含规则指纹和源文件的大小、修改时间，换规则或源文件有改动后复用同一队列目录会重新转换。
+    失败记录只在它所在的那一轮有效：早于本进程启动的失败记录会被清除并重新领取。
+    """
+    
+    CLAIM_DIR = 'claims'
+    DONE_DIR = 'done'
+    FAILED_DIR = 'failed'
+    
+    def __init__(self, queue_dir, inputs, output, input_rules, output_formats, jobs=1,
+                 auto_rules=False, encoding=None, output_encoding='utf-8', output_format='text',
+                 claim_timeout=300.0, interval=2.0, profile_dir=None, profile_mode='cprofile'):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.inputs = inputs
+        self.output = output
+        self.input_rules = input_rules
+        self.output_formats = output_formats
+        self.jobs = jobs
+        self.auto_rules = auto_rules
+        self.encoding = encoding
+        self.output_encoding = output_encoding
+        self.output_format = output_format
+        self.claim_timeout = claim_timeout
+        self.interval = interval
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.converter = MarkdownConverter()
+        self.profiler = ConversionProfiler(profile_dir, profile_mode) if profile_dir else None
+        self.current_claim = None
+        self.claim_lock = threading.Lock()
+        self.started = 0.0
+        fingerprint = rule_config_fingerprint(input_rules, output_formats)
+        self.fingerprint = f"{fingerprint}:{output_format}:{int(auto_rules)}"
+    
+    def log(self, message):
+        print(f"[{time.strftime('%H:%M:%S')}] [{self.worker}] {message}", file=sys.stderr)
+    
+    def path_for(self, kind, job_id):
+        suffix = '.lock' if kind == self.CLAIM_DIR else '.json'
+        return os.path.join(self.queue_dir, kind, job_id + suffix)
+    
+    def job_id(self, src, dst):
+        """任务ID：输出文件在输出目录中的相对路径、规则指纹和源文件的大小与修改时间
+        
+        不含挂载点，各主机挂载路径不同也一致；源文件改动后 ID 随之改变，旧的完成记录不再匹配。
+        """
+        rel = os.path.relpath(dst, self.output).replace(os.sep, '/')
+        st = os.stat(src)
+        key = f"{self.fingerprint}\n{rel}\n{st.st_size}:{st.st_mtime_ns}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+    
+    def queue_now(self):
+        """用队列目录所在文件系统的时间判断锁是否过期，避免各主机时钟不一致"""
+        probe = os.path.join(self.queue_dir, f".now.{socket.gethostname()}.{os.getpid()}")
+        try:
+            with open(probe, 'w'):
+                pass
+            return os.stat(probe).st_mtime
+        except OSError:
+            return time.time()
+        finally:
+            try:
+                os.remove(probe)
+            except OSError:
+                pass
+    
+    def try_claim(self, job_id, src):
+        """尝试领取任务，成功返回 True"""
+        path = self.path_for(self.CLAIM_DIR, job_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'worker': self.worker, 'source': src, 'time': time.time()}, f, ensure_ascii=False)
+        with self.claim_lock:
+            self.current_claim = path
+        return True
+    
+    def release(self, job_id):
+        with self.claim_lock:
+            self.current_claim = None
+        try:
+            os.remove(self.path_for(self.CLAIM_DIR, job_id))
+        except OSError:
+            pass
+    
+    def reclaim_stale(self, job_id, now):
+        """锁文件心跳超时则将其移走；返回是否移走了过期的锁"""
+        path = self.path_for(self.CLAIM_DIR, job_id)
+        try:
+            if now - os.stat(path).st_mtime < self.claim_timeout:
+                return False
+            stale_path = f"{path}.stale.{socket.gethostname()}.{os.getpid()}"
+            # 改名是原子的，多个进程同时发现过期时只有一个会成功
+            os.rename(path, stale_path)
+        except OSError:
+            return False
+        try:
+            fresh = now - os.stat(stale_path).st_mtime < self.claim_timeout
+        except OSError:
+            return False
+        if fresh:
+            # 判断过期之后、改名之前，锁已被别的进程回收并重新领取：原样放回
+            try:
+                os.link(stale_path, path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+        try:
+            with open(stale_path, 'r', encoding='utf-8') as f:
+                owner = json.load(f).get('worker', '?')
+        except (OSError, ValueError):
+            owner = '?'
+        try:
+            os.remove(stale_path)
+        except OSError:
+            pass
+        self.log(f"回收过期任务（原领取者 {owner}）：{job_id}")
+        return True
+    
+    def heartbeat(self, stop):
+        """后台线程：定期刷新当前锁文件的修改时间"""
+        while not stop.wait(max(self.claim_timeout / 3, 0.1)):
+            with self.claim_lock:
+                path = self.current_claim
+            if path:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+    
+    def is_finished(self, job_id):
+        """已完成，或在本轮中（本进程启动之后）已有进程转换失败"""
+        if os.path.exists(self.path_for(self.DONE_DIR, job_id)):
+            return True
+        failed_path = self.path_for(self.FAILED_DIR, job_id)
+        try:
+            failed_at = os.stat(failed_path).st_mtime
+        except OSError:
+            return False
+        if failed_at >= self.started:
+            return True
+        # 上一轮留下的失败记录：清除后重新领取
+        try:
+            os.remove(failed_path)
+        except OSError:
+            pass
+        return False
+    
+    def finish(self, job_id, kind, record):
+        write_file_atomic(self.path_for(kind, job_id), json.dumps(record, ensure_ascii=False))
+        if kind == self.DONE_DIR:
+            try:
+                os.remove(self.path_for(self.FAILED_DIR, job_id))
+            except OSError:
+                pass
+        self.release(job_id)
+    
+    def process(self, job_id, src, dst):
+        """转换已领取的任务，返回是否成功；任务已由其他进程完成而跳过时返回 None"""
+        # 领取前别的进程可能刚好完成并删除了锁
+        if self.is_finished(job_id):
+            self.release(job_id)
+            return None
+        started = time.time()
+        record = {'source': src, 'output': dst, 'worker': self.worker}
+        try:
+            with profile_conversion(self.profiler, document_title(src), self.input_rules, self.output_formats, src):
+                convert_batch_file(self.converter, src, dst, self.input_rules, self.output_formats,
+                                   self.jobs, self.auto_rules, self.encoding, self.output_encoding,
+                                   self.output_format)
+        except Exception as e:
+            record['error'] = str(e)
+            self.finish(job_id, self.FAILED_DIR, record)
+            self.log(f"转换失败：{src}：{e}")
+            return False
+        record['seconds'] = round(time.time() - started, 3)
+        self.finish(job_id, self.DONE_DIR, record)
+        self.log(f"已转换：{src} -> {dst}")
+        return True
+    
+    def run(self):
+        """循环领取并转换任务，直到所有任务完成或失败；返回本进程失败的文件数"""
+        for kind in (self.CLAIM_DIR, self.DONE_DIR, self.FAILED_DIR):
+            os.makedirs(os.path.join(self.queue_dir, kind), exist_ok=True)
+        # 用队列目录所在文件系统的时间，与失败记录的修改时间比较
+        self.started = self.queue_now()
+        pending = [(self.job_id(src, dst), src, dst)
+                   for src, dst in collect_batch_jobs(self.inputs, self.output,
+                                                      OUTPUT_FILE_SUFFIXES[self.output_format])]
+        stop = threading.Event()
+        beat = threading.Thread(target=self.heartbeat, args=(stop,), daemon=True)
+        beat.start()
+        converted = failures = 0
+        try:
+            while pending:
+                waiting = []
+                for job_id, src, dst in pending:
+                    if self.is_finished(job_id):
+                        continue
+                    if not self.try_claim(job_id, src):
+                        waiting.append((job_id, src, dst))
+                        continue
+                    result = self.process(job_id, src, dst)
+                    if result:
+                        converted += 1
+                    elif result is not None:
+                        failures += 1
+                pending = waiting
+                if not pending:
+                    break
+                # 剩下的任务都被其他进程领取：等待完成，并回收心跳超时的锁
+                time.sleep(self.interval)
+                now = self.queue_now()
+                for job_id, _, _ in pending:
+                    self.reclaim_stale(job_id, now)
+        except KeyboardInterrupt:
+            self.log("已中断，释放当前任务")
+            with self.claim_lock:
+                path = self.current_claim
+            if path:
+                self.release(os.path.basename(path)[:-len('.lock')])
+            raise
+        finally:
+            stop.set()
+        self.log(f"队列已处理完毕：本进程转换 {converted} 个文件，失败 {failures} 个；{self.converter.clean_memo.summary()}")
+        return failures
+
+class InotifyWatcher:
+    """基于 Linux inotify 的目录监视器（通过 ctypes 调用，无需第三方依赖）"""
+    
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_ATTRIB)
+    
+    _EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify 仅在 Linux 上可用")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._watches = {}
+    
+    def add_tree(self, root_dir):
+        """递归监视目录"""
+        for dirpath, dirnames, _ in os.walk(root_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            self.add_watch(dirpath)
+    
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self._watches[wd] = path
+    
+    def read_events(self, timeout):
+        """等待事件，返回 [(路径, mask)]；事件队列溢出时返回 None 表示需要全量扫描"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            header_size = self._EVENT_HEADER.size
+            while offset + header_size <= len(data):
+                wd, mask, _, name_len = self._EVENT_HEADER.unpack_from(data, offset)
+                offset += header_size
+                name = data[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                if mask & self.IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & self.IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                events.append((path, mask))
+        return None if overflow else events
+    
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+class DirectoryWatcher:
+    """监视输入目录，只重新转换内容真正发生变化的文件
+    
+    清单（manifest）记录每个源文件的 (路径, 大小, 修改时间, 哈希)，
+    保存在输出目录中；规则配置变化时清空清单并全量重建。
+    """
+    
+    MANIFEST_NAME = '.convert_manifest.json'
+    
+    def __init__(self, input_dirs, output_dir, config_path=None, interval=1.0, use_inotify=True,
+                 encoding=None, output_encoding='utf-8', output_format='text', normalize_width=False,
+                 profile_dir=None, profile_mode='cprofile'):
+        self.input_dirs = [os.path.abspath(d) for d in input_dirs]
+        self.normalize_width = normalize_width
+        self.encoding = encoding
+        self.output_encoding = output_encoding
+        self.output_format = output_format
+        self.output_dir = os.path.abspath(output_dir)
+        self.config_path = config_path
+        self.interval = interval
+        self.converter = MarkdownConverter()
+        self.profiler = ConversionProfiler(profile_dir, profile_mode) if profile_dir else None
+        self.manifest_file = os.path.join(self.output_dir, self.MANIFEST_NAME)
+        self.manifest = {'rules': None, 'files': {}}
+        self.config_stamp = None
+        self.input_rules = None
+        self.output_formats = None
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = InotifyWatcher()
+            except (OSError, AttributeError) as e:
+                self.log(f"inotify 不可用，改用轮询：{e}")
+    
+    def log(self, message):
+        print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr)
+    
+    def target_dir_for(self, input_dir):
+        if len(self.input_dirs) > 1:
+            return os.path.join(self.output_dir, os.path.basename(input_dir))
+        return self.output_dir
+    
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get('files'), dict):
+                self.manifest = manifest
+        except (OSError, ValueError):
+            pass
+    
+    def save_manifest(self):
+        write_file_atomic(self.manifest_file, json.dumps(self.manifest, ensure_ascii=False, indent=1))
+    
+    def config_file_stamp(self):
+        path = self.config_path or DEFAULT_CONFIG_FILE
+        try:
+            st = os.stat(path)
+            return (st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+    
+    def reload_rules(self):
+        """重新读取规则配置；规则变化时返回 True"""
+        stamp = self.config_file_stamp()
+        if self.input_rules is not None and stamp == self.config_stamp:
+            return False
+        self.config_stamp = stamp
+        try:
+            input_rules, output_formats = load_rule_config(self.config_path)
+        except (OSError, ValueError) as e:
+            self.log(f"读取规则配置失败，继续使用当前规则：{e}")
+            return False
+        if self.normalize_width:
+            input_rules[NORMALIZE_WIDTH_KEY] = True
+        self.input_rules, self.output_formats = input_rules, output_formats
+        # 输出格式变化时同样需要全量重建
+        fingerprint = rule_config_fingerprint(input_rules, output_formats)
+        if self.output_format != 'text':
+            fingerprint += ':' + self.output_format
+        if fingerprint != self.manifest.get('rules'):
+            self.manifest = {'rules': fingerprint, 'files': {}}
+            return True
+        return False
+    
+    def locate(self, path):
+        """返回源文件对应的 (输入目录, 相对路径)，不在监视范围内时返回 None"""
+        for input_dir in self.input_dirs:
+            if path.startswith(input_dir + os.sep):
+                rel = os.path.relpath(path, input_dir)
+                if any(part.startswith('.') for part in rel.split(os.sep)):
+                    return None
+                return input_dir, rel
+        return None
+    
+    def process_file(self, path):
+        """检查单个文件，内容变化时重新转换；返回是否修改了清单"""
+        location = self.locate(path)
+        if location is None or not is_convertible_file(path) or path.startswith(self.output_dir + os.sep):
+            return False
+        input_dir, rel = location
+        files = self.manifest['files']
+        try:
+            st = os.stat(path)
+        except OSError:
+            return self.remove_file(path)
+        
+        entry = files.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return False
+        
+        digest = file_digest(path)
+        dst = mirrored_output_path(rel, self.target_dir_for(input_dir), OUTPUT_FILE_SUFFIXES[self.output_format])
+        if entry and entry['hash'] == digest and os.path.exists(dst):
+            # 只是时间戳变化，内容未变，无需重新转换
+            entry['size'], entry['mtime'] = st.st_size, st.st_mtime_ns
+            return True
+        
+        try:
+            with profile_conversion(self.profiler, document_title(path), self.input_rules, self.output_formats, path):
+                convert_file(self.converter, path, dst, self.input_rules, self.output_formats,
+                             self.encoding, self.output_encoding, self.output_format)
+        except Exception as e:
+            self.log(f"转换失败：{path}：{e}")
+            return False
+        files[path] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'hash': digest, 'output': dst}
+        self.log(f"已转换：{path} -> {dst}")
+        return True
+    
+    def remove_file(self, path):
+        entry = self.manifest['files'].pop(path, None)
+        if entry is None:
+            return False
+        try:
+            os.remove(entry['output'])
+        except OSError:
+            pass
+        self.log(f"源文件已删除：{path}")
+        return True
+    
+    def full_scan(self):
+        """扫描全部输入目录；未变化的文件只做 stat，不读取内容"""
+        changed = False
+        seen = set()
+        for input_dir in self.input_dirs:
+            for path, _ in iter_convertible_files(input_dir, exclude_dir=self.output_dir):
+                seen.add(path)
+                changed = self.process_file(path) or changed
+        for path in list(self.manifest['files']):
+            if path not in seen:
+                changed = self.remove_file(path) or changed
+        if changed:
+            self.save_manifest()
+    
+    def handle_events(self, events):
+        changed = False
+        for path, mask in events:
+            if mask & InotifyWatcher.IN_ISDIR:
+                if mask & (InotifyWatcher.IN_CREATE | InotifyWatcher.IN_MOVED_TO):
+                    # 新目录：加入监视并处理其中已有的文件
+                    self.inotify.add_tree(path)
+                    for file_path, _ in iter_convertible_files(path, exclude_dir=self.output_dir):
+                        changed = self.process_file(file_path) or changed
+                elif mask & InotifyWatcher.IN_MOVED_FROM:
+                    for file_path in [p for p in self.manifest['files'] if p.startswith(path + os.sep)]:
+                        changed = self.remove_file(file_path) or changed
+                continue
+            if mask & (InotifyWatcher.IN_DELETE | InotifyWatcher.IN_MOVED_FROM):
+                changed = self.remove_file(path) or changed
+            else:
+                changed = self.process_file(path) or changed
+        if changed:
+            self.save_manifest()
+    
+    def run(self, once=False):
+        """运行监视循环；once=True 时只做一次同步"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.load_manifest()
+        if self.reload_rules():
+            self.log("规则配置已变化，全量重建")
+        if self.inotify and not once:
+            for input_dir in self.input_dirs:
+                self.inotify.add_tree(input_dir)
+        self.full_scan()
+        if once:
+            return
+        
+        mode = "inotify" if self.inotify else f"轮询（间隔 {self.interval} 秒）"
+        self.log(f"开始监视：{', '.join(self.input_dirs)}（{mode}）")
+        try:
+            while True:
+                if self.inotify:
+                    events = self.inotify.read_events(self.interval)
+                else:
+                    time.sleep(self.interval)
+                    events = None
+                
+                if self.reload_rules():
+                    self.log("规则配置已变化，全量重建")
+                    self.full_scan()
+                elif events is None:
+                    self.full_scan()
+                elif events:
+                    self.handle_events(events)
+        except KeyboardInterrupt:
+            self.log("已停止监视")
+        finally:
+            if self.inotify:
+                self.inotify.close()
+
+# 管道模式缓存的规则方案数量（按请求中的预设名或规则配置区分）
+PIPE_PLAN_CACHE_SIZE = 256
+
+# 管道模式子进程中复用的转换器（正则编译结果缓存在其中）
+_pipe_converter = None
+
+def _run_pipe_job(job, profile_dir=None, profile_mode='cprofile'):
+    """执行一个管道请求，返回响应字典；-j 大于 1 时在子进程中运行
+    
+    给出 profile_dir 时以 profile_mode 方式分析本次请求，文档名为 “pipe-请求 id”。
+    """
+    global _pipe_converter
+    request_id, mode, text, input_rules, output_formats = job
+    if _pipe_converter is None:
+        _pipe_converter = MarkdownConverter()
+    profiler = ConversionProfiler(profile_dir, profile_mode) if profile_dir else None
+    with profile_conversion(profiler, f"pipe-{request_id}", input_rules, output_formats):
+        return _convert_pipe_request(request_id, mode, text, input_rules, output_formats)
+
+def _convert_pipe_request(request_id, mode, text, input_rules, output_formats):
+    """用本进程的转换器执行请求，异常转为失败响应"""
+    try:
+        if mode == 'outline':
+            outline = _pipe_converter.iter_outline(text, input_rules, output_formats)
+            return {'id': request_id, 'ok': True, 'outline': [entry._asdict() for entry in outline]}
+        return {'id': request_id, 'ok': True, 'text': _pipe_converter.convert_text(text, input_rules, output_formats)}
+    except Exception as e:
+        return {'id': request_id, 'ok': False, 'error': f"转换失败：{e}"}
+
+class PipeService:
+    """常驻的 JSON lines 服务：从输入流逐行读取请求，向输出流逐行写出响应
+    
+    请求：{"id": ..., "text": "...", "preset": "预设名"} 或 {"id": ..., "text": "...", "rules": {...}}，
+    rules 与配置文件格式相同；可选 "mode": "convert"（默认）或 "outline"。
+    都不给出时使用启动时的规则配置。
+    响应：{"id": ..., "ok": true, "text": "..."}，失败时为 {"id": ..., "ok": false, "error": "..."}。
+    
+    客户端可以连续发送多个请求而不必等待响应，响应按请求顺序返回。
+    收到 {"cmd": "shutdown"}、输入结束或 SIGTERM 时停止读取，处理完已收到的请求后退出。
+    SIGTERM 只设置停止标志，在两个请求之间检查；只有正在等待输入时才中断读取，
+    不会打断正在转换的请求或写了一半的响应。
+    """
+    
+    def __init__(self, input_rules, output_formats, jobs=1, stdin=None, stdout=None, profile_dir=None,
+                 profile_mode='cprofile'):
+        self.default_rules = (input_rules, output_formats)
+        self.jobs = jobs
+        self.profile_dir = profile_dir
+        self.profile_mode = profile_mode
+        self.stdin = stdin or sys.stdin.buffer
+        self.stdout = stdout or sys.stdout.buffer
+        self.plans = {}
+        self.stopping = False
+        self.reading = False
+    
+    def resolve_rules(self, request):
+        """取请求对应的 (input_rules, output_formats)，解析结果按预设名或规则内容缓存"""
+        if 'preset' in request:
+            key = ('preset', request['preset'])
+        elif 'rules' in request:
+            key = ('rules', json.dumps(request['rules'], sort_keys=True, ensure_ascii=False))
+        else:
+            return self.default_rules
+        plan = self.plans.pop(key, None)
+        if plan is None:
+            if key[0] == 'preset':
+                plan = preset_rule_config(request['preset'])
+            else:
+                plan = rule_config_from_dict(request['rules'])
+            if len(self.plans) >= PIPE_PLAN_CACHE_SIZE:
+                # 字典保持插入顺序，最早插入的就是最久未使用的
+                self.plans.pop(next(iter(self.plans)))
+        self.plans[key] = plan
+        return plan
+    
+    def parse_request(self, line):
+        """解析一行请求，返回 (任务, None) 或 (None, 直接返回的响应)；关闭命令的响应带有 shutdown 字段"""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return None, {'id': None, 'ok': False, 'error': f"无效的 JSON：{e}"}
+        if not isinstance(request, dict):
+            return None, {'id': None, 'ok': False, 'error': "请求必须是 JSON 对象"}
+        request_id = request.get('id')
+        if request.get('cmd') == 'shutdown':
+            return None, {'id': request_id, 'ok': True, 'shutdown': True}
+        text = request.get('text')
+        mode = request.get('mode', 'convert')
+        if not isinstance(text, str):
+            return None, {'id': request_id, 'ok': False, 'error': "缺少 text 字段"}
+        if mode not in ('convert', 'outline'):
+            return None, {'id': request_id, 'ok': False, 'error': f"未知的 mode：{mode}"}
+        try:
+            input_rules, output_formats = self.resolve_rules(request)
+        except (ValueError, TypeError, AttributeError) as e:
+            return None, {'id': request_id, 'ok': False, 'error': str(e)}
+        return (request_id, mode, text, input_rules, output_formats), None
+    
+    def write_response(self, response):
+        self.stdout.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.stdout.flush()
+    
+    def iter_requests(self):
+        """逐行产出 (任务, 直接返回的响应)；关闭命令的响应产出后或收到 SIGTERM 后停止读取"""
+        while not self.stopping:
+            self.reading = True
+            try:
+                line = self.stdin.readline()
+            finally:
+                self.reading = False
+            if not line:
+                return
+            if not line.strip():
+                continue
+            job, response = self.parse_request(line)
+            yield job, response
+            if response is not None and response.get('shutdown'):
+                return
+    
+    def request_stop(self, signum=None, frame=None):
+        """SIGTERM 处理函数：处理完当前请求后停止；正在等待输入时直接中断读取"""
+        self.stopping = True
+        if self.reading:
+            raise KeyboardInterrupt
+    
+    def run(self):
+        """运行服务直到输入结束或收到关闭命令"""
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGTERM'):
+            previous_handler = signal.signal(signal.SIGTERM, self.request_stop)
+        try:
+            if self.jobs > 1:
+                self._run_parallel()
+            else:
+                try:
+                    for job, error in self.iter_requests():
+                        self.write_response(error or _run_pipe_job(job, self.profile_dir, self.profile_mode))
+                except KeyboardInterrupt:
+                    pass
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+    
+    def _run_parallel(self):
+        """多进程处理：主线程读取并提交请求，写出线程按顺序等待结果并写出
+        
+        有界队列限制在途请求数，客户端发得太快时读取会暂停。
+        """
+        pending = queue.Queue(maxsize=self.jobs * 4)
+        
+        def write_results():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                if isinstance(item, dict):
+                    self.write_response(item)
+                    continue
+                request_id, future = item
+                try:
+                    response = future.result()
+                except Exception as e:
+                    # 子进程崩溃（BrokenProcessPool 等）时转为该请求的失败响应，继续取队列，
+                    # 否则主线程会在有界的 pending 队列上永远阻塞
+                    response = {'id': request_id, 'ok': False, 'error': f"转换进程异常：{e!r}"}
+                self.write_response(response)
+        
+        writer = threading.Thread(target=write_results)
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_reset_worker_signals) as pool:
+            writer.start()
+            try:
+                for job, error in self.iter_requests():
+                    if error is None:
+                        try:
+                            error = (job[0], pool.submit(_run_pipe_job, job, self.profile_dir, self.profile_mode))
+                        except Exception as e:
+                            error = {'id': job[0], 'ok': False, 'error': f"转换进程异常：{e!r}"}
+                    pending.put(error)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                pending.put(None)
+                writer.join()
+
+def _reset_worker_signals():
+    """子进程恢复默认的 SIGTERM 处理（fork 时继承了服务的处理函数），进程池终止子进程时不打印回溯"""
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Markdown中文格式转换器。不带参数运行时启动图形界面。"
+    )
+    parser.add_argument('inputs', nargs='*', help="要转换的文件或目录")
+    parser.add_argument('-o', '--output',
+                        help="输出文件或目录（目录时镜像输入目录结构）；以 .zip/.tar.gz 结尾时所有结果写入该归档")
+    parser.add_argument('-c', '--config', help="规则配置文件（默认使用界面保存的配置）")
+    parser.add_argument('--watch', action='store_true', help="持续监视输入目录，只重新转换变化的文件")
+    parser.add_argument('--interval', type=float, default=1.0, help="监视模式的轮询间隔（秒）")
+    parser.add_argument('--poll', action='store_true', help="监视模式下不使用 inotify，强制轮询")
+    parser.add_argument('--detect', action='store_true',
+                        help="只抽样识别输入文件的标题格式，输出 JSON，不转换")
+    parser.add_argument('--pipe', action='store_true',
+                        help="常驻管道模式：从标准输入逐行读取 JSON 请求，向标准输出逐行写出 JSON 响应")
+    parser.add_argument('--outline', action='store_true',
+                        help="只提取标题大纲（级别、编号、标题、源行号），每个标题输出一行 JSON")
+    parser.add_argument('--check', action='store_true',
+                        help="只检查标题是否已按输出格式编号（转换不会改写任何标题行），报告不一致的行号，不输出转换结果")
+    parser.add_argument('--fail-fast', action='store_true',
+                        help="检查模式下每个文件在第一个不一致处停止")
+    parser.add_argument('--renumber', action='store_true',
+                        help="只重新编号：改写标题行的编号，其余内容（包括 Markdown 符号和段落换行）逐字节保留，文件扩展名不变")
+    parser.add_argument('--diff', action='store_true',
+                        help="只输出转换结果相对于源文件的补丁（统一差异格式，按源文件的编码和换行符），边转换边比较，写入 -o 指定的文件或标准输出")
+    parser.add_argument('--diff-context', type=int, default=3, metavar='N',
+                        help="补丁中每处变化前后保留的未变行数")
+    parser.add_argument('--normalize-width', action='store_true',
+                        help="匹配标题前先把全角字母、数字、标点统一为半角，（1) 1． 等混写也能识别")
+    parser.add_argument('--auto-rules', action='store_true',
+                        help="按每个文件自动识别的输入格式转换（输出格式仍取自配置）")
+    parser.add_argument('--encoding', help="输入文件编码（默认按文件内容自动识别 UTF-8/UTF-16/GBK 等）")
+    parser.add_argument('--output-encoding', default='utf-8', help="输出文件编码（默认 utf-8）")
+    parser.add_argument('-f', '--format', choices=list(OUTPUT_FILE_SUFFIXES), default='text',
+                        help="输出格式：纯文本、HTML（标题为 h1~h4）或 DOCX（标题使用标题样式）")
+    parser.add_argument('--split-sections', action='store_true',
+                        help="按一级标题把每个文档拆分为多个文件（文件名为序号和转换后的标题），编号跨文件连续")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="流水线批量转换：读取线程预读、-j 个转换进程、写出线程同时工作，结束时报告各阶段利用率")
+    parser.add_argument('--io-threads', type=int, default=2,
+                        help="流水线模式的读取线程数和写出线程数（各自）")
+    parser.add_argument('--queue', metavar='DIR',
+                        help="共享队列目录：多个进程（可在不同主机上）按锁文件领取同一批文件分工转换")
+    parser.add_argument('--claim-timeout', type=float, default=300.0,
+                        help="队列模式下锁文件超过多少秒未刷新即视为领取者已退出，任务被重新领取")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="并行进程数；大于 1 时大文档按标题行分片并行转换")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="性能分析：批量、队列、监视和管道模式下逐个文档（请求）把分析结果和规则配置写入 DIR")
+    parser.add_argument('--profile-mode', choices=PROFILE_MODES, default='cprofile',
+                        help="分析方式：cprofile 写出 .pstats，sample 采样调用栈写出火焰图用的 .collapsed（两者不同时运行）")
+    parser.add_argument('--diagnostics', action='store_true',
+                        help="图形界面诊断模式：监视主循环卡顿，记录卡顿时运行的处理函数，状态栏显示延迟直方图")
+    # macOS 从 Finder 启动时会附带 -psn_ 参数
+    argv = [arg for arg in argv if not arg.startswith('-psn_')]
+    return parser, parser.parse_args(argv)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser, args = parse_args(argv)
+    
+    if args.fail_fast and not args.check:
+        parser.error("--fail-fast 只用于检查模式 --check")
+    if args.watch:
+        # 监视模式按配置文件逐个重新转换变化的文件，其他模式和批量选项都不适用
+        unsupported = [flag for flag, used in (
+            ('--pipe', args.pipe), ('--detect', args.detect), ('--outline', args.outline),
+            ('--check', args.check), ('--renumber', args.renumber), ('--diff', args.diff),
+            ('--auto-rules', args.auto_rules), ('-j/--jobs', args.jobs > 1), ('--pipeline', args.pipeline),
+            ('--queue', args.queue), ('--split-sections', args.split_sections)) if used]
+        if unsupported:
+            parser.error(f"监视模式不支持 {'、'.join(unsupported)}")
+    
+    if args.pipe:
+        if args.inputs:
+            parser.error("管道模式不接受输入文件")
+        try:
+            input_rules, output_formats = load_rule_config(args.config)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        if args.normalize_width:
+            input_rules[NORMALIZE_WIDTH_KEY] = True
+        PipeService(input_rules, output_formats, jobs=args.jobs, profile_dir=args.profile,
+                    profile_mode=args.profile_mode).run()
+        return 0
+    
+    if not args.inputs:
+        if args.watch:
+            parser.error("监视模式需要指定输入目录")
+        run_gui(diagnostics=args.diagnostics)
+        return 0
+    
+    for name in filter(None, (args.encoding, args.output_encoding)):
+        try:
+            codecs.lookup(name)
+        except LookupError:
+            parser.error(f"未知的编码：{name}")
+    
+    if args.detect:
+        run_detect(args.inputs, args.encoding)
+        return 0
+    
+    try:
+        input_rules, output_formats = load_rule_config(args.config)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.normalize_width:
+        input_rules[NORMALIZE_WIDTH_KEY] = True
+    
+    if args.outline:
+        if args.output:
+            with atomic_output(args.output) as out:
+                run_outline(args.inputs, input_rules, output_formats, args.auto_rules, args.encoding, out)
+        else:
+            run_outline(args.inputs, input_rules, output_formats, args.auto_rules, args.encoding)
+        return 0
+    
+    if args.check:
+        failed = run_check(args.inputs, input_rules, output_formats, args.auto_rules, args.encoding, args.fail_fast)
+        return 1 if failed else 0
+    
+    if args.diff:
+        if args.watch or args.pipeline or args.queue or args.split_sections or args.renumber:
+            parser.error("补丁模式只支持普通批量模式")
+        if args.format != 'text':
+            parser.error("补丁模式只支持纯文本输出")
+        if args.output and (os.path.isdir(args.output) or is_archive_file(args.output)):
+            parser.error("补丁模式的 -o 为输出的补丁文件")
+        if args.output:
+            # 补丁按各源文件的编码写出，--output-encoding 不适用
+            with atomic_output(args.output, None) as out:
+                failures = run_diff(args.inputs, input_rules, output_formats, args.auto_rules, args.encoding,
+                                    args.diff_context, out)
+        else:
+            sys.stdout.flush()
+            failures = run_diff(args.inputs, input_rules, output_formats, args.auto_rules, args.encoding,
+                                args.diff_context)
+            sys.stdout.buffer.flush()
+        return 1 if failures else 0
+    
+    if args.renumber:
+        if args.watch or args.pipeline or args.queue or args.split_sections or args.format != 'text':
+            parser.error("重新编号模式只支持普通批量模式和纯文本输出")
+        if not args.output:
+            if len(args.inputs) != 1 or not os.path.isfile(args.inputs[0]):
+                parser.error("重新编号目录或多个文件时需要指定输出目录 -o")
+            converter = MarkdownConverter()
+            file_encoding, file_rules = resolve_file_plan(converter, args.inputs[0], input_rules,
+                                                          args.auto_rules, args.encoding)
+            sys.stdout.flush()
+            renumber_file(converter, args.inputs[0], sys.stdout.buffer, file_rules, output_formats, file_encoding)
+            sys.stdout.buffer.flush()
+            return 0
+        if any(is_archive_file(p) for p in args.inputs + [args.output]):
+            parser.error("重新编号模式不支持归档输入或输出")
+        failures = run_renumber(args.inputs, args.output, input_rules, output_formats,
+                                args.auto_rules, args.encoding)
+        return 1 if failures else 0
+    
+    if args.watch:
+        if not args.output:
+            parser.error("监视模式需要指定输出目录 -o")
+        if not all(os.path.isdir(p) for p in args.inputs):
+            parser.error("监视模式的输入必须是目录")
+        watcher = DirectoryWatcher(args.inputs, args.output, args.config,
+                                   interval=args.interval, use_inotify=not args.poll,
+                                   encoding=args.encoding, output_encoding=args.output_encoding,
+                                   output_format=args.format, normalize_width=args.normalize_width,
+                                   profile_dir=args.profile, profile_mode=args.profile_mode)
+        watcher.run()
+        return 0
+    
+    if args.queue and not args.output:
+        parser.error("队列模式需要指定输出目录 -o")
+    if args.split_sections:
+        if not args.output:
+            parser.error("分节输出需要指定输出目录 -o")
+        if args.pipeline or args.queue:
+            parser.error("流水线模式和队列模式不支持分节输出，请使用普通批量模式")
+    if args.profile and args.pipeline:
+        parser.error("流水线模式不支持性能分析，请使用普通批量模式")
+    if any(is_archive_file(p) for p in args.inputs + [args.output or '']):
+        if not args.output:
+            parser.error("归档输入需要指定输出目录或输出归档 -o")
+        if args.pipeline or args.queue:
+            parser.error("流水线模式和队列模式不支持归档输入或输出，请使用普通批量模式")
+    
+    if not args.output:
+        if len(args.inputs) != 1 or not os.path.isfile(args.inputs[0]):
+            parser.error("转换目录或多个文件时需要指定输出目录 -o")
+        src = args.inputs[0]
+        encoding, input_rules = resolve_file_plan(MarkdownConverter(), src, input_rules, args.auto_rules,
+                                                  args.encoding)
+        profiler = ConversionProfiler(args.profile, args.profile_mode) if args.profile else None
+        with profile_conversion(profiler, document_title(src), input_rules, output_formats, src):
+            sys.stdout.flush()
+            renderer_class = OUTPUT_RENDERERS[args.format]
+            if renderer_class.binary:
+                with open_text_input(src, encoding) as f:
+                    render_events(renderer_class(sys.stdout.buffer),
+                                  MarkdownConverter().iter_stream_events(f, input_rules, output_formats))
+                sys.stdout.buffer.flush()
+                return 0
+            out = io.TextIOWrapper(sys.stdout.buffer, encoding=args.output_encoding, errors='replace', newline='\n')
+            try:
+                if args.jobs > 1 and args.format == 'text' and not is_compressed_file(src):
+                    convert_file_parallel(src, out, input_rules, output_formats, args.jobs, encoding)
+                else:
+                    renderer = renderer_class(out, args.output_encoding, document_title(src))
+                    with open_text_input(src, encoding) as f:
+                        render_events(renderer, MarkdownConverter().iter_stream_events(f, input_rules, output_formats))
+            finally:
+                out.flush()
+                out.detach()
+            return 0
+    
+    if args.queue:
+        work_queue = SharedWorkQueue(args.queue, args.inputs, args.output, input_rules, output_formats,
+                                     jobs=args.jobs, auto_rules=args.auto_rules,
+                                     encoding=args.encoding, output_encoding=args.output_encoding,
+                                     output_format=args.format, claim_timeout=args.claim_timeout,
+                                     profile_dir=args.profile, profile_mode=args.profile_mode)
+        try:
+            failures = work_queue.run()
+        except KeyboardInterrupt:
+            return 130
+        return 1 if failures else 0
+    
+    if args.pipeline:
+        pipeline = BatchPipeline(input_rules, output_formats, jobs=args.jobs, io_threads=args.io_threads,
+                                 auto_rules=args.auto_rules, encoding=args.encoding,
+                                 output_encoding=args.output_encoding, output_format=args.format)
+        failures = pipeline.run(args.inputs, args.output)
+        return 1 if failures else 0
+    
+    failures = run_batch(args.inputs, args.output, input_rules, output_formats,
+                         jobs=args.jobs, auto_rules=args.auto_rules,
+                         encoding=args.encoding, output_encoding=args.output_encoding,
+                         output_format=args.format, split_sections=args.split_sections,
+                         profile_dir=args.profile, profile_mode=args.profile_mode)
+    return 1 if failures else 0
+
 if __name__ == "__main__":
-    main()
+    # 打包后的可执行文件使用进程池时需要
+    multiprocessing.freeze_support()
+    sys.exit(main())
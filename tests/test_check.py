@@ -0,0 +1,88 @@
+"""检查模式（--check）：报告编号与输出格式不一致的标题及其源行号，--fail-fast 时每个文件只报告第一处"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+# 输入规则能识别输出格式本身，已经按输出格式编号的文档才会被判为一致
+INPUT_RULES = {'level1': 'chinese_dot', 'level2': 'chinese_paren'}
+OUTPUT_FORMATS = {'level1': 'chinese', 'level2': 'chinese_paren', 'level3': 'number_dot', 'level4': 'number_paren'}
+
+BAD_LINES = [
+    '一、总则',
+    '正文第一段',
+    '（一）目的',
+    '（三）范围',       # 第 4 行：应为（二）
+    '',
+    '三、附则',         # 第 6 行：应为二、
+    '（一）说明',
+    '（一）重复',       # 第 8 行：应为（二）
+]
+
+GOOD_LINES = ['一、总则', '（一）目的', '（二）范围', '二、附则', '正文']
+
+
+class CheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmp, 'rules.json')
+        with open(self.config, 'w', encoding='utf-8') as f:
+            json.dump({'input_rules': INPUT_RULES, 'output_formats': OUTPUT_FORMATS}, f, ensure_ascii=False)
+        self.docs = os.path.join(self.tmp, 'docs')
+        os.makedirs(self.docs)
+        self.bad = self.write('bad.md', '\r\n'.join(BAD_LINES) + '\r\n')
+        self.good = self.write('good.md', '\n'.join(GOOD_LINES))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, text):
+        path = os.path.join(self.docs, name)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        return path
+
+    def check(self, inputs, fail_fast=False):
+        out = io.StringIO()
+        with redirect_stderr(io.StringIO()):
+            failed = mgc.run_check(inputs, INPUT_RULES, OUTPUT_FORMATS, fail_fast=fail_fast, out=out)
+        return failed, out.getvalue().splitlines()
+
+    def test_report_all(self):
+        failed, report = self.check([self.bad, self.good])
+        self.assertEqual(failed, 1)
+        self.assertEqual([line.split(': ', 1)[0] for line in report],
+                         [f'{self.bad}:4', f'{self.bad}:6', f'{self.bad}:8'])
+        self.assertIn('应为“（二）范围”，实际为“（三）范围”', report[0])
+        self.assertIn('应为“二、附则”，实际为“三、附则”', report[1])
+
+    def test_fail_fast_reports_first_per_file(self):
+        other = self.write('other.md', '二、错误开头\n（一）小节\n')
+        failed, report = self.check([self.bad, self.good, other], fail_fast=True)
+        self.assertEqual(failed, 2)
+        self.assertEqual([line.split(': ', 1)[0] for line in report], [f'{self.bad}:4', f'{other}:1'])
+
+    def test_consistent_file(self):
+        self.assertEqual(self.check([self.good]), (0, []))
+
+    def test_directory_exit_status(self):
+        command = ['--check', self.docs, '-c', self.config]
+        with redirect_stderr(io.StringIO()), redirect_stdout(io.StringIO()):
+            self.assertEqual(mgc.main(command), 1)
+        os.remove(self.bad)
+        with redirect_stderr(io.StringIO()), redirect_stdout(io.StringIO()):
+            self.assertEqual(mgc.main(command), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""可保留的清理阶段：保留某个阶段时对应的 Markdown 原样留下，其余阶段照常清理"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+# 阶段名 -> [(原文, 保留该阶段时的结果, 全部清理时的结果)]；
+# 全部清理时链接步骤先于图片步骤执行，图片会留下 !，这里不检查（None）
+CASES = {
+    'emphasis': [
+        ('这是**重点**内容', '这是**重点**内容', '这是重点内容'),
+        ('*斜体* 和 __粗体__ 及 _斜体_', '*斜体* 和 __粗体__ 及 _斜体_', '斜体 和 粗体 及 斜体'),
+        ('**含 # 号的粗体**', '**含  号的粗体**', '含  号的粗体'),
+    ],
+    'heading': [
+        ('## 小节', '## 小节', '小节'),
+        ('### **加粗的小节**', '### 加粗的小节', '加粗的小节'),
+    ],
+    'list': [
+        ('* 条目', '* 条目', '条目'),
+        ('- 条目 **粗**', '- 条目 粗', '条目 粗'),
+        ('1. 第一项', '1. 第一项', '第一项'),
+    ],
+    'link': [
+        ('见[说明](http://a/b)', '见[说明](http://a/b)', '见说明'),
+    ],
+    'image': [
+        ('图![示意](a.png)', '图![示意](a.png)', None),
+    ],
+    'code': [
+        ('运行 `a*b` 命令', '运行 `a*b` 命令', '运行 ab 命令'),
+    ],
+    'quote': [
+        ('> 引用的话', '> 引用的话', '引用的话'),
+    ],
+    'separator': [
+        ('---', '---', ''),
+    ],
+    'stray': [
+        ('C# 与 a*b', 'C# 与 a*b', 'C 与 ab'),
+    ],
+}
+
+
+class CleanStagesTest(unittest.TestCase):
+
+    def test_every_stage_has_cases(self):
+        self.assertEqual({stage for stage, _ in mgc.CLEAN_STAGES}, set(CASES))
+
+    def test_kept_stage(self):
+        for stage, cases in CASES.items():
+            clean = mgc.build_cleaner((stage,))
+            for text, kept, _ in cases:
+                with self.subTest(stage=stage, text=text):
+                    self.assertEqual(clean(text), kept)
+
+    def test_all_stages_cleaned(self):
+        clean = mgc.build_cleaner()
+        for stage, cases in CASES.items():
+            for text, _, cleaned in cases:
+                if cleaned is None:
+                    continue
+                with self.subTest(stage=stage, text=text):
+                    self.assertEqual(clean(text), cleaned)
+
+    def test_kept_emphasis_with_kept_link(self):
+        clean = mgc.build_cleaner(('emphasis', 'link'))
+        self.assertEqual(clean('**[链接](u)** 与 *x*'), '**[链接](u)** 与 *x*')
+
+    def test_converter_keeps_emphasis_in_body(self):
+        input_rules = {'level1': 'markdown_h1', mgc.CLEAN_KEEP_KEY: 'emphasis'}
+        output_formats = {'level1': 'chinese', 'level2': 'chinese_paren',
+                          'level3': 'number_dot', 'level4': 'number_paren'}
+        result = mgc.MarkdownConverter().convert_text('# 总则\n这是**重点**内容', input_rules, output_formats)
+        self.assertEqual(result, '一、总则\n这是**重点**内容')
+
+
+if __name__ == '__main__':
+    unittest.main()
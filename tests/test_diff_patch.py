@@ -0,0 +1,90 @@
+"""补丁模式（--diff）生成的补丁能用 patch(1) 直接应用到原文件上"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+RULES = {
+    'input_rules': {'level1': 'markdown_h1', 'level2': 'markdown_h2', 'level3': '', 'level4': ''},
+    'output_formats': {'level1': 'chinese', 'level2': 'chinese_paren',
+                       'level3': 'number_dot', 'level4': 'number_paren'},
+}
+
+SOURCE_LINES = [
+    '# 总则',
+    '已经转换好的正文',
+    '',
+    '## 目的',
+    '正文 **粗体** 第一行',
+    '第二行',
+    '',
+    '---',
+    '- 列表项',
+    '不变的一行',
+    '',
+    '# 附则',
+    '最后一行',
+]
+
+
+@unittest.skipUnless(shutil.which('patch'), "需要 patch(1)")
+class DiffPatchTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmp, 'rules.json')
+        with open(self.config, 'w', encoding='utf-8') as f:
+            json.dump(RULES, f, ensure_ascii=False)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    
+    def expected_lines(self):
+        input_rules, output_formats = mgc.rule_config_from_dict(RULES)
+        text = '\n'.join(SOURCE_LINES) + '\n'
+        return mgc.MarkdownConverter().convert_text(text, input_rules, output_formats).split('\n')
+    
+    def apply_diff(self, data):
+        """写入源文件，生成补丁并用 patch 应用，返回打过补丁的文件内容"""
+        src = os.path.join(self.tmp, 'doc.md')
+        with open(src, 'wb') as f:
+            f.write(data)
+        patch_path = os.path.join(self.tmp, 'doc.diff')
+        with redirect_stderr(io.StringIO()):
+            status = mgc.main([src, '--diff', '-c', self.config, '-o', patch_path])
+        self.assertEqual(status, 0)
+        for args in (['--dry-run'], []):
+            result = subprocess.run(['patch', '-p1', *args, '-i', patch_path], cwd=self.tmp,
+                                    capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        with open(src, 'rb') as f:
+            return f.read()
+    
+    def test_crlf_source(self):
+        data = '\r\n'.join(SOURCE_LINES).encode('utf-8') + b'\r\n'
+        expected = ''.join(line + '\r\n' for line in self.expected_lines()).encode('utf-8')
+        self.assertEqual(self.apply_diff(data), expected)
+    
+    def test_gbk_source(self):
+        data = '\n'.join(SOURCE_LINES).encode('gbk') + b'\n'
+        expected = ''.join(line + '\n' for line in self.expected_lines()).encode('gbk')
+        self.assertEqual(self.apply_diff(data), expected)
+    
+    def test_missing_final_newline(self):
+        data = '\n'.join(SOURCE_LINES).encode('utf-8')
+        expected = ''.join(line + '\n' for line in self.expected_lines()).encode('utf-8')
+        self.assertEqual(self.apply_diff(data), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
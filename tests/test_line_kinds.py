@@ -0,0 +1,89 @@
+"""NumPy 行分类预扫描（classify_lines）：给出行分类与逐行匹配的解析结果完全相同"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+OUTPUT_FORMATS = {'level1': 'number', 'level2': 'number_paren', 'level3': 'number_dot', 'level4': 'number_paren'}
+
+RULE_SETS = [
+    {'level1': 'markdown_h1', 'level2': 'markdown_h2', 'level3': 'markdown_h3', 'level4': 'markdown_h4'},
+    # 只启用部分 Markdown 级别：## 和 #### 开头的行不可能是标题
+    {'level1': 'markdown_h1', 'level2': 'markdown_h3', 'level3': '', 'level4': ''},
+    {'level1': 'chinese_dot', 'level2': 'chinese_paren', 'level3': 'number_period', 'level4': 'letter_paren'},
+    {'level1': 'markdown_h2', 'level2': 'chinese_paren', 'level3': 'letter_period', 'level4': 'number_dot',
+     mgc.NORMALIZE_WIDTH_KEY: True},
+    {'level1': 'roman_dot', 'level2': 'roman_paren', 'level3': 'dash', 'level4': 'asterisk',
+     mgc.CLEAN_KEEP_KEY: 'emphasis'},
+]
+
+LINES = [
+    '# 一级', '## 二级', '### 三级', '#### 四级', '##### 五个井号', '#没有空格', '#', '＃ 全角井号', '＃＃ 全角二级',
+    '一、章', '（一）节', '(一) 半角括号', '（Ⅱ）罗马', 'Ⅲ、罗马', '1. 条', '2、款', '(3) 项', '(A) 字母', 'B. 字母',
+    '（Ａ）全角字母', 'Ｃ. 全角', '１、全角数字', '- 列表', '* 星号', '+ 加号', '---', '***', '___',
+    '', '', '', '   ', '\t', '\r', '　全角空格开头', ' 不换行空格', '𠀀扩展区正文', '😀 表情',
+    '**粗体**开头', '> 引用', '`代码`', '[链接](u)', '![图](a.png)', '①圈号', 'abc 英文', 'Z', '!',
+]
+
+
+def random_lines(rnd):
+    lines = []
+    for _ in range(rnd.randint(1, 400)):
+        if rnd.random() < 0.5:
+            lines.append(f'正文 **{rnd.randint(0, 99)}** 内容' + rnd.choice(['', ' ', '  ', '\r']))
+        else:
+            lines.append(rnd.choice(LINES))
+    return lines
+
+
+class LineKindsTest(unittest.TestCase):
+
+    def setUp(self):
+        if mgc.np is None:
+            self.skipTest('NumPy 不可用')
+        self.converter = mgc.MarkdownConverter()
+
+    def test_parse_blocks_identical(self):
+        for trial in range(60):
+            rnd = random.Random(trial)
+            input_rules = RULE_SETS[trial % len(RULE_SETS)]
+            lines = random_lines(rnd)
+            text = '\n'.join(lines)
+            kinds = self.converter.classify_lines(text, input_rules)
+            self.assertIsNotNone(kinds)
+            self.assertEqual(len(kinds), len(lines))
+            with self.subTest(trial=trial, rules=trial % len(RULE_SETS)):
+                self.assertEqual(list(self.converter.parse_events(lines, input_rules, kinds)),
+                                 list(self.converter.parse_events(lines, input_rules)))
+
+    def test_fast_path_exercised(self):
+        lines = ['# 标题', '', '正文', '## 小节', '#####', '- 列表']
+        kinds = self.converter.classify_lines('\n'.join(lines), RULE_SETS[1]).tolist()
+        self.assertEqual(kinds, [mgc.LINE_FULL, mgc.LINE_BLANK, mgc.LINE_PLAIN,
+                                 mgc.LINE_PLAIN, mgc.LINE_PLAIN, mgc.LINE_FULL])
+
+    def test_match_anything_rules_not_classified(self):
+        input_rules = {'level1': 'markdown_h1', 'level2': 'plain_text'}
+        self.assertIsNone(self.converter.classify_lines('# 标题\n正文', input_rules))
+
+    def test_convert_text_with_and_without_numpy(self):
+        rnd = random.Random(0)
+        lines = []
+        while len(lines) < mgc.NUMPY_MIN_LINES * 2:
+            lines.extend(random_lines(rnd))
+        text = '\n'.join(lines)
+        without = mgc.MarkdownConverter()
+        without.use_numpy = False
+        for input_rules in RULE_SETS:
+            with self.subTest(rules=input_rules):
+                self.assertEqual(self.converter.convert_text(text, input_rules, OUTPUT_FORMATS),
+                                 without.convert_text(text, input_rules, OUTPUT_FORMATS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""大文档分片并行转换（-j）：任意级别的标题都可以作为分片起点，合并后与整篇转换结果相同"""
+
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+# 数字编号避免一百以上的中文数字
+OUTPUT_FORMATS = {'level1': 'number', 'level2': 'number_paren', 'level3': 'number_dot', 'level4': 'number_paren'}
+
+RULE_SETS = [
+    {'level1': 'markdown_h1', 'level2': 'markdown_h2', 'level3': 'markdown_h3', 'level4': 'markdown_h4'},
+    {'level1': 'chinese_dot', 'level2': 'chinese_paren', 'level3': 'number_period', 'level4': 'number_paren'},
+    # 所有其他非空行都是四级标题，分片几乎可以从任意一行开始
+    {'level1': 'markdown_h1', 'level2': 'markdown_h2', 'level3': 'markdown_h3', 'level4': 'plain_text'},
+]
+
+HEADINGS = {
+    0: {1: '# 标题{}', 2: '## 小节{}', 3: '### 条{}', 4: '#### 款{}'},
+    1: {1: '一、标题{}', 2: '（一）小节{}', 3: '1. 条{}', 4: '(1) 款{}'},
+    2: {1: '# 标题{}', 2: '## 小节{}', 3: '### 条{}', 4: '款{}'},
+}
+
+
+def random_document(rnd, rule_index):
+    level1_share = rnd.choice([0.0, 0.02, 0.2])
+    lines = []
+    for i in range(rnd.randint(1, 300)):
+        r = rnd.random()
+        if r < 0.3:
+            level = 1 if rnd.random() < level1_share else rnd.choice([2, 3, 3, 4, 4, 4])
+            lines.append(HEADINGS[rule_index][level].format(i))
+        elif r < 0.4:
+            lines.append('')
+        elif r < 0.45:
+            lines.append(rnd.choice(['---', '***', '  ----  ']))
+        elif r < 0.5:
+            lines.append(f'- 列表项 {i}')
+        else:
+            lines.append(f'正文 **{i}** 内容' + rnd.choice(['', ' ', '\r']))
+    return '\n'.join(lines) + rnd.choice(['', '\n'])
+
+
+class ParallelShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.min_shard = mgc.PARALLEL_MIN_SHARD
+
+    def tearDown(self):
+        mgc.PARALLEL_MIN_SHARD = self.min_shard
+        shutil.rmtree(self.tmp)
+
+    def test_sharded_output_matches_convert_text(self):
+        converter = mgc.MarkdownConverter()
+        path = os.path.join(self.tmp, 'doc.md')
+        multi_shard = 0
+        for trial in range(60):
+            rnd = random.Random(trial)
+            rule_index = trial % len(RULE_SETS)
+            input_rules = RULE_SETS[rule_index]
+            text = random_document(rnd, rule_index)
+            encoding = rnd.choice(['utf-8', 'utf-8-sig', 'gbk'])
+            with open(path, 'wb') as f:
+                f.write(text.encode(encoding))
+            mgc.PARALLEL_MIN_SHARD = rnd.choice([16, 64, 256])
+            jobs = rnd.choice([1, 2, 4])
+            shards = mgc.find_shard_boundaries(converter, path, input_rules,
+                                               max(1, min(jobs * 4, os.path.getsize(path) // mgc.PARALLEL_MIN_SHARD)),
+                                               encoding)
+            multi_shard += len(shards) > 1
+
+            out = io.StringIO()
+            mgc.convert_file_parallel(path, out, input_rules, OUTPUT_FORMATS, jobs, encoding)
+            normalized = text.replace('\r\n', '\n').replace('\r', '\n')
+            expected = converter.convert_text(normalized, input_rules, OUTPUT_FORMATS)
+            with self.subTest(trial=trial, rules=rule_index, encoding=encoding, shards=len(shards)):
+                self.assertEqual(out.getvalue(), expected + '\n' if expected else '')
+        # 确认确实测到了多分片的合并
+        self.assertGreater(multi_shard, 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
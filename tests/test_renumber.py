@@ -0,0 +1,92 @@
+"""重新编号模式（--renumber）：只改写标题行的编号，其余字节（换行符、BOM、无法解码的字节）原样保留"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+RULES = {
+    'input_rules': {'level1': 'markdown_h1', 'level2': 'markdown_h2', 'level3': '', 'level4': ''},
+    'output_formats': {'level1': 'chinese', 'level2': 'chinese_paren',
+                       'level3': 'number_dot', 'level4': 'number_paren'},
+}
+
+# (源行, 重新编号后的行)；正文行两者相同
+LINES = [
+    ('# 3. 旧编号', '# 一、旧编号'),
+    ('正文  有**粗体**  ', None),
+    ('', None),
+    ('  ## 缩进小节', '  ## （一）缩进小节'),
+    ('---', None),
+    ('- 列表 * 星号', None),
+    ('## （五）已有编号', '## （二）已有编号'),
+    ('\t缩进正文\t', None),
+    ('# 一、第二章', '# 二、第二章'),
+    ('   ', None),
+    ('最后一行', None),
+]
+
+
+class RenumberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmp, 'rules.json')
+        with open(self.config, 'w', encoding='utf-8') as f:
+            json.dump(RULES, f, ensure_ascii=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def renumber(self, data, *options):
+        src = os.path.join(self.tmp, 'doc.md')
+        dst = os.path.join(self.tmp, 'doc.out.md')
+        with open(src, 'wb') as f:
+            f.write(data)
+        with redirect_stderr(io.StringIO()):
+            self.assertEqual(mgc.main(['--renumber', src, '-o', dst, '-c', self.config, *options]), 0)
+        with open(dst, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def document(newline, encoding, final_newline=True, prefix=b'', extra=b''):
+        """返回 (源文件字节, 期望的输出字节)"""
+        source = newline.join(line for line, _ in LINES)
+        expected = newline.join(line if new is None else new for line, new in LINES)
+        if final_newline:
+            source += newline
+            expected += newline
+        return (prefix + source.encode(encoding) + extra,
+                prefix + expected.encode(encoding) + extra)
+
+    def test_crlf(self):
+        source, expected = self.document('\r\n', 'utf-8')
+        self.assertEqual(self.renumber(source), expected)
+
+    def test_bom_and_missing_final_newline(self):
+        source, expected = self.document('\n', 'utf-8', final_newline=False, prefix=b'\xef\xbb\xbf')
+        self.assertEqual(self.renumber(source), expected)
+
+    def test_gb18030(self):
+        source, expected = self.document('\r\n', 'gb18030', extra='㐀€ 扩展字符\r\n'.encode('gb18030'))
+        self.assertEqual(self.renumber(source, '--encoding', 'gb18030'), expected)
+
+    def test_undecodable_bytes_kept(self):
+        source, expected = self.document('\n', 'utf-8', extra=b'\xff\xfe bad \x80\n')
+        self.assertEqual(self.renumber(source, '--encoding', 'utf-8'), expected)
+
+    def test_already_numbered_document_unchanged(self):
+        _, expected = self.document('\r\n', 'utf-8', final_newline=False)
+        self.assertEqual(self.renumber(expected), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
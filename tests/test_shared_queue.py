@@ -0,0 +1,127 @@
+"""队列模式（--queue）：多个进程共用一个队列目录，每个文件只转换一次，过期的领取会被回收"""
+
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown_gui_custom as mgc
+
+RULES = {
+    'input_rules': {'level1': 'markdown_h1', 'level2': 'markdown_h2', 'level3': '', 'level4': ''},
+    'output_formats': {'level1': 'chinese', 'level2': 'chinese_paren',
+                       'level3': 'number_dot', 'level4': 'number_paren'},
+}
+
+WORKERS = 3
+DOCUMENTS = 30
+
+
+class SharedQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmp, 'rules.json')
+        with open(self.config, 'w', encoding='utf-8') as f:
+            json.dump(RULES, f, ensure_ascii=False)
+        self.src_dir = os.path.join(self.tmp, 'in')
+        self.out_dir = os.path.join(self.tmp, 'out')
+        self.queue_dir = os.path.join(self.tmp, 'queue')
+        os.makedirs(self.src_dir)
+        self.texts = {}
+        for n in range(DOCUMENTS):
+            text = f"# 文档{n}\n正文 {n}\n\n## 小节\n内容\n"
+            with open(os.path.join(self.src_dir, f'doc{n:02d}.md'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            self.texts[f'doc{n:02d}'] = text
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def plant_stale_claim(self, name):
+        """为一个任务留下心跳早已停止的锁文件，模拟领取后崩溃的进程"""
+        input_rules, output_formats = mgc.rule_config_from_dict(RULES)
+        work_queue = mgc.SharedWorkQueue(self.queue_dir, [self.src_dir], self.out_dir, input_rules, output_formats)
+        src = os.path.join(self.src_dir, name + '.md')
+        job_id = work_queue.job_id(src, os.path.join(self.out_dir, name + '.txt'))
+        claim = work_queue.path_for(work_queue.CLAIM_DIR, job_id)
+        os.makedirs(os.path.dirname(claim))
+        with open(claim, 'w', encoding='utf-8') as f:
+            json.dump({'worker': 'crashed-host:1', 'source': src, 'time': 0}, f)
+        stale = time.time() - 3600
+        os.utime(claim, (stale, stale))
+
+    def run_workers(self):
+        command = [sys.executable, mgc.__file__, self.src_dir, '-o', self.out_dir, '--queue', self.queue_dir,
+                   '-c', self.config, '--claim-timeout', '5']
+        workers = [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                   for _ in range(WORKERS)]
+        logs = []
+        for worker in workers:
+            _, err = worker.communicate(timeout=120)
+            self.assertEqual(worker.returncode, 0, err.decode('utf-8', 'replace'))
+            logs.append(err.decode('utf-8'))
+        return logs
+
+    def test_each_file_converted_once(self):
+        self.plant_stale_claim('doc07')
+        logs = self.run_workers()
+
+        converted = [line for log in logs for line in log.splitlines() if '已转换：' in line]
+        sources = sorted(re.search(r'已转换：(\S+) ->', line).group(1) for line in converted)
+        self.assertEqual(sources, sorted(os.path.join(self.src_dir, name + '.md') for name in self.texts))
+        totals = [int(re.search(r'本进程转换 (\d+) 个文件', log).group(1)) for log in logs]
+        self.assertEqual(sum(totals), DOCUMENTS)
+        self.assertIn('回收过期任务（原领取者 crashed-host:1）', ''.join(logs))
+
+        input_rules, output_formats = mgc.rule_config_from_dict(RULES)
+        converter = mgc.MarkdownConverter()
+        for name, text in self.texts.items():
+            with open(os.path.join(self.out_dir, name + '.txt'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), converter.convert_text(text, input_rules, output_formats) + '\n')
+        self.assertEqual(len(os.listdir(os.path.join(self.queue_dir, 'done'))), DOCUMENTS)
+        self.assertEqual(os.listdir(os.path.join(self.queue_dir, 'claims')), [])
+
+    def test_job_finished_by_another_worker_is_not_counted(self):
+        self.run_workers()
+        input_rules, output_formats = mgc.rule_config_from_dict(RULES)
+
+        class LateQueue(mgc.SharedWorkQueue):
+            """模拟竞争：领取前的检查还没看到完成记录，领取成功后才看到"""
+            seen = set()
+
+            def is_finished(self, job_id):
+                if job_id not in self.seen:
+                    self.seen.add(job_id)
+                    return False
+                return super().is_finished(job_id)
+
+        work_queue = LateQueue(self.queue_dir, [self.src_dir], self.out_dir, input_rules, output_formats)
+        log = io.StringIO()
+        with redirect_stderr(log):
+            failures = work_queue.run()
+        self.assertEqual(failures, 0)
+        self.assertIn('本进程转换 0 个文件，失败 0 个', log.getvalue())
+        self.assertNotIn('已转换：', log.getvalue())
+        src = os.path.join(self.src_dir, 'doc00.md')
+        dst = os.path.join(self.out_dir, 'doc00.txt')
+        self.assertIsNone(work_queue.process(work_queue.job_id(src, dst), src, dst))
+
+    def test_rerun_skips_finished_jobs(self):
+        self.run_workers()
+        logs = self.run_workers()
+        totals = [int(re.search(r'本进程转换 (\d+) 个文件', log).group(1)) for log in logs]
+        self.assertEqual(totals, [0] * WORKERS)
+
+
+if __name__ == '__main__':
+    unittest.main()